@@ -0,0 +1,225 @@
+"""Benchmarks of the emission calculations with synthetic events, results are written as json
+so that runs can be compared. Run it from the repository folder:
+
+    python -m benchmarks.run_benchmarks --scales 1000 10000 100000 --output benchmark_results.json
+    python -m benchmarks.run_benchmarks --compare previous_results.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic_events as sev
+from scripts import crop_ghg_emissions as ghg
+from scripts import emission_factors_mot as ef
+from scripts import soil_management as sme
+from scripts import soilgrid_functions as sgf
+
+KOPPEN_PATH = "climate_classification/world_climate_class_koppen.tif"
+CLIMATE_RASTERS = [KOPPEN_PATH, "climate_classification/world_climate_regions_Sayre.tif"]
+
+## pandas is imported before the clock starts, only the factor tables are timed
+FACTOR_IMPORT_CODE = ("import time; import pandas; start = time.perf_counter(); "
+                      "from scripts import emission_factors_mot as ef; ef.load_factor_tables(); "
+                      "print(time.perf_counter() - start)")
+## the rebuild writes a bundle in a temporary folder, the bundle of the repository is not touched
+FACTOR_REBUILD_CODE = ("import sys; import time; import pandas; "
+                       "from scripts import emission_factors_mot as ef; ef.FACTOR_BUNDLE_PATH = sys.argv[1]; "
+                       "start = time.perf_counter(); ef.load_factor_tables(rebuild=True); "
+                       "print(time.perf_counter() - start)")
+
+
+def time_call(function, repeats=1):
+    """wall time in seconds of each call, the printed messages are not shown"""
+    times = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+    return times
+
+
+def benchmark_result(name, times, n_events=None, mode=None, **info):
+    result = {'name': name, 'mode': mode, 'n_events': n_events,
+              'seconds': float(np.median(times)), 'min_seconds': float(np.min(times)),
+              'repeats': len(times), 'times': [float(i) for i in times]}
+    if n_events:
+        result['events_per_second'] = n_events / result['seconds']
+    result.update(info)
+
+    return result
+
+
+def factor_import_benchmarks(repeats=3):
+    """import of the factor tables in a new process from the bundle, and rebuild from the workbooks"""
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for mode, arguments in [('bundle', ['-c', FACTOR_IMPORT_CODE]),
+                                ('workbooks', ['-c', FACTOR_REBUILD_CODE,
+                                               os.path.join(temp_dir, 'factors_bundle.pkl')])]:
+            times = []
+            for _ in range(repeats):
+                output = subprocess.run([sys.executable] + arguments, check=True,
+                                        stdout=subprocess.PIPE, universal_newlines=True).stdout
+                times.append(float(output.strip().splitlines()[-1]))
+            results.append(benchmark_result('factor import', times, mode=mode))
+
+    return results
+
+
+def single_event_benchmark(general_info, fertilisers, repeats=3):
+    event_id = general_info.id_event.values[0]
+    subset_generalinfo = general_info.loc[general_info.id_event == event_id]
+    subset_fertilisers = fertilisers.loc[fertilisers.id_event == event_id]
+
+    times = time_call(lambda: ghg.event_emissions(event_id, subset_generalinfo, subset_fertilisers), repeats)
+
+    return benchmark_result('single event', times, n_events=1, mode='serial')
+
+
+def multiple_events_benchmarks(scales, seed=0, coordinates=True, max_serial_events=10000, n_workers=1):
+    """ghg_emissions.multiple_events for each number of events, the serial and pool modes are
+    only run up to max_serial_events"""
+    results = []
+    for n_events in scales:
+        general_info, fertilisers = sev.synthetic_events(n_events, seed=seed, coordinates=coordinates)
+        modes = [('vectorized', {'vectorized': True})]
+        if n_events <= max_serial_events:
+            modes.insert(0, ('serial', {}))
+            if n_workers > 1:
+                modes.append(('pool', {'n_workers': n_workers}))
+
+        for mode, options in modes:
+            times = time_call(lambda: ghg.ghg_emissions(general_info, fertilisers, **options))
+            results.append(benchmark_result('multiple events', times, n_events=n_events, mode=mode,
+                                            n_fertiliser_rows=fertilisers.shape[0], **options))
+
+    return results
+
+
+def raster_sampling_benchmarks(n_points=200, seed=0, climate_rasters=True):
+    """pixel values of random points in the local climate rasters"""
+    rng = np.random.default_rng(seed)
+    longitude = rng.uniform(-79.0, -67.0, n_points)
+    latitude = rng.uniform(-4.0, 12.0, n_points)
+
+    def sample_koppen():
+        for lon, lat in zip(longitude, latitude):
+            sgf.getCoordinatePixel(KOPPEN_PATH, lon, lat)
+
+    results = [benchmark_result('raster sampling', time_call(sample_koppen), n_events=n_points, mode='koppen')]
+    results.append(benchmark_result('raster sampling',
+                                    time_call(lambda: sgf.sample_coordinates(KOPPEN_PATH, longitude, latitude)),
+                                    n_events=n_points, mode='koppen points'))
+    if climate_rasters:
+        def sample_climate():
+            for lon, lat in zip(longitude, latitude):
+                sme.get_climate_fromlayers(lon, lat)
+
+        results.append(benchmark_result('raster sampling', time_call(sample_climate), n_events=n_points,
+                                        mode='climate layers'))
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales=(1000, 10000, 100000), seed=0, repeats=3, max_serial_events=10000, n_workers=1,
+                   raster_points=200):
+    """run every benchmark
+
+    :param scales: numbers of events for multiple_events
+    :param seed: seed of the synthetic events
+    :param repeats: repetitions of the short benchmarks, the median time is reported
+    :param max_serial_events: largest number of events that is gauged one event at a time
+    :param n_workers: processes of the pool mode, it is not run with one worker
+    :param raster_points: number of points sampled from the rasters
+    :return: dict with the run metadata and a list of results
+    """
+    ## the climate regions raster is not part of the repository, events get no coordinates without it
+    climate_rasters = all(os.path.exists(i) for i in CLIMATE_RASTERS)
+    general_info, fertilisers = sev.synthetic_events(10, seed=seed, coordinates=climate_rasters)
+
+    results = factor_import_benchmarks(repeats)
+    results.append(single_event_benchmark(general_info, fertilisers, repeats))
+    results.extend(multiple_events_benchmarks(scales, seed, climate_rasters, max_serial_events, n_workers))
+    results.extend(raster_sampling_benchmarks(raster_points, seed, climate_rasters))
+
+    metadata = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'cpu_count': os.cpu_count(),
+                'seed': seed,
+                'climate_rasters': climate_rasters,
+                'factor_bundle_version': ef.FACTOR_BUNDLE_VERSION}
+
+    return {'metadata': metadata, 'results': results}
+
+
+def compare_results(previous, current):
+    """time ratio of the current run over a previous one for each benchmark
+
+    :param previous: dict or json path of a previous run
+    :param current: dict or json path of the current run
+    :return: pandas dataframe, ratios above 1 are slower than before
+    """
+    runs = []
+    for run in [previous, current]:
+        if isinstance(run, str):
+            with open(run) as run_file:
+                run = json.load(run_file)
+        runs.append(pd.DataFrame(run['results']).set_index(['name', 'mode', 'n_events']).seconds)
+
+    comparison = pd.concat(runs, axis=1, keys=['previous', 'current'], join='inner')
+    comparison['ratio'] = comparison.current / comparison.previous
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ghg emissions benchmarks with synthetic events")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="numbers of events for multiple_events")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-serial-events', type=int, default=10000,
+                        help="largest number of events that is gauged one event at a time")
+    parser.add_argument('--workers', type=int, default=1, help="processes of the pool mode")
+    parser.add_argument('--raster-points', type=int, default=200)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help="json file of a previous run")
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.scales, args.seed, args.repeats, args.max_serial_events, args.workers,
+                         args.raster_points)
+    with open(args.output, 'w') as output_file:
+        json.dump(run, output_file, indent=2)
+
+    print(pd.DataFrame(run['results'])[['name', 'mode', 'n_events', 'seconds']].to_string(index=False))
+    if args.compare is not None:
+        print(compare_results(args.compare, run).to_string())
+
+
+if __name__ == '__main__':
+    main()
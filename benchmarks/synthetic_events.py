@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from scripts import emission_factors_mot as ef
+from scripts import translations as tl
+
+## products and crops that are kept out of the synthetic events
+EXCLUDED_NAMES = ['ninguno', 'otro', 'otros', 'none', 'other', 'others']
+
+## organic products are applied in larger amounts and for some years
+ORGANIC_AMOUNT_KG_HA = (200, 3000)
+SYNTHETIC_AMOUNT_KG_HA = (20, 400)
+
+
+def option_names(options, language="spanish"):
+    """options of a translations list in the input language"""
+    return list(options[0] if language == "spanish" else options[1])
+
+
+def valid_crops(language="spanish"):
+    """crops that are found in both the crop and the residue amount factor tables, with all their factors"""
+    col_name = "crop_spanish" if language == "spanish" else "Crop"
+    residue_crops = ef.ramount_factors_index[col_name]
+
+    return [crop for crop in ef.crop_factors_index[col_name]
+            if crop in residue_crops and not pd.isnull(list(residue_crops[crop])).any() and
+            crop == crop.strip() and crop not in EXCLUDED_NAMES]
+
+
+def valid_fertilisers(language="spanish"):
+    """fertiliser products of the factor table that have nutrient contents, and production
+    factors when they are synthetic, with their type"""
+    col_name = 'fertiliser_sp' if language == "spanish" else 'fertiliser_eng'
+    products = ef.fertilizers_factors.loc[ef.fertilizers_factors[col_name].map(lambda i: isinstance(i, str))]
+    products = products.loc[products.N.notnull() & ~products[col_name].str.lower().isin(EXCLUDED_NAMES)]
+    products = products.loc[products['type'].notnull() | products[['Europe', 'Other', 'China']].notnull().all(axis=1)]
+    products = products.drop_duplicates(col_name)
+
+    return pd.DataFrame({'product': products[col_name].values,
+                         'organic': products['type'].notnull().values})
+
+
+def synthetic_events(n_events, seed=None, language="spanish", max_fertilisers=5, rice_share=0.1,
+                     soil_type_share=0.3, coordinates=True, bounds=(-79.0, -67.0, -4.0, 12.0)):
+    """Generate general information and fertiliser tables of realistic cropping events. Every
+    option is taken from translations and the factor tables, and the soil properties are always
+    given, so the events can be gauged without downloading soilgrid data.
+
+    :param n_events: number of events
+    :param seed: seed of the random generator
+    :param language: language of the options
+    :param max_fertilisers: maximum number of fertiliser rows of an event
+    :param rice_share: share of rice events
+    :param soil_type_share: share of events whose soil is given by a soil type instead of its properties
+    :param coordinates: when False the coordinates are left empty and the climate rasters are not used
+    :param bounds: minimum longitude, maximum longitude, minimum latitude and maximum latitude
+    :return: list: general information and fertiliser pandas dataframes
+    """
+
+    rng = np.random.default_rng(seed)
+
+    def pick(options, size=n_events):
+        return np.array(options, dtype=object)[rng.integers(len(options), size=size)]
+
+    crops = valid_crops(language)
+    rice_crop = "arroz" if language == "spanish" else "rice"
+    crops = [crop for crop in crops if crop != rice_crop]
+    crop = pick(crops)
+    rice_events = rng.random(n_events) < rice_share
+    crop[rice_events] = rice_crop
+
+    ## the soil type takes the place of texture and properties
+    soil = np.where(rng.random(n_events) < soil_type_share, pick(option_names(tl.soil_type, language)), np.nan)
+    if coordinates:
+        longitude = rng.uniform(bounds[0], bounds[1], n_events)
+        latitude = rng.uniform(bounds[2], bounds[3], n_events)
+    else:
+        longitude = latitude = np.full(n_events, np.nan)
+
+    luc = np.where(rng.random(n_events) < 0.2, pick(option_names(tl.luc_options, language)[:4]), np.nan)
+    missing = np.full(n_events, np.nan, dtype=object)
+    sowing_date = pd.to_datetime('2020-01-01') + pd.to_timedelta(rng.integers(0, 180, n_events), 'D')
+
+    general_info = pd.DataFrame({
+        'id_event': ['event_{}'.format(i) for i in range(n_events)],
+        'country': 'colombia',
+        'municipality': pick(['cundinamarca', 'nariño', 'tolima', 'meta', 'valle del cauca']),
+        'longitude': longitude,
+        'latitude': latitude,
+        'luc': luc,
+        'luc_time': np.where(pd.isnull(luc), np.nan, rng.integers(1, 40, n_events)),
+        'climate': missing,
+        'crop': crop,
+        'soil': soil,
+        'soil_texture': pick(option_names(tl.soil_texture, language)),
+        'soil_organic_content': np.round(rng.uniform(0.5, 6, n_events), 2),
+        'soil_n_content': np.round(rng.uniform(0.02, 0.5, n_events), 3),
+        'soil_pH': np.round(rng.uniform(4.5, 8.5, n_events), 1),
+        'bulk_density': np.round(rng.uniform(1.0, 1.6, n_events), 2),
+        'tillage_input': pick(option_names(tl.tillage_options, language)),
+        'time_using_tillage_system': rng.integers(1, 30, n_events),
+        'crop_cover': pick(option_names(tl.cover_crop_options, language)),
+        'time_using_crop_cover': rng.integers(1, 30, n_events).astype(float),
+        'residues_input': pick(['quema', 'no'] if language == "spanish" else ['burning', 'no']),
+        'crop_yield_kg_ha': rng.integers(1000, 10000, n_events),
+        'specific_climate_for_rice': missing,
+        'sowing_date': sowing_date,
+        'harvest_date': sowing_date + pd.to_timedelta(rng.integers(90, 180, n_events), 'D'),
+        'water_regime': missing,
+        'pre_water_regime': missing})
+
+    ## rice factors, the fifth specific climate option has no factor in the rice tables
+    n_rice = int(rice_events.sum())
+    rice_climates = option_names(tl.specific_climate_rice_options, language)
+    rice_climates = [option for i, option in enumerate(rice_climates) if i != 4]
+    general_info.loc[rice_events, 'specific_climate_for_rice'] = pick(rice_climates, n_rice)
+    general_info.loc[rice_events, 'water_regime'] = pick(option_names(tl.rice_water_regime_options, language),
+                                                         n_rice)
+    general_info.loc[rice_events, 'pre_water_regime'] = pick(
+        option_names(tl.rice_prewater_regime_options, language), n_rice)
+
+    ## fertilisers, every event has at least one product
+    products = valid_fertilisers(language)
+    n_products = rng.integers(1, max_fertilisers + 1, n_events)
+    product_rows = rng.integers(products.shape[0], size=n_products.sum())
+    organic = products.organic.values[product_rows]
+    amounts = np.where(organic, rng.uniform(*ORGANIC_AMOUNT_KG_HA, len(product_rows)),
+                       rng.uniform(*SYNTHETIC_AMOUNT_KG_HA, len(product_rows)))
+    inhibitors = option_names([['No inhibitors', 'Nitrification inhibitors', 'Polymer-coated fertiliser']] * 2)
+
+    fertilisers = pd.DataFrame({
+        'id_event': np.repeat(general_info.id_event.values, n_products),
+        'fertliser_product': products['product'].values[product_rows],
+        'amount_kg_ha': np.round(amounts),
+        'inhibitor': np.where(organic, inhibitors[0], pick(inhibitors, len(product_rows))),
+        'production_country': pick(option_names(tl.prod_country_options, language), len(product_rows)),
+        'years_using_the_fertlizer': np.where(organic, rng.integers(1, 30, len(product_rows)), np.nan)})
+
+    return [general_info, fertilisers]
@@ -0,0 +1,675 @@
+import numpy as np
+import pandas as pd
+
+from scripts import soil_management as sme
+from scripts import climate_grid as cg
+from scripts import soilgrid_functions as sgf
+from scripts import fertiliser_practices as fp
+from scripts import fertiliser_functions as ff
+from scripts import rice_estimations as rice
+from scripts import emission_factors_mot as ef
+from scripts import translations as tl
+from scripts import stage_timing as st
+
+
+def lower_values(values):
+    """lower case for the string values of a pandas series, other values are kept"""
+    return values.map(lambda i: i.lower() if isinstance(i, str) else i)
+
+
+def map_unique(values, function):
+    """apply a scalar function once for each distinct value of a pandas series"""
+    codes, uniques = pd.factorize(values)
+    ## the last position is kept for missing values
+    results = np.empty(len(uniques) + 1, dtype=object)
+    for i, value in enumerate(uniques):
+        results[i] = function(value)
+    if (codes == -1).any():
+        results[-1] = function(np.nan)
+
+    return pd.Series(results[codes], index=values.index)
+
+
+def translate_options(values, options, language="spanish"):
+    """translate the user options into the english ones used by the factor tables,
+    values that are not available in the options are returned as nan"""
+    if language == "spanish":
+        input_options = [i.lower() for i in options[0]]
+    else:
+        input_options = [i.lower() for i in options[1]]
+    translation = {}
+    for i, option in enumerate(input_options):
+        translation.setdefault(option, options[1][i])
+
+    return lower_values(values).map(translation)
+
+
+def bouwman_climate(climate, climates_in_table):
+    """climate classes that are not available in a factor table are replaced by bouwman's classes"""
+    bouwman_classes = dict(zip(tl.world_climate_bouwman[0], tl.world_climate_bouwman[1]))
+    return climate.map(lambda i: i if i.lower() in climates_in_table else bouwman_classes.get(i, np.nan))
+
+
+def cumulative_socemissions_for_20years(years_usingtec, factor_20years, soil_c_stock):
+    """vectorized version of soil_management.cumulative_socemissions_for_20years"""
+    years_usingtec = np.asarray(years_usingtec, dtype=float)
+    factor_20years = np.asarray(factor_20years, dtype=float)
+
+    cumulative_20_years = np.where(factor_20years == 1, 0,
+                                   (-1 * soil_c_stock * (factor_20years - 1)) * (44 / 12))
+    cumulative_20_years = np.where(years_usingtec < 20, cumulative_20_years, 0)
+
+    return [cumulative_20_years / 20, cumulative_20_years]
+
+
+def classify_values(values, thresholds, classes):
+    """classes for numeric values given ascending thresholds, nan values take the last class"""
+    values = np.asarray(values, dtype=float)
+    conditions = [values < i for i in thresholds]
+
+    return np.select(conditions, classes[:-1], classes[-1])
+
+
+def classify_factors(values, thresholds, classes, factors_index):
+    """factor of the class of each value, it works for arrays of any shape,
+    nan values take the last class as classify_values does"""
+    values = np.asarray(values, dtype=float)
+    class_factors = np.array([factors_index.get(i, np.nan) for i in classes], dtype=float)
+    conditions = [values < i for i in thresholds]
+
+    return class_factors[np.select(conditions, list(range(len(thresholds))), len(thresholds))]
+
+
+def get_climate_fromcoordinates(longitude, latitude):
+    """mot climate classification for each pair of coordinates, all the coordinates are
+    sampled at once and each distinct pair of layer values is only classified once"""
+    climate = pd.Series('temperate continental', index=longitude.index, dtype=object)
+    withcoordinates = longitude.notnull() & latitude.notnull()
+    if not withcoordinates.any():
+        return climate
+
+    grid = cg.load_climate_grid()
+    if grid is not None:
+        with st.stage('climate grid'):
+            climate[withcoordinates] = grid.climate_classes(longitude[withcoordinates].values,
+                                                            latitude[withcoordinates].values)
+        return climate
+
+    koppen, cliregion = sme.get_climate_fromlayers_points(longitude[withcoordinates].values,
+                                                          latitude[withcoordinates].values)
+    layer_values = pd.Series(list(zip(koppen, cliregion)), index=longitude.index[withcoordinates], dtype=object)
+    climate[withcoordinates] = map_unique(layer_values, sme.mot_climate_classification)
+
+    return climate
+
+
+def soil_properties(events, language="spanish"):
+    """soil texture, organic carbon, nitrogen, pH and bulk density of each event, given by
+    its soil type or by its own values"""
+    soil = pd.DataFrame(index=events.index)
+    soil_type = lower_values(events.soil)
+    if language == "spanish":
+        option_column = "sp_options"
+        soil_type_options = [i.lower() for i in tl.soil_type[0]]
+        soil_text_options = [i.lower() for i in tl.soil_texture[0]]
+    else:
+        option_column = "eng_options"
+        soil_type_options = [i.lower() for i in tl.soil_type[1]]
+
+    by_soiltype = soil_type.notnull()
+    known_soiltype = by_soiltype & soil_type.isin(soil_type_options)
+    properties = pd.DataFrame(
+        list(soil_type[known_soiltype].map(ef.soil_properties_index[option_column])),
+        index=soil_type.index[known_soiltype],
+        columns=['soil_texture', 'soil_organic_c', 'n_content', 'pH_content', 'soil_bulk_density'])
+
+    soil_texture = events.soil_texture.astype(object)
+    if language == "spanish":
+        soil_texture = soil_texture.map(
+            lambda i: tl.soil_texture[1][soil_text_options.index(i.lower())] if i in soil_text_options else "medium")
+
+    soil['soil_texture'] = soil_texture.where(~by_soiltype, np.nan)
+    soil['soil_organic_c'] = events.soil_organic_content.astype(float).where(~by_soiltype, np.nan)
+    soil['n_content'] = events.soil_n_content.astype(float).where(~by_soiltype, np.nan)
+    soil['pH_content'] = events.soil_pH.astype(float).where(~by_soiltype, np.nan)
+    soil['soil_bulk_density'] = events.bulk_density.astype(float).where(~by_soiltype, np.nan)
+    ## the soil type values replace the individual ones, update also takes an empty selection
+    soil.update(properties)
+
+    return soil
+
+
+def soilgrid_layer_coordinates(soil, longitude, latitude):
+    """coordinates where each soilgrid layer is drawn by soilgrid_soil_properties, for the events
+    whose soil carbon stock can not be calculated from their soil properties
+
+    :return: dict: soilgrid layer and [longitudes, latitudes]
+    """
+    fromsoilgrid = (soil.soil_organic_c.isnull() | soil.soil_bulk_density.isnull()) & \
+        longitude.notnull() & latitude.notnull()
+    layers = {}
+    for layer, drawn in [["Soil organic carbon stock", fromsoilgrid],
+                         ["Bulk density", fromsoilgrid],
+                         ["Nitrogen", fromsoilgrid & soil.n_content.isnull()],
+                         ["pH water", fromsoilgrid & soil.pH_content.isnull()],
+                         ["Organic carbon density", fromsoilgrid]]:
+        if drawn.any():
+            layers[layer] = [longitude[drawn].values, latitude[drawn].values]
+
+    return layers
+
+
+def prefetch_soilgrid_tiles(general_info, language="spanish"):
+    """download at once the soilgrid tiles that the events need and are not in the cache,
+    so events gauged one at a time do not wait for each download"""
+    events = general_info.reset_index(drop=True)
+    layers = soilgrid_layer_coordinates(soil_properties(events, language), pd.to_numeric(events.longitude),
+                                        pd.to_numeric(events.latitude))
+    if len(layers) > 0:
+        sgf.fetch_soilgrid_tiles(layers)
+
+
+@st.timed('soil context')
+def soil_context(general_info, language="spanish"):
+    """Get the soil and climate attributes of each event as columns, it follows the same
+    rules as soil_management.soil_management_emissions
+
+    :param general_info: pandas dataframe with one row per event
+    :param language: language used in the input options
+    :return: pandas dataframe
+    """
+
+    events = general_info.reset_index(drop=True)
+    context = pd.DataFrame(index=events.index)
+    context['crop'] = events.crop
+    context['crop_yield_kg_ha'] = events.crop_yield_kg_ha.astype(float)
+    longitude = pd.to_numeric(events.longitude)
+    latitude = pd.to_numeric(events.latitude)
+    context['climate'] = get_climate_fromcoordinates(longitude, latitude)
+
+    ## soil properties by soil type or by individual values
+    soil = soil_properties(events, language)
+    for column in soil.columns:
+        context[column] = soil[column]
+
+    ## soil carbon stock, missing values are drawn from soilgrid
+    context['soil_c_stock'] = (10000 * 0.3 * context.soil_organic_c * context.soil_bulk_density / 100 * 1000)
+    fromsoilgrid = context.soil_organic_c.isnull() | context.soil_bulk_density.isnull()
+    layers = soilgrid_layer_coordinates(soil, longitude, latitude)
+    if len(layers) > 0:
+        ## the missing tiles of all the events are downloaded at once
+        sgf.fetch_soilgrid_tiles(layers)
+    for i in context.index[fromsoilgrid]:
+        context.loc[i, ['soil_c_stock', 'soil_bulk_density',
+                        'n_content', 'pH_content', 'soil_organic_c']] = sme.soilgrid_soil_properties(
+            longitude[i], latitude[i], context.n_content[i], context.pH_content[i])
+
+    climate = context.climate
+    ## tillage
+    context['til_eng_input'], context['tillage_soc_change'] = tillage_soc_change(
+        events.tillage_input, events.time_using_tillage_system, climate, context.soil_c_stock, language)
+
+    ## cover crop
+    crop_cover = events.crop_cover.astype(object).where(events.crop_cover.notnull(), "nan")
+    context['cc_eng_input'] = translate_options(crop_cover, tl.cover_crop_options, language)
+    years_cropcover_tech = events.time_using_crop_cover.astype(float)
+    covercrop_climate = bouwman_climate(climate, ef.cover_cropping_climates)
+    covercrop_factor = [ef.cover_cropping_index.get((cl.lower(), cc.lower()), 1)
+                        if isinstance(cc, str) else 1
+                        for cl, cc in zip(covercrop_climate, context.cc_eng_input)]
+    cover_crop_soc_change = cumulative_socemissions_for_20years(years_cropcover_tech.fillna(10), covercrop_factor,
+                                                                context.soil_c_stock)[0]
+    context['cover_crop_soc_change'] = np.where(context.cc_eng_input.notnull(), cover_crop_soc_change, 0)
+
+    ## land use change
+    luc_eng_input = translate_options(events.luc, tl.luc_options, language)
+    luc_factor = []
+    for cl, luc in zip(climate, luc_eng_input):
+        if isinstance(luc, str):
+            change_nr = ef.luc_options[luc][0]
+            if (change_nr, cl.lower()) not in ef.luc_factors_index:
+                cl = tl.world_climate_bouwman[1][tl.world_climate_bouwman[0].index(cl)]
+            luc_factor.append(ef.luc_factors_index.get((change_nr, cl.lower()), np.nan))
+        else:
+            luc_factor.append(np.nan)
+    luc_effect_on_soil = cumulative_socemissions_for_20years(events.luc_time.astype(float), luc_factor,
+                                                             context.soil_c_stock)[0]
+    ## luc options that are not available can not be estimated
+    context['luc_effect_on_soil'] = np.where(events.luc.isnull(), 0,
+                                             np.where(luc_eng_input.notnull(), luc_effect_on_soil, np.nan))
+
+    ## soil factors
+    context['ph_attribute'] = classify_values(context.pH_content, [5.5, 7.3, 8.5],
+                                              ['less than 5.5', '5.5-7.3', '7.3-8.5', 'more than 8.5'])
+    texture = context.soil_texture.map(lambda i: i.capitalize() if isinstance(i, str) else i)
+    climate_capitalized = climate.map(lambda i: i.capitalize())
+
+    context['soc_n2o'] = pd.Series(classify_values(context.soil_organic_c, [1.0, 3.0],
+                                                   ['less than 1.0', '1.0-3.0', 'more than 3.0'])).map(ef.n2o_soc_index)
+    context['n_no'] = pd.Series(classify_values(context.n_content, [0.05, 0.2],
+                                                ['less than 0.05', '0.05-0.2', 'more than 0.2'])).map(ef.n_no_index)
+    context['pH_n2o'] = context.ph_attribute.map(ef.pH_n2o_index)
+    context['pH_nh3'] = context.ph_attribute.map(ef.pH_nh3_index)
+    context['texture_n2o'] = texture.map(ef.texture_n2o_index)
+    climate_n2o_no = climate_capitalized.map(ef.climate_n2o_no_index)
+    context['climate_n2o'] = climate_n2o_no.map(lambda i: i[0] if isinstance(i, tuple) else np.nan)
+    context['climate_no'] = climate_n2o_no.map(lambda i: i[1] if isinstance(i, tuple) else np.nan)
+    context['climate_nh3'] = climate_capitalized.map(ef.climate_nh3_index)
+
+    ## crop factors
+    col_name = "crop_spanish" if language == "spanish" else "Crop"
+    crop_factors = ef.crop_factors_index[col_name]
+    other_bouwman = ef.crop_factors_index["crop_spanish"]['otro'][0]
+    crop = lower_values(events.crop)
+    crop_factor_values = crop.map(lambda i: crop_factors.get(i, (other_bouwman, np.nan, np.nan)))
+    bouwman_equi = lower_values(crop_factor_values.map(lambda i: i[0]))
+    context['crop_nh3'] = bouwman_equi.map(ef.crop_nh3_index)
+    context['crop_n2o'] = bouwman_equi.map(ef.cropbouwman_n2o_index)
+    context['crop_ncontent'] = crop_factor_values.map(lambda i: i[1]).astype(float)
+    context['crop_harvestmoist'] = crop_factor_values.map(lambda i: i[2]).astype(float)
+
+    ## cec
+    ph_valueforcec = context.ph_attribute.map(ef.cec_factors_index).astype(float)
+    texture_factorforcec = texture.map(ef.cec_factors_index).astype(float)
+    bulk_density = np.where(context.soil_bulk_density != 0, context.soil_bulk_density, 1)
+    context['soil_cec'] = ((-59 + 51 * ph_valueforcec) * context.soil_c_stock / 3000000 / bulk_density +
+                           (30 + 4.4 * ph_valueforcec) * texture_factorforcec)
+    context['cec_nh3'] = pd.Series(classify_values(context.soil_cec, [16, 24, 32],
+                                                   ['less than 16', '16-24', '24-32', 'more than 32'])
+                                   ).map(ef.cec_nh3_index)
+
+    ## burning residues
+    context['burning_residues'] = burning_residues(events.crop, context.crop_yield_kg_ha,
+                                                   events.residues_input, language)
+
+    return context
+
+
+def tillage_soc_change(tillage_input, years_tillage_tech, climate, soil_c_stock, language="spanish"):
+    """english tillage options and annual soil organic carbon change by tillage,
+    see soil_management.soil_management_emissions.tillage_technology"""
+    tillage_input = tillage_input.astype(object).where(tillage_input.notnull(), "na")
+    til_eng_input = translate_options(tillage_input, tl.tillage_options, language)
+    tillage_climate = bouwman_climate(climate, ef.tillage_climates)
+    tillage_factor = [ef.tillage_factors_index.get((cl.lower(), 'conventional tillage', till.lower()), 1)
+                      if isinstance(till, str) else 1
+                      for cl, till in zip(tillage_climate, til_eng_input)]
+    soc_change = cumulative_socemissions_for_20years(years_tillage_tech.astype(float).fillna(10), tillage_factor,
+                                                     soil_c_stock)[0]
+
+    return [til_eng_input, np.where(til_eng_input.notnull(), soc_change, 0)]
+
+
+def burning_residues(crop, crop_yield_kg_ha, residues_input, language="spanish"):
+    """co2 equivalent emissions by burning crop residues,
+    see soil_management.soil_management_emissions.burning_residues"""
+    burningN2O_emissions_kg, burningCH4_emissions_kg = burning_residues_kg(crop, crop_yield_kg_ha,
+                                                                           residues_input, language)
+
+    return burningN2O_emissions_kg * ef.pc_N2O_MOT + burningCH4_emissions_kg * ef.pc_CH4
+
+
+def burning_residues_kg(crop, crop_yield_kg_ha, residues_input, language="spanish"):
+    """kg of n2o and ch4 emitted by burning crop residues"""
+    col_name = "crop_spanish" if language == "spanish" else "Crop"
+    ramount_factors = lower_values(crop).map(
+        lambda i: ef.ramount_factors_index[col_name].get(i, (np.nan, np.nan, np.nan, np.nan)))
+    slope_above_ground, drymatter_factor, intercept_factor = [ramount_factors.map(lambda i: i[j]).astype(float)
+                                                              for j in range(3)]
+    above_residues = crop_yield_kg_ha / 1000 * slope_above_ground * drymatter_factor + intercept_factor
+    burning = residues_input.isin(["quema", "burning"])
+    burningCH4_emissions_kg = np.where(burning, above_residues * (ef.burned_CH4factor / 1000) * 1000, 0)
+    burningN2O_emissions_kg = np.where(burning, above_residues * (ef.burned_N2Ofactor / 1000) * 1000, 0)
+
+    return [burningN2O_emissions_kg, burningCH4_emissions_kg]
+
+
+@st.timed('fertiliser products')
+def fertiliser_products(fertilisers, id_column_name='id_event', language="spanish"):
+    """Get the emission attributes of each fertiliser product as columns, it follows the same
+    rules as fertiliser_practices.fertiliser_management
+
+    :param fertilisers: pandas dataframe with one row per product applied in an event
+    :param id_column_name: event identifier column
+    :param language: language used in the input options
+    :return: pandas dataframe
+    """
+
+    fertilisers = fertilisers.reset_index(drop=True)
+    ## events that only reported N, P, K values
+    products_by_event = fertilisers.groupby(id_column_name)[id_column_name].transform('size')
+    only_npk = (products_by_event == 1) & fertilisers.amount_kg_ha.isnull()
+    if only_npk.sum() > 0:
+        npk_products = []
+        for i in fertilisers.index[only_npk]:
+            products = ff.assign_fertilizer_products(fertilisers.loc[[i]])
+            products[id_column_name] = fertilisers.loc[i, id_column_name]
+            npk_products.append(products)
+        fertilisers = pd.concat([fertilisers.loc[~only_npk]] + npk_products, ignore_index=True)
+
+    products = pd.DataFrame({id_column_name: fertilisers[id_column_name]})
+    products['amount'] = fertilisers.amount_kg_ha.astype(float).fillna(0)
+
+    option_column = "fertiliser_sp" if language == "spanish" else "fertiliser_eng"
+    fert = lower_values(fertilisers.fertliser_product)
+    fert = fert.where(fert.isin(list(ef.fertilizers_factors_index[option_column])), "another_fert")
+    fert_type = fert.map(lambda i: ef.fertilizers_factors_index[option_column].get(i, ('',))[0])
+    products['fertiliser'] = fert
+    products['organic_type'] = fert_type.where(fert_type.isin(fp.ORGANIC_FERTILISER_TYPES), np.nan)
+    products['organic'] = products.organic_type.notnull()
+    if 'years_using_the_fertlizer' in fertilisers.columns:
+        products['years'] = fertilisers.years_using_the_fertlizer.astype(float).fillna(10).map(int)
+    else:
+        products['years'] = 10
+
+    ## product factors are always drawn from the spanish names
+    factors = pd.DataFrame(list(fert.map(lambda i: ef.fertilizers_factors_index['fertiliser_sp'].get(
+        i, (np.nan,) * 9))),
+        columns=['type', 'Product', 'N', 'Europe', 'China', 'Other',
+                 'bouwman', 'application_method', 'rice_emission_factor'])
+    products['n_amount'] = products.amount / factors.Product.astype(float) * factors.N.astype(float)
+
+    synthetic = ~products.organic
+    ## emissions by production
+    country = fertilisers.production_country
+    if language == "spanish":
+        country = translate_options(country, tl.prod_country_options)
+    country = country.map(lambda i: i.capitalize() if i in ['Europe', 'China', 'other'] else 'other')
+    country_factor = [factors.loc[i, j] if j in factors.columns else np.nan for i, j in zip(factors.index, country)]
+    products['production'] = np.where(synthetic,
+                                      products.amount / factors.Product.astype(float) * np.array(country_factor,
+                                                                                                 dtype=float),
+                                      0)
+
+    ## inhibitors
+    inhibitor = lower_values(fertilisers.inhibitor.astype(object)).where(synthetic, 'no inhibitors')
+    products['inhibitor_n2o'] = products.n_amount * inhibitor.map(ef.inhibi_index).astype(float)
+    products['inhibitor_no'] = products.n_amount * inhibitor.map(ef.inhibi_no_index).astype(float)
+
+    ## volatilization
+    products['bouwman'] = factors.bouwman.astype(float).fillna(0)
+    application_method = lower_values(factors.application_method.fillna('broadcast'))
+    products['application_method'] = np.where(products.n_amount != 0,
+                                              application_method.map(ef.method_appl_nh3_index).astype(float), 0)
+
+    ## urea
+    urea_name = "solución de nitrato de amonio urea" if language == "spanish" else "urea ammonium nitrate solution"
+    products['urea_co2'] = np.select([synthetic & (fert == "urea"), synthetic & (fert == urea_name)],
+                                     [products.amount * ef.urea_factor * (44 / 12),
+                                      products.amount * (0.25 / 0.73) * ef.urea_factor * (44 / 12)], 0)
+
+    ## rice
+    rice_factor = fert.map(lambda i: ef.fertilizers_factors_index['fertiliser_sp'][i][8]
+                           if i in ef.fertilizers_factors_index['fertiliser_sp'] else 0)
+    products['rice_flux'] = rice_factor.astype(float) * np.log(1 + products.amount / 1000)
+
+    return products
+
+
+def sum_by_event(values, keys, event_ids):
+    """sum values by event, missing values are propagated as numpy's sum does in the serial code"""
+    totals = np.zeros(len(event_ids))
+    np.add.at(totals, pd.Index(event_ids).get_indexer(keys), np.asarray(values, dtype=float))
+
+    return totals
+
+
+def get_organic_specific_amount(products, event_ids, id_column_name='id_event'):
+    """total amount and average years using each organic fertiliser type by event"""
+    organic = products.loc[products.organic]
+    amounts = pd.DataFrame(0.0, index=event_ids, columns=fp.ORGANIC_FERTILISER_TYPES)
+    years = pd.DataFrame(np.nan, index=event_ids, columns=fp.ORGANIC_FERTILISER_TYPES)
+    if organic.shape[0] > 0:
+        grouped = organic.groupby([id_column_name, 'organic_type'])
+        amounts = grouped.amount.sum().unstack().reindex(index=event_ids,
+                                                         columns=fp.ORGANIC_FERTILISER_TYPES).fillna(0)
+        years = grouped.years.mean().unstack().reindex(index=event_ids, columns=fp.ORGANIC_FERTILISER_TYPES)
+
+    return [amounts, years]
+
+
+def cumulative_organic_fertilizer_for20years(org_fert_amount_kg_ha, soil_c_stock,
+                                             org_fert_option='compost',
+                                             years_adding_org_fert=20):
+    """vectorized version of fertiliser_functions.cumulative_organic_fertilizer_for20years"""
+    org_fert_amount = np.asarray(org_fert_amount_kg_ha, dtype=float) / 1000
+    intercept, amount, duration = ef.factors_soc_change[org_fert_option][:3]
+
+    anual_factor = np.where(org_fert_amount > 0, 1 + (intercept + amount * org_fert_amount + duration * 20), 1)
+    cum20years_factor = 1 + (anual_factor - 1) * 20
+
+    cumulative_20_years = (-1 * soil_c_stock * (cum20years_factor - 1)) * (44 / 12)
+    cumulative_20_years = np.where(np.asarray(years_adding_org_fert, dtype=float) < 20, cumulative_20_years, 0)
+
+    return [cumulative_20_years / 20, cumulative_20_years]
+
+
+@st.timed('rice CH4')
+def ghg_from_rice(events, context, products, id_column_name='id_event', language="spanish"):
+    """methane emissions and soil management for rice events, see crop_ghg_emissions.ghg_from_rice"""
+
+    intercept = 0.363
+    soc = 0.3371
+
+    pH_value = map_unique(context.pH_content, lambda i: rice.get_nh4_by_pH_content(i)[0]).astype(float)
+
+    pre_water = events.pre_water_regime.notnull()
+    pw_value = pd.Series(0.0, index=events.index)
+    w_value = pd.Series(0.0, index=events.index)
+    cl_value = pd.Series(0.0, index=events.index)
+    if pre_water.sum() > 0:
+        pw_value[pre_water] = map_unique(events.pre_water_regime[pre_water],
+                                         lambda i: rice.pre_water_regime_factor(i, language)[0]).astype(float)
+        w_value[pre_water] = map_unique(events.water_regime[pre_water],
+                                        lambda i: rice.water_regime_factor(i, language)[0]).astype(float)
+        cl_value[pre_water] = map_unique(events.specific_climate_for_rice[pre_water],
+                                         lambda i: rice.sp_climate_factor(i, language)).astype(float)
+
+    ## fertiliser flux is only added when there is more than one organic product
+    organic = products.loc[products.organic & products[id_column_name].isin(events[id_column_name])]
+    organic_count = organic.groupby(id_column_name).size().reindex(events[id_column_name]).fillna(0).values
+    fert_flux = organic.groupby(id_column_name).rice_flux.sum().reindex(events[id_column_name]).fillna(0).values
+    fert_flux = np.where(organic_count > 1, fert_flux, 0)
+
+    soil_organic_c = context.soil_organic_c.fillna(0).values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        soc_flux = np.where(soil_organic_c != 0, soc * np.log(np.where(soil_organic_c != 0, soil_organic_c, 1)), 0)
+    ch4emission_lnflux = intercept + soc_flux + pH_value + pw_value + w_value + cl_value + fert_flux
+    ch4emission_flux = np.exp(ch4emission_lnflux)
+    ch4_kg_ch4_ha_day = (ch4emission_flux * 10000 * 24) / (1000 * 1000)
+
+    if (np.issubdtype(events.sowing_date.dtype, np.datetime64) and
+            np.issubdtype(events.harvest_date.dtype, np.datetime64)):
+        days = (events.harvest_date - events.sowing_date).values / np.timedelta64(1, 'D')
+    else:
+        days = 120
+    ch4_kg_ch4_ha = ch4_kg_ch4_ha_day * days * ef.pc_CH4
+
+    ### soil management
+    years_tillage_tech = events.time_using_tillage_system.astype(float)
+    rice_tillfactor = map_unique(context.til_eng_input,
+                                 lambda i: rice.mitigation_by_tillage(i) if isinstance(i, str) else 1).astype(float)
+    rice_tillfactor = (-1 * context.soil_c_stock * (rice_tillfactor - 1)) * (44 / 12) / 20
+    rice_tillfactor = np.where(years_tillage_tech <= 20, rice_tillfactor, 0)
+
+    cropadding = pd.Series(list(zip(context.cc_eng_input, context.climate)), index=events.index)
+    rice_cropaddfactor = map_unique(cropadding,
+                                    lambda i: rice.mitigation_by_cropadding(i[0], i[1])
+                                    if isinstance(i[0], str) else 1).astype(float)
+    rice_cropaddfactor = (-1 * context.soil_c_stock * (rice_cropaddfactor - 1)) * (44 / 12) / 20
+    rice_cropaddfactor = np.where(years_tillage_tech <= 20, rice_cropaddfactor, 0)
+
+    ## organic fertilisers, the same factors are applied for each type of product
+    org_fert_mit = np.zeros(len(events))
+    if organic.shape[0] > 0:
+        org_fert_mit = np.full(len(events), np.inf)
+        event_position = pd.Series(range(len(events)), index=events[id_column_name])
+        soil_c_stock = pd.Series(context.soil_c_stock.values, index=events[id_column_name])
+        grouped = organic.groupby([id_column_name, 'organic_type'])
+        by_type = pd.DataFrame({'amount': grouped.amount.sum(), 'years': grouped.years.median()}).reset_index()
+        for org_type, type_subset in by_type.groupby('organic_type'):
+            baseline_cropadd = rice.factors_by_organic_fertilisers(org_type)
+            baseline_crop = (1 + baseline_cropadd['All crops_Intercept'].values[0] +
+                             baseline_cropadd['Rice_Omamount_factor'].values[0] * type_subset.amount / 1000 +
+                             baseline_cropadd['Rices_duration_factor'].values[0] * 20)
+            stock = soil_c_stock[type_subset[id_column_name]].values
+            baseline_crop = np.where(type_subset.years <= 20,
+                                     (-1 * stock * ((1 + (baseline_crop - 1) * 20) - 1)) * (44 / 12), 0) / 20
+            positions = event_position[type_subset[id_column_name]].values
+            np.minimum.at(org_fert_mit, positions, baseline_crop)
+        org_fert_mit = np.where(np.isinf(org_fert_mit), 0, org_fert_mit)
+
+    rice_smanagement = np.minimum(np.minimum(org_fert_mit, rice_tillfactor), rice_cropaddfactor)
+
+    return [np.asarray(ch4_kg_ch4_ha, dtype=float), rice_smanagement]
+
+
+def soil_nitrogen_terms(context):
+    """soil and climate terms of the nitrogen emission models for each event"""
+    length_factor = ef.lengthexperimet_factors['Per year (<300 days)'][0]
+
+    return {
+        'log_n2o': (ef.constantN2O + context.soc_n2o + context.pH_n2o + context.texture_n2o +
+                    context.climate_n2o + context.crop_n2o + length_factor).values.astype(float),
+        'log_no': (context.n_no + ef.constantNO + context.climate_no + length_factor).values.astype(float),
+        'nh3': (context.pH_nh3 + context.climate_nh3 + context.crop_nh3 + context.cec_nh3).values.astype(float),
+        'leaching_climate': context.climate.map(
+            lambda i: ef.leaching_climate_index.get(i.capitalize(), 0)).values.astype(float)}
+
+
+def nh3_by_event(products, soil_terms, event_ids, id_column_name='id_event'):
+    """nitrogen volatilized from synthetic fertilisers in each event before applying the emission factor"""
+    synthetic = products.loc[~products.organic]
+    soil_nh3 = pd.Series(soil_terms['nh3'], index=event_ids)
+    coeff_nh3 = soil_nh3.reindex(synthetic[id_column_name]).values + synthetic.bouwman + synthetic.application_method
+    nh3_by_product = np.exp(coeff_nh3.astype(float)) * synthetic.n_amount
+
+    return sum_by_event(nh3_by_product, synthetic[id_column_name], event_ids)
+
+
+@st.timed('nitrogen models')
+def nitrogen_emissions(soil_terms, n_total, n_synthetic, weigthedsum, weigthedsum_no, nh3_coefficients,
+                       coefficients=None):
+    """co2 equivalent of the n2o, no, volatilization and leaching emissions, the arguments
+    can be arrays of any shape that broadcast together. The application rate constants and the
+    n2o global warming potential are taken from emission_factors_mot unless they are given in coefficients"""
+    coefficients = {} if coefficients is None else coefficients
+    n_rate_n2o = coefficients.get('N_application_rate_constant', ef.N_application_rate_constant)
+    n_rate_no = coefficients.get('NO_application_rate_constant', ef.NO_application_rate_constant)
+    pc_N2O_MOT = coefficients.get('pc_N2O_MOT', ef.pc_N2O_MOT)
+
+    ### BACKGROUND N2O AND NO EMISSIONS
+    background_n2o_emissions = np.exp(soil_terms['log_n2o'])
+    fertiliserinducedemission_n2o = ((np.exp(soil_terms['log_n2o'] + n_rate_n2o * n_total) -
+                                      background_n2o_emissions) * weigthedsum)
+    total_n2o = (fertiliserinducedemission_n2o + background_n2o_emissions) * ef.N_to_N2O * pc_N2O_MOT
+
+    background_no_emissions = np.exp(soil_terms['log_no']) * 0.01
+    fertiliserinducedemission_no = ((np.exp(soil_terms['log_no'] + n_rate_no * n_total) *
+                                     0.01 - background_no_emissions) * weigthedsum_no)
+    total_no = (fertiliserinducedemission_no + background_no_emissions) * ef.N_to_N2O * pc_N2O_MOT
+
+    ### VOLATILIZATION
+    volatilizationfactor = ef.volatilizationfactors.loc[
+        ef.volatilizationfactors.iloc[:, 4] == "Volatilization"].iloc[0, 5]
+    total_nh3 = nh3_coefficients * volatilizationfactor * ef.N_to_N2O * pc_N2O_MOT
+
+    ### LEACHING
+    leachingfactor = ef.leachingfactors.loc[ef.leachingfactors.iloc[:, 4] == "Leaching"].iloc[0, 5]
+    total_leaching = n_synthetic * leachingfactor * soil_terms['leaching_climate'] * ef.N_to_N2O * pc_N2O_MOT
+
+    return total_n2o + total_no + total_nh3 + total_leaching
+
+
+def soil_mining_emissions(context, n_total):
+    """co2 equivalent of the nitrogen that is removed from the soil when the fertilisers
+    do not cover the crop needs"""
+    cropyielddry = context.crop_yield_kg_ha - (context.crop_yield_kg_ha * (context.crop_harvestmoist / 100))
+    balance_n_rate = np.asarray(cropyielddry * (context.crop_ncontent / 100) / 0.85, dtype=float)
+    if np.ndim(n_total) > 1:
+        balance_n_rate = balance_n_rate[:, np.newaxis]
+
+    return np.where(n_total < balance_n_rate, balance_n_rate - n_total, 0) * 8
+
+
+def calculate_emissions(general_info, fertilisers, id_column_name='id_event', language="spanish"):
+    """Gauge ghg emissions for all the events at once, every emission source is computed
+    as column operations instead of creating an object for each event.
+
+    :param general_info: pandas dataframe with the general information of each event
+    :param fertilisers: pandas dataframe with the fertilisers applied in each event
+    :param id_column_name: event identifier column
+    :param language: language used in the input options
+    :return: list: summary table, nitrogen applied by synthetic fertilisers and crop yield,
+     as crop_ghg_emissions.ghg_emissions.multiple_events does
+    """
+
+    events = general_info.loc[general_info[id_column_name].notnull()].reset_index(drop=True)
+    unique_events = events.drop_duplicates(id_column_name).reset_index(drop=True)
+    event_ids = unique_events[id_column_name]
+
+    context = soil_context(unique_events, language)
+    products = fertiliser_products(fertilisers.loc[fertilisers[id_column_name].isin(event_ids)],
+                                   id_column_name, language)
+
+    ## per event sums of the fertiliser products
+    synthetic = products.loc[~products.organic]
+    n_synthetic = sum_by_event(synthetic.n_amount, synthetic[id_column_name], event_ids)
+    n_total = sum_by_event(products.n_amount, products[id_column_name], event_ids)
+    production = sum_by_event(synthetic.production, synthetic[id_column_name], event_ids)
+    urea_co2 = sum_by_event(synthetic.urea_co2, synthetic[id_column_name], event_ids)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weigthedsum = np.where(n_total != 0,
+                               sum_by_event(products.inhibitor_n2o, products[id_column_name], event_ids) / n_total, 0)
+        weigthedsum_no = np.where(n_total != 0,
+                                  sum_by_event(products.inhibitor_no, products[id_column_name], event_ids) / n_total,
+                                  0)
+
+    ### SOIL MANAGEMENT
+    soc_changes = [context.tillage_soc_change.values, context.cover_crop_soc_change.values]
+    org_amounts, org_years = get_organic_specific_amount(products, event_ids, id_column_name)
+    for org_type in fp.ORGANIC_FERTILISER_TYPES:
+        soc_changes.append(cumulative_organic_fertilizer_for20years(org_amounts[org_type].values,
+                                                                    context.soil_c_stock.values,
+                                                                    org_type,
+                                                                    org_years[org_type].values)[0])
+    soil_management_soc = np.array(soc_changes).min(axis=0)
+
+    soil_terms = soil_nitrogen_terms(context)
+    nh3_coefficients = nh3_by_event(products, soil_terms, event_ids, id_column_name)
+
+    ## limestone is not added, fertiliser_management only looks for it among the product keys
+    fertiliser_induced_field_emissions = nitrogen_emissions(soil_terms, n_total, n_synthetic, weigthedsum,
+                                                            weigthedsum_no, nh3_coefficients) + urea_co2
+
+    #### SOIL MINING
+    soil_mining = soil_mining_emissions(context, n_total)
+
+    summary = pd.DataFrame({
+        'id_event': event_ids.values,
+        'municipality': unique_events.municipality.values,
+        'Fertiliser production': np.round(production, 2),
+        'Fertlises induced field emissions': np.round(fertiliser_induced_field_emissions, 2),
+        'Soil Management': np.round(soil_management_soc, 2),
+        'Soil Mining': soil_mining,
+        'Land Use Change effect on soil': context.luc_effect_on_soil.values,
+        'Burning residues': context.burning_residues.values})
+
+    #### RICE
+    ## as in multiple_events, the methane column is only added when there are rice events
+    rice_events = lower_values(context.crop).isin(["rice", "arroz"]).values
+    if rice_events.sum() > 0:
+        summary['Methane from rice'] = np.nan
+        rice_emissions, rice_soilmanagement = ghg_from_rice(unique_events.loc[rice_events],
+                                                            context.loc[rice_events],
+                                                            products, id_column_name, language)
+        summary.loc[rice_events, 'Methane from rice'] = rice_emissions
+        summary.loc[rice_events, 'Soil Management'] = rice_soilmanagement
+
+    ## one row per event in the original order, as multiple_events does
+    positions = pd.Series(range(len(event_ids)), index=event_ids.values)[events[id_column_name]].values
+    summary = summary.iloc[positions]
+    summary.index = np.zeros(len(positions), dtype=int)
+
+    return [summary, list(n_synthetic[positions]), list(context.crop_yield_kg_ha.values[positions])]
+
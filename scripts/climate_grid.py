@@ -0,0 +1,214 @@
+"""MOT climate class of every pixel of the climate layers, baked into a uint8 grid that is
+memory mapped, so the climate of a coordinate is a single array index and all the worker
+processes share the same pages. Build it once from the repository folder:
+
+    python -m scripts.climate_grid
+
+The grid is not used when it is missing or the climate layers changed after it was built.
+"""
+import json
+import os
+
+import numpy as np
+import rasterio as rio
+
+from scripts import soilgrid_functions as sgf
+from scripts import translations as tl
+
+KOPPEN_PATH = "climate_classification/world_climate_class_koppen.tif"
+CLIMATEREGION_PATH = "climate_classification/world_climate_regions_Sayre.tif"
+CLIMATE_GRID_PATH = "climate_classification/mot_climate_classes.npy"
+## the code table and grid definition are kept next to the grid
+CLIMATE_GRID_VERSION = 1
+
+## class of each code, the default class takes code 0
+DEFAULT_CLIMATE = 'temperate continental'
+CLIMATE_CLASSES = list(dict.fromkeys([DEFAULT_CLIMATE] + list(tl.world_climate_koppen.keys()) +
+                                     list(tl.world_climate_sayre.keys())))
+
+
+def climate_class_codes(koppen_values, cliregion_values):
+    """codes of CLIMATE_CLASSES for arrays of koppen and climate region values, it follows the same
+    rules as soil_management.mot_climate_classification: the koppen class is taken first, then
+    the climate region class and otherwise the default class"""
+    koppen_values = np.asarray(koppen_values)
+    cliregion_values = np.asarray(cliregion_values)
+    codes = np.zeros(koppen_values.shape, dtype=np.uint8)
+
+    for name, options in tl.world_climate_sayre.items():
+        codes[np.isin(cliregion_values, options[0])] = CLIMATE_CLASSES.index(name)
+    for name, options in tl.world_climate_koppen.items():
+        codes[np.isin(koppen_values, options[0])] = CLIMATE_CLASSES.index(name)
+
+    return codes
+
+
+def source_signatures(raster_paths):
+    """modification time and size of the layers, the grid is built again when they change"""
+    signatures = {}
+    for path in raster_paths:
+        stats = os.stat(path)
+        signatures[path] = [stats.st_mtime_ns, stats.st_size]
+
+    return signatures
+
+
+def grid_definition(raster_paths):
+    """transform, width and height of a grid that covers all the layers and whose pixels fall in
+    a single pixel of every layer, the layers must share their crs and be aligned"""
+    datasets = [rio.open(path) for path in raster_paths]
+    try:
+        if len(set(dataset.crs.to_wkt() for dataset in datasets)) > 1:
+            raise ValueError("the climate layers do not share the same crs")
+        xres = min(dataset.res[0] for dataset in datasets)
+        yres = min(dataset.res[1] for dataset in datasets)
+        left = min(dataset.bounds.left for dataset in datasets)
+        top = max(dataset.bounds.top for dataset in datasets)
+        right = max(dataset.bounds.right for dataset in datasets)
+        bottom = min(dataset.bounds.bottom for dataset in datasets)
+        for dataset in datasets:
+            steps = [dataset.res[0] / xres, dataset.res[1] / yres,
+                     (dataset.bounds.left - left) / xres, (top - dataset.bounds.top) / yres]
+            if not np.allclose(steps, np.round(steps), rtol=0, atol=1e-6):
+                raise ValueError("the climate layer {} is not aligned with the others".format(dataset.name))
+        crs = datasets[0].crs
+    finally:
+        for dataset in datasets:
+            dataset.close()
+
+    width = int(round((right - left) / xres))
+    height = int(round((top - bottom) / yres))
+
+    return [rio.transform.from_origin(left, top, xres, yres), width, height, crs]
+
+
+def build_climate_grid(output_path=CLIMATE_GRID_PATH, koppen_path=KOPPEN_PATH,
+                       climateregion_path=CLIMATEREGION_PATH, rows_per_strip=256):
+    """Classify the center of every pixel of the climate layers and write the codes as a .npy
+    grid with a .json file holding the code table, grid transform and layer signatures
+
+    :param output_path: .npy file
+    :param koppen_path: koppen classification raster
+    :param climateregion_path: climate regions raster
+    :param rows_per_strip: grid rows classified at a time
+    :return: str: grid path
+    """
+    transform, width, height, crs = grid_definition([koppen_path, climateregion_path])
+
+    temp_path = '{}.{}.tmp.npy'.format(output_path[:-len('.npy')], os.getpid())
+    grid = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=(height, width))
+    longitudes = transform.c + (np.arange(width) + 0.5) * transform.a
+    for row in range(0, height, rows_per_strip):
+        latitudes = transform.f + (np.arange(row, min(row + rows_per_strip, height)) + 0.5) * transform.e
+        strip_longitudes, strip_latitudes = [i.ravel() for i in np.meshgrid(longitudes, latitudes)]
+        koppen_values = sample_layer(koppen_path, strip_longitudes, strip_latitudes)
+        cliregion_values = sample_layer(climateregion_path, strip_longitudes, strip_latitudes)
+        grid[row:row + len(latitudes)] = climate_class_codes(koppen_values,
+                                                             cliregion_values).reshape(len(latitudes), width)
+    grid.flush()
+    del grid
+
+    metadata = {'version': CLIMATE_GRID_VERSION,
+                'classes': CLIMATE_CLASSES,
+                'transform': list(transform)[:6],
+                'width': width,
+                'height': height,
+                'crs': crs.to_wkt(),
+                'sources': source_signatures([koppen_path, climateregion_path])}
+    with open(temp_path[:-len('.npy')] + '.json', 'w') as f:
+        json.dump(metadata, f, indent=2)
+    ## both files are replaced at the end, so readers never find a partial grid
+    os.replace(temp_path, output_path)
+    os.replace(temp_path[:-len('.npy')] + '.json', metadata_path(output_path))
+    _grids.pop(output_path, None)
+
+    return output_path
+
+
+def sample_layer(raster_path, longitudes, latitudes):
+    """layer values as get_climate_fromlayers takes them, points outside the layer take 0"""
+    values, inside, _ = sgf.sample_coordinates(raster_path, longitudes, latitudes)
+
+    return np.where(inside, values, 0)
+
+
+def metadata_path(grid_path):
+    return os.path.splitext(grid_path)[0] + '.json'
+
+
+class climate_grid:
+    """Memory mapped grid of climate codes
+
+                   Parameters
+                   ----------
+
+                   grid_path : str
+                           .npy file written by build_climate_grid
+            """
+
+    def codes(self, longitudes, latitudes):
+        """climate codes for arrays of coordinates, points outside the grid or without
+        coordinates take the default class"""
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        codes = np.zeros(longitudes.shape, dtype=np.uint8)
+        withcoordinates = np.isfinite(longitudes) & np.isfinite(latitudes)
+        if not withcoordinates.any():
+            return codes
+
+        rows, cols = rio.transform.rowcol(self.transform, longitudes[withcoordinates], latitudes[withcoordinates])
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        grid_codes = np.zeros(len(rows), dtype=np.uint8)
+        grid_codes[inside] = self.grid[rows[inside], cols[inside]]
+        codes[withcoordinates] = grid_codes
+
+        return codes
+
+    def climate_classes(self, longitudes, latitudes):
+        """mot climate class names for arrays of coordinates"""
+        return self.classes[self.codes(longitudes, latitudes)]
+
+    def is_current(self):
+        """the layers did not change since the grid was built"""
+        try:
+            return source_signatures(self.sources.keys()) == self.sources
+        except OSError:
+            return False
+
+    def __init__(self, grid_path=CLIMATE_GRID_PATH):
+        with open(metadata_path(grid_path)) as f:
+            metadata = json.load(f)
+        if metadata.get('version') != CLIMATE_GRID_VERSION:
+            raise ValueError("the climate grid {} was built by another version".format(grid_path))
+
+        self.grid = np.load(grid_path, mmap_mode='r')
+        self.classes = np.array(metadata['classes'], dtype=object)
+        self.transform = rio.Affine(*metadata['transform'])
+        self.width = metadata['width']
+        self.height = metadata['height']
+        self.sources = metadata['sources']
+
+
+def load_climate_grid(grid_path=CLIMATE_GRID_PATH):
+    """climate grid of a process, None when it is missing, unreadable or older than the layers"""
+    if grid_path not in _grids:
+        grid = None
+        if os.path.exists(grid_path):
+            try:
+                grid = climate_grid(grid_path)
+            except (OSError, ValueError, KeyError):
+                grid = None
+            if grid is not None and not grid.is_current():
+                grid = None
+        _grids[grid_path] = grid
+
+    return _grids[grid_path]
+
+
+## grids loaded by this process
+_grids = {}
+
+
+if __name__ == '__main__':
+    print("{} was written".format(build_climate_grid()))
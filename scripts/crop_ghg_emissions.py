@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import math
+from concurrent.futures import ProcessPoolExecutor
 
 from scripts import soil_management as sme
 from scripts import fertiliser_practices as fp
@@ -9,10 +10,27 @@ from scripts import emission_factors_mot as ef
 from scripts import translations as tl
 from scripts import fertiliser_practices as fp
 from scripts import fertiliser_functions as ff
+from scripts import batch_emissions as be
+from scripts import general_functions as gf
+from scripts import results_cache as rc
+from scripts import uncertainty_emissions as ue
+from scripts import stage_timing as st
 import warnings
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
+## emission sources of the summary table, methane from rice is only added when there are rice events
+EMISSION_COLUMNS = ['Fertiliser production', 'Fertlises induced field emissions', 'Soil Management', 'Soil Mining',
+                    'Land Use Change effect on soil', 'Burning residues', 'Methane from rice']
+## columns of the input tables that are read when the events are gauged, climate is optional
+GENERAL_INFO_COLUMNS = ['id_event', 'municipality', 'longitude', 'latitude', 'luc', 'luc_time', 'crop', 'soil',
+                        'soil_texture', 'soil_organic_content', 'soil_n_content', 'soil_pH', 'bulk_density',
+                        'tillage_input', 'time_using_tillage_system', 'crop_cover', 'time_using_crop_cover',
+                        'residues_input', 'crop_yield_kg_ha', 'specific_climate_for_rice', 'sowing_date',
+                        'harvest_date', 'water_regime', 'pre_water_regime']
+FERTILISER_COLUMNS = ['id_event', 'fertliser_product', 'amount_kg_ha', 'inhibitor', 'production_country',
+                      'years_using_the_fertlizer']
+
 
 class ghg_emissions:
     """Get soil emissions factors and properties for gauging ghg.
@@ -24,6 +42,12 @@ class ghg_emissions:
                    input_list_files : list
                            Table
 
+                   input_general_path, input_fert_file_path : str, pandas dataframe or arrow table
+                           general information and fertilisers tables, files can be excel, csv, parquet or feather
+
+                   input_format : str
+                           format of the input files, it is taken from the file extension when it is not given
+
                    soil_emissions table : str
 
 
@@ -38,141 +62,132 @@ class ghg_emissions:
 
     def calculate_emissions_for_a_single_event(self, event_id):
         """Gauge ghg emissions for a single event"""
-        print("calculating emissions for {}".format(event_id))
-        subset_generalinfo = self._general_info.loc[self._general_info['id_event'] == event_id]
-        subset_input_fertilisers_table = self._input_fertilisers_table.loc[
-            self._input_fertilisers_table['id_event'] == event_id]
+        event_results = sliced_events_emissions(self.event_slices, [event_id])[0]
 
-        fertiliser_data = fp.fertiliser_management(subset_input_fertilisers_table)
-
-        soil_emissions = sme.soil_management_emissions(subset_generalinfo)
-
-        ###
-
-        compost_soc_change = ff.cumulative_organic_fertilizer_for20years(
-            fertiliser_data._compost_total_amount[0],
-            soil_emissions.soil_c_stock,
-            'compost',
-            fertiliser_data._compost_total_amount[1])
-
-        manure_soc_change = ff.cumulative_organic_fertilizer_for20years(
-            fertiliser_data._manure_total_amount[0],
-            soil_emissions.soil_c_stock,
-            'manure',
-            fertiliser_data._manure_total_amount[1])
-
-        residue_soc_change = ff.cumulative_organic_fertilizer_for20years(
-            fertiliser_data._residue_total_amount[0],
-            soil_emissions.soil_c_stock,
-            'residue',
-            fertiliser_data._residue_total_amount[1])
-
-        ####SOIL MANAGEMENT
-
-        soil_management_soc_CO2eq_kg_ha = np.array(
-            [soil_emissions.tillage_soc_change[0],
-             soil_emissions.cover_crop_soc_change[0],
-             compost_soc_change[0],
-             manure_soc_change[0],
-             residue_soc_change[0]]).min()
-
-        #### FERTILISERS PRODUCTION
-        fertiliser_production_CO2eq_kg_ha = fertiliser_data.em_fert_production_CO2eq_kg_ha
-        #### LUC
-        luc_kg_co2 = soil_emissions.luc_effect_on_soil
-        ### BURNING
-        total_burning_kg_CO2eq = soil_emissions.burning_residues()
-        ### BACKGROUND NH3 NO AND N2O EMISSIONS
-        total_N2O_total_flux_kgCO2ha = calculate_n2o_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data)
-        total_NO_total_flux_kgCO2ha = calculate_no_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data)
-        total_NH3_total_flux_kgCO2ha = emissions_by_volatilization(soil_emissions, fertiliser_data)
-        total_N_leaching_kgCO2ha = emissions_by_leaching(soil_emissions, fertiliser_data)
-
-        fertiliser_induced_field_emissions_co2 = (np.array(
-            fertiliser_data.emissions_by_urea_application()).sum() +
-                                                  np.array(
-                                                      fertiliser_data.caco3_emissions_by_limestone_application()).sum())
-
-        #### SOIL MINING
-        soil_mining_ghg_emission_kg_co2 = calculate_co2eq_by_soilmining(soil_emissions, fertiliser_data)
-
-        fertiliser_induced_field_emissions_n2o = np.array([
-            total_N2O_total_flux_kgCO2ha,
-            total_NO_total_flux_kgCO2ha,
-            total_NH3_total_flux_kgCO2ha,
-            total_N_leaching_kgCO2ha
-        ]).sum()
-
-        ### LUC
-
-        if np.array(luc_kg_co2).size > 1:
-            luc_kg_co2_year = luc_kg_co2[0]
-        else:
-            luc_kg_co2_year = luc_kg_co2
-
-        retults = pd.DataFrame({
-            'id_event': [event_id],
-            'municipality': subset_generalinfo.municipality.values[0],
-            'Fertiliser production': [np.round(fertiliser_production_CO2eq_kg_ha, 2)],
-            'Fertlises induced field emissions': [np.round(fertiliser_induced_field_emissions_n2o +
-                                                           fertiliser_induced_field_emissions_co2, 2)],
-            'Soil Management': [np.round(soil_management_soc_CO2eq_kg_ha, 2)],
-            'Soil Mining': soil_mining_ghg_emission_kg_co2,
-            'Land Use Change effect on soil': [luc_kg_co2_year],
-            'Burning residues': [total_burning_kg_CO2eq],
-
-        })
-
-        total_emissions = np.array([np.round(fertiliser_production_CO2eq_kg_ha, 2),
-                                    np.round(fertiliser_induced_field_emissions_n2o +
-                                             fertiliser_induced_field_emissions_co2, 2),
-                                    np.round(soil_management_soc_CO2eq_kg_ha, 2),
-                                    luc_kg_co2_year,
-                                    total_burning_kg_CO2eq]).sum()
-
-        fertiliser_data.caco3_emissions_by_limestone_application()
-
-        #### RICE
-        crop = soil_emissions.soil_inputs.crop.values[0].lower()
-
-        if crop == "rice" or crop == "arroz":
-            rice_emissions, rice_soilmanagement = ghg_from_rice(soil_emissions, fertiliser_data)
-            retults['Methane from rice'] = rice_emissions
-            total_emissions -= retults['Soil Management'].values[0]
-            retults['Soil Management'] = rice_soilmanagement
-            total_emissions += rice_soilmanagement
-
-        ## table | total emissions | Nitrogen applied
-        return [retults, total_emissions,
-                np.array(fertiliser_data.application_inN_synthetic).sum(),
-                soil_emissions.crop_yield_kg_ha]
+        return [summarise_events([event_results])[0]] + event_results[1:]
 
     def multiple_events(self):
         """Gauge ghg emissions for multiple events"""
-        table_summary = []
-        total_n_amount = []
-        crop_yield = []
-        for id_event in self.id_list:
-            summary_ghg_emissions = self.calculate_emissions_for_a_single_event(id_event)
-            if summary_ghg_emissions[0].shape[1] == 7:
-                summary_ghg_emissions[0]['Methane from rice'] = np.nan
-
-            table_summary.append(summary_ghg_emissions[0])
-            total_n_amount.append(summary_ghg_emissions[2])
-            crop_yield.append(summary_ghg_emissions[3])
-
-        return [pd.concat(table_summary), total_n_amount, crop_yield]
+        if self.cache_path is not None:
+            return self.cached_events()
+
+        if self.vectorized:
+            return be.calculate_emissions(self._general_info, self._input_fertilisers_table, self.id_column_name)
+
+        return summarise_events(self.events_emissions(self.id_list))
+
+    def events_emissions(self, id_events):
+        """Gauge ghg emissions for a list of events, a result is returned for each event
+        as event_emissions does"""
+        if self.vectorized:
+            general_info = self._general_info.loc[self._general_info[self.id_column_name].isin(id_events)]
+            summary, n_amount, crop_yield = be.calculate_emissions(general_info, self._input_fertilisers_table,
+                                                                   self.id_column_name)
+            ## the first row of each event
+            positions = {}
+            for i, event_id in enumerate(summary.id_event.values):
+                positions.setdefault(event_id, i)
+            total_columns = ['Fertiliser production', 'Fertlises induced field emissions', 'Soil Management',
+                             'Land Use Change effect on soil', 'Burning residues']
+            total_emissions = np.array(summary[total_columns].values, dtype=float).sum(axis=1)
+            rows = summary.to_dict('records')
+            ## methane from rice is only given for rice events, as event_emissions does, so a cached
+            ## result does not add the column to a summary without rice events
+            for row in rows:
+                if 'Methane from rice' in row and pd.isnull(row['Methane from rice']):
+                    del row['Methane from rice']
+            return [[rows[positions[i]], total_emissions[positions[i]],
+                     n_amount[positions[i]], crop_yield[positions[i]]] for i in id_events]
+
+        ## the soilgrid tiles of all the events are downloaded before they are gauged
+        be.prefetch_soilgrid_tiles(self._general_info.loc[self._general_info[self.id_column_name].isin(id_events)])
+        if self.n_workers > 1:
+            return self.parallel_events(id_events)
+
+        return sliced_events_emissions(self.event_slices, id_events)
+
+    def cached_events(self):
+        """Gauge ghg emissions for multiple events, only the events whose rows or factors
+        changed since they were stored in the cache are calculated"""
+        cache = rc.event_results_cache(self.cache_path, self.cache_size_mb,
+                                       'vectorized' if self.vectorized else 'serial')
+        id_events = list(dict.fromkeys(self.id_list))
+        keys = {}
+        results = {}
+        for event_id in id_events:
+            keys[event_id] = cache.event_key(self.event_slices.get_slice(event_id, 'general_info'),
+                                             self.event_slices.get_slice(event_id, 'fertilisers'))
+            results[event_id] = cache.get(keys[event_id])
+
+        missing = [i for i in id_events if results[i] is None]
+        self.cache_hits = len(id_events) - len(missing)
+        print("{} events were taken from the cache".format(self.cache_hits))
+        try:
+            if len(missing) > 0:
+                for event_id, event_results in zip(missing, self.events_emissions(missing)):
+                    results[event_id] = event_results
+                    cache.put(keys[event_id], event_results)
+        finally:
+            cache.close()
+
+        return summarise_events([results[i] for i in self.id_list])
+
+    def emissions_uncertainty(self, n_draws=1000, uncertainty=None, percentiles=(2.5, 50, 97.5), seed=None):
+        """Mean and percentiles of each emission component with Monte Carlo draws of the soil
+        properties, fertiliser amounts, model coefficients and global warming potentials,
+        see uncertainty_emissions.monte_carlo_emissions"""
+        return ue.monte_carlo_emissions(self._general_info, self._input_fertilisers_table, n_draws, uncertainty,
+                                        percentiles, seed, id_column_name=self.id_column_name)
+
+    def parallel_events(self, id_events):
+        """Gauge ghg emissions for chunks of events in a process pool, the results
+        are returned in the same order as id_events"""
+        chunksize = self.chunksize
+        if chunksize is None:
+            chunksize = max(1, math.ceil(len(id_events) / (self.n_workers * 4)))
+        chunks = [id_events[i:i + chunksize] for i in range(0, len(id_events), chunksize)]
+
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 initializer=init_events_worker,
+                                 initargs=(self._general_info, self._input_fertilisers_table,
+                                           self.id_column_name, st.is_enabled())) as executor:
+            chunks_emissions = []
+            for chunk_emissions, stage_records in executor.map(events_chunk_emissions, chunks):
+                chunks_emissions.append(chunk_emissions)
+                st.add_records(stage_records)
+
+        return [event for chunk in chunks_emissions for event in chunk]
 
     def __init__(self,
                  input_general_path,
                  input_fert_file_path,
                  id_event=np.nan,
-                 id_column_name='id_event'):
-
-        self._general_info = pd.read_excel(input_general_path)
+                 id_column_name='id_event',
+                 vectorized=False,
+                 n_workers=1,
+                 chunksize=None,
+                 cache_path=None,
+                 cache_size_mb=512,
+                 input_format=None):
+
+        self.id_column_name = id_column_name
+        ## gauge all the events at once with the batch engine
+        self.vectorized = vectorized
+        ## events are spread across a process pool when there is more than one worker
+        self.n_workers = n_workers
+        self.chunksize = chunksize
+        ## results of single events are reused from this file when their rows did not change
+        self.cache_path = cache_path
+        self.cache_size_mb = cache_size_mb
+        self.cache_hits = 0
+        self._general_info = gf.read_table(input_general_path, input_format)
         ##removing nan from the id list
         self.id_list = [i for i in self._general_info[id_column_name] if np.logical_not(pd.isnull(i))]
-        self._input_fertilisers_table = pd.read_excel(input_fert_file_path)
+        self._input_fertilisers_table = gf.read_table(input_fert_file_path, input_format, date_columns=[])
+        ## rows of each event, both tables are partitioned once
+        self.event_slices = gf.event_slice_index({'general_info': self._general_info,
+                                                  'fertilisers': self._input_fertilisers_table},
+                                                 id_column_name)
 
         self.emissions_summary = np.nan
         if np.logical_not(pd.isnull(id_event)):
@@ -194,11 +209,232 @@ class ghg_emissions:
 
 
 
+## tables of the events gauged by a pool worker
+_worker_events = {}
+
+
+def init_events_worker(general_info, fertilisers, id_column_name='id_event', timing=False):
+    """load the emission factors and partition the input tables once for each pool worker"""
+    if timing:
+        st.enable()
+    ef.load_factor_tables()
+    _worker_events['event_slices'] = gf.event_slice_index({'general_info': general_info,
+                                                           'fertilisers': fertilisers},
+                                                          id_column_name)
+
+
+def sliced_events_emissions(event_slices, id_events):
+    """Gauge ghg emissions for a list of events taking their rows from an event slice index"""
+    events_emissions = []
+    for event_id in id_events:
+        print("calculating emissions for {}".format(event_id))
+        with st.event(event_id):
+            events_emissions.append(event_emissions(event_id,
+                                                    event_slices.get_slice(event_id, 'general_info'),
+                                                    event_slices.get_slice(event_id, 'fertilisers')))
+
+    return events_emissions
+
+
+def events_chunk_emissions(id_events):
+    """Gauge ghg emissions for a chunk of events inside a pool worker, the stage times
+    recorded in the worker are returned with the results"""
+    events_emissions = sliced_events_emissions(_worker_events['event_slices'], id_events)
+
+    return [events_emissions, st.collect_records()]
+
+
+class event_results_columns:
+    """Preallocated columns where the results of single events are written, the summary
+    table is only built once all the events are in.
+
+                   Parameters
+                   ----------
+
+                   n_events : int
+                           number of events
+            """
+
+    def set_event(self, position, event_results):
+        """write the results of an event, as event_emissions returns them"""
+        values, total_emissions, n_amount, crop_yield = event_results
+        self.id_event[position] = values['id_event']
+        self.municipality[position] = values['municipality']
+        for i, column in enumerate(EMISSION_COLUMNS):
+            if column in values:
+                value = values[column]
+                self.emissions[position, i] = value
+                self._filled[i] = True
+                if not isinstance(value, (int, np.integer)):
+                    self._integer[i] = False
+        self.n_amount[position] = n_amount
+        self.crop_yield[position] = crop_yield
+
+    def summary(self):
+        """summary table with a row for each event, a column is kept as integer when all
+        its values were integers"""
+        summary = pd.DataFrame({'id_event': self.id_event.tolist(),
+                                'municipality': self.municipality.tolist()},
+                               index=np.zeros(len(self.id_event), dtype=int))
+        for i, column in enumerate(EMISSION_COLUMNS):
+            if self._filled[i]:
+                summary[column] = self.emissions[:, i].astype('int64') if self._integer[i] else self.emissions[:, i]
+
+        return summary
+
+    def __init__(self, n_events):
+        self.id_event = np.empty(n_events, dtype=object)
+        self.municipality = np.empty(n_events, dtype=object)
+        self.emissions = np.full((n_events, len(EMISSION_COLUMNS)), np.nan)
+        self.n_amount = np.full(n_events, np.nan)
+        self.crop_yield = np.full(n_events, np.nan)
+        self._filled = np.zeros(len(EMISSION_COLUMNS), dtype=bool)
+        self._integer = np.ones(len(EMISSION_COLUMNS), dtype=bool)
+
+
+def summarise_events(events_emissions):
+    """join the results of single events into the summary table, nitrogen applied and
+    crop yield lists"""
+    columns = event_results_columns(len(events_emissions))
+    for position, event_results in enumerate(events_emissions):
+        columns.set_event(position, event_results)
+
+    return [columns.summary(), list(columns.n_amount), list(columns.crop_yield)]
+
+
+def tables_emissions(general_info, fertilisers, id_column_name='id_event', vectorized=False):
+    """Gauge ghg emissions for all the events of a general information and a fertiliser table
+    :return: list: summary table, nitrogen applied by synthetic fertilisers and crop yield
+    """
+    if vectorized:
+        return be.calculate_emissions(general_info, fertilisers, id_column_name)
+
+    event_slices = gf.event_slice_index({'general_info': general_info, 'fertilisers': fertilisers},
+                                        id_column_name)
+    id_list = [i for i in general_info[id_column_name] if np.logical_not(pd.isnull(i))]
+    be.prefetch_soilgrid_tiles(general_info)
+
+    return summarise_events(sliced_events_emissions(event_slices, id_list))
+
+
+def event_emissions(event_id, subset_generalinfo, subset_input_fertilisers_table):
+    """Gauge ghg emissions for the general information and fertiliser rows of a single event
+    :return: list: emissions by source as a dict, total emissions, nitrogen applied by synthetic fertilisers
+     and crop yield, see summarise_events
+    """
+
+    with st.stage('fertiliser management'):
+        fertiliser_data = fp.fertiliser_management(subset_input_fertilisers_table)
+
+    with st.stage('soil management'):
+        soil_emissions = sme.soil_management_emissions(subset_generalinfo)
+
+    ###
+
+    compost_soc_change = ff.cumulative_organic_fertilizer_for20years(
+        fertiliser_data._compost_total_amount[0],
+        soil_emissions.soil_c_stock,
+        'compost',
+        fertiliser_data._compost_total_amount[1])
+
+    manure_soc_change = ff.cumulative_organic_fertilizer_for20years(
+        fertiliser_data._manure_total_amount[0],
+        soil_emissions.soil_c_stock,
+        'manure',
+        fertiliser_data._manure_total_amount[1])
+
+    residue_soc_change = ff.cumulative_organic_fertilizer_for20years(
+        fertiliser_data._residue_total_amount[0],
+        soil_emissions.soil_c_stock,
+        'residue',
+        fertiliser_data._residue_total_amount[1])
+
+    ####SOIL MANAGEMENT
+
+    soil_management_soc_CO2eq_kg_ha = np.array(
+        [soil_emissions.tillage_soc_change[0],
+         soil_emissions.cover_crop_soc_change[0],
+         compost_soc_change[0],
+         manure_soc_change[0],
+         residue_soc_change[0]]).min()
+
+    #### FERTILISERS PRODUCTION
+    fertiliser_production_CO2eq_kg_ha = fertiliser_data.em_fert_production_CO2eq_kg_ha
+    #### LUC
+    luc_kg_co2 = soil_emissions.luc_effect_on_soil
+    ### BURNING
+    total_burning_kg_CO2eq = soil_emissions.burning_residues()
+    ### BACKGROUND NH3 NO AND N2O EMISSIONS
+    total_N2O_total_flux_kgCO2ha = calculate_n2o_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data)
+    total_NO_total_flux_kgCO2ha = calculate_no_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data)
+    total_NH3_total_flux_kgCO2ha = emissions_by_volatilization(soil_emissions, fertiliser_data)
+    total_N_leaching_kgCO2ha = emissions_by_leaching(soil_emissions, fertiliser_data)
+
+    fertiliser_induced_field_emissions_co2 = (np.array(
+        fertiliser_data.emissions_by_urea_application()).sum() +
+                                              np.array(
+                                                  fertiliser_data.caco3_emissions_by_limestone_application()).sum())
+
+    #### SOIL MINING
+    soil_mining_ghg_emission_kg_co2 = calculate_co2eq_by_soilmining(soil_emissions, fertiliser_data)
+
+    fertiliser_induced_field_emissions_n2o = np.array([
+        total_N2O_total_flux_kgCO2ha,
+        total_NO_total_flux_kgCO2ha,
+        total_NH3_total_flux_kgCO2ha,
+        total_N_leaching_kgCO2ha
+    ]).sum()
+
+    ### LUC
+
+    if np.array(luc_kg_co2).size > 1:
+        luc_kg_co2_year = luc_kg_co2[0]
+    else:
+        luc_kg_co2_year = luc_kg_co2
+
+    retults = {
+        'id_event': event_id,
+        'municipality': subset_generalinfo.municipality.values[0],
+        'Fertiliser production': np.round(fertiliser_production_CO2eq_kg_ha, 2),
+        'Fertlises induced field emissions': np.round(fertiliser_induced_field_emissions_n2o +
+                                                      fertiliser_induced_field_emissions_co2, 2),
+        'Soil Management': np.round(soil_management_soc_CO2eq_kg_ha, 2),
+        'Soil Mining': soil_mining_ghg_emission_kg_co2,
+        'Land Use Change effect on soil': luc_kg_co2_year,
+        'Burning residues': total_burning_kg_CO2eq,
+
+    }
+
+    total_emissions = np.array([np.round(fertiliser_production_CO2eq_kg_ha, 2),
+                                np.round(fertiliser_induced_field_emissions_n2o +
+                                         fertiliser_induced_field_emissions_co2, 2),
+                                np.round(soil_management_soc_CO2eq_kg_ha, 2),
+                                luc_kg_co2_year,
+                                total_burning_kg_CO2eq]).sum()
+
+    fertiliser_data.caco3_emissions_by_limestone_application()
+
+    #### RICE
+    crop = soil_emissions.soil_inputs.crop.values[0].lower()
+
+    if crop == "rice" or crop == "arroz":
+        rice_emissions, rice_soilmanagement = ghg_from_rice(soil_emissions, fertiliser_data)
+        retults['Methane from rice'] = rice_emissions
+        total_emissions -= retults['Soil Management']
+        retults['Soil Management'] = rice_soilmanagement
+        total_emissions += rice_soilmanagement
+
+    ## table | total emissions | Nitrogen applied
+    return [retults, total_emissions,
+            np.array(fertiliser_data.application_inN_synthetic).sum(),
+            soil_emissions.crop_yield_kg_ha]
+
+
+@st.timed('soil mining')
 def calculate_co2eq_by_soilmining(general_info, fertiliser_info):
     baseline_namount = np.array(fertiliser_info.application_inN_synthetic).sum() + np.array(
         fertiliser_info.application_inN_organic).sum()
-    n_content_harvested = general_info.get_nh3_n2o_by_crop()[2]
-    moisture_content_harvested = general_info.get_nh3_n2o_by_crop()[3]
+    n_content_harvested, moisture_content_harvested = general_info.get_nh3_n2o_by_crop()[2:]
 
     cropyield = general_info.crop_yield_kg_ha
     cropyielddry = general_info.crop_yield_kg_ha - (
@@ -216,6 +452,7 @@ def calculate_co2eq_by_soilmining(general_info, fertiliser_info):
     return (additional_fert * 8)
 
 
+@st.timed('rice CH4')
 def ghg_from_rice(soil_emissions, fertiliser_data):
     intercept = 0.363
     soc = 0.3371
@@ -249,11 +486,10 @@ def ghg_from_rice(soil_emissions, fertiliser_data):
 
     ch4_kg_ch4_ha_day = (ch4emission_flux * 10000 * 24) / (1000 * 1000)
 
-    sdate = soil_emissions.crop_duration()[0]
-    hdate = soil_emissions.crop_duration()[1]
+    sdate, hdate = soil_emissions.crop_duration()
     if (np.issubdtype(sdate, np.datetime64) and
             np.issubdtype(hdate, np.datetime64)):
-        dif_dates = soil_emissions.crop_duration()[1] - soil_emissions.crop_duration()[0]
+        dif_dates = hdate - sdate
         days = dif_dates.astype('timedelta64[D]') / np.timedelta64(1, 'D')
 
     else:
@@ -272,6 +508,7 @@ def ghg_from_rice(soil_emissions, fertiliser_data):
     return [ch4_kg_ch4_ha, rice_smanagement]
 
 
+@st.timed('N2O model')
 def calculate_n2o_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data):
     backgrounds_log_n2o = np.array([ef.constantN2O, soil_emissions.get_n2o_soil_organic_content(),
                                     soil_emissions.get_n2o_nh3_by_pH_content()[0],
@@ -298,6 +535,7 @@ def calculate_n2o_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data):
     return total_n2o_total_flux_kgN2Oha * ef.pc_N2O_MOT
 
 
+@st.timed('NO model')
 def calculate_no_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data):
     backgroundemission_log_no = np.array([soil_emissions.get_no_by_n_content(),
                                           ef.constantNO,
@@ -321,6 +559,7 @@ def calculate_no_ghg_from_soil_fertilizers(soil_emissions, fertiliser_data):
     return total_NO_total_flux_kgN2Oha * ef.pc_N2O_MOT
 
 
+@st.timed('NH3 model')
 def emissions_by_volatilization(soil_emissions, fertiliser_data):
     bowman_nh3 = ff.calculate_multiple_fertiliser_emissions(fertiliser_data.synthetic_products,
                                                             ef.fertilizers_factors,
@@ -329,13 +568,14 @@ def emissions_by_volatilization(soil_emissions, fertiliser_data):
 
     coefficients_per_product = []
 
+    ## soil terms are the same for all the products of the event
+    pH_nh3_content = soil_emissions.get_n2o_nh3_by_pH_content()[1]
+    climate_nh3_content = soil_emissions.get_n2o_no_by_climate()[2]
+    crop_nh3_content = soil_emissions.get_nh3_n2o_by_crop()[0]
+    cec_nh3 = soil_emissions.estimate_soil_cec()[1]
+
     for bowman, application, nammount in zip(bowman_nh3, fertiliser_data.nh3_emissions_by_application(),
                                              fertiliser_data.application_inN_synthetic):
-        pH_nh3_content = soil_emissions.get_n2o_nh3_by_pH_content()[1]
-        climate_nh3_content = soil_emissions.get_n2o_no_by_climate()[2]
-        crop_nh3_content = soil_emissions.get_nh3_n2o_by_crop()[0]
-        cec_nh3 = soil_emissions.estimate_soil_cec()[1]
-
         coeff_nh3 = np.sum([pH_nh3_content, climate_nh3_content, crop_nh3_content, cec_nh3, bowman, application])
         coefficients_per_product.append(math.exp(coeff_nh3) * nammount)
 
@@ -348,6 +588,7 @@ def emissions_by_volatilization(soil_emissions, fertiliser_data):
     return nh3_volatilization_kgN2Oha * ef.pc_N2O_MOT
 
 
+@st.timed('leaching model')
 def emissions_by_leaching(soil_emissions, fertiliser_data):
     filter_conditions = (ef.leachingfactors.iloc[:, 1] ==
                          soil_emissions._cl_eng_input.capitalize())
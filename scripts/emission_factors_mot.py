@@ -1,7 +1,11 @@
 import pandas as pd
 import numpy as np
+import atexit
 import os
+import pickle
+import hashlib
 from scripts import general_functions as gf
+from scripts import stage_timing as st
 
 pc_CO2 = 1
 pc_CH4 = 34  ## IPCC 2013 5th Assessement Report WG1
@@ -15,131 +19,364 @@ N_to_N2O = 44 / 28
 limestone_factor = 0.12
 urea_factor = 0.2
 
-### factors
-fertilizers_table = pd.read_excel(r'emission_factors/fertilizers_factors.xlsx')
+### WORKBOOKS
+## every factor table is sliced from one of these excel files
+
+FACTOR_WORKBOOKS = {
+    'fertilizers_table': r'emission_factors/fertilizers_factors.xlsx',
+    'rice_table': r'emission_factors/rice_factors.xlsx',
+    'inducedfertiliser_table': r'emission_factors/N2O_and NO_model_factors.xlsx',
+    'soil_ef_table': r'emission_factors/soil_factors.xlsx',
+    'crop_factors_file': r'emission_factors/crop_factors.xlsx',
+    'luc_table': r'emission_factors/luc_factors.xlsx',
+    'cec_table': r'emission_factors/cec_factors.xlsx'
+}
 
-fertilizers_factors = gf.subsetpandas_byvalues(fertilizers_table,
-                                               'Factors for fertilizers',
-                                               'Factors for inhibitors and Polymer-coated fertilizer', 1, addinitrow=3)
+## compiled snapshot of the factor tables, it is rebuilt when a workbook changes
+FACTOR_BUNDLE_PATH = r'emission_factors/factors_bundle.pkl'
+## increase it when the way in which tables are sliced changes
+FACTOR_BUNDLE_VERSION = 5
+
+
+def _subset(source, initpos, endpos, column_num, addinitrow=1, delendrow=1):
+    """factor table sliced from a source table using rows reference"""
+    return (source,
+            lambda table: gf.subsetpandas_byvalues(table, initpos, endpos, column_num,
+                                                   addinitrow=addinitrow, delendrow=delendrow))
+
+
+def _model_factor(variable, gas):
+    """single coefficient from the Stehfest and Bouwman model table"""
+    return ('inducedfertiliser_factors',
+            lambda table: table.loc[table.Variables == variable][gas].values[0])
+
+
+def _index(source, key_columns, value_columns, lowercase=False):
+    """dictionary index over a factor table for constant time lookups"""
+    return (source,
+            lambda table: gf.index_byvalues(table, key_columns, value_columns, lowercase=lowercase))
+
+
+def _language_index(source, language_columns, value_columns):
+    """dictionary index over a factor table for each language column, keys are in lower case"""
+    return (source,
+            lambda table: {column: gf.index_byvalues(table, column, value_columns, lowercase=True)
+                           for column in language_columns})
+
+
+## table name: (source table, function that builds the table from its source)
+## a source is either a workbook or another factor table
+FACTOR_TABLES = {
+    ### factors
+    'fertilizers_factors': _subset('fertilizers_table',
+                                   'Factors for fertilizers',
+                                   'Factors for inhibitors and Polymer-coated fertilizer', 1, addinitrow=3),
+
+    ### RICE FACTORS
+    'rice_factors': _subset('rice_table',
+                            'Empirical method factors',
+                            'IPCC  method factors', 1, addinitrow=1),
+    'rice_soilm_factors': _subset('rice_table',
+                                  'Management change_Rice based system',
+                                  'Management change_Cover cropping', 1, addinitrow=1),
+    'rice_covercrop_factors': _subset('rice_table',
+                                      'Management change_Cover cropping',
+                                      'Factors - SOC change/baseline', 1, addinitrow=1),
+    'rice_ofert_factors': _subset('rice_table',
+                                  'Factors - SOC change/baseline',
+                                  'end_table', 1, addinitrow=2, delendrow=0),
+
+    ## INHIBITORS
+    'inhibi_factors': _subset('fertilizers_table',
+                              'Factors for N2O emission change with N inhibitor',
+                              'Factors for NO emission change with N inhibitor', 1, addinitrow=0),
+    'inhibi_no_factors': _subset('fertilizers_table',
+                                 'Factors for NO emission change with N inhibitor',
+                                 'end_table', 1, addinitrow=0),
+
+    ### INDIRECT EMISSIONS BY FERTLISERS
+    'inducedfertiliser_factors': _subset('inducedfertiliser_table',
+                                         'Stehfest and Bouwman 2006',
+                                         'Factors for NH3 model', 1, addinitrow=1),
+    'nh3_factors_table': _subset('inducedfertiliser_table',
+                                 'Factors for NH3 model',
+                                 'Method of N application', 1, addinitrow=2, delendrow=-5),
+    'method_appl_nh3_options': _subset('nh3_factors_table',
+                                       'Method of N application',
+                                       'Method of N application', 0, addinitrow=-1, delendrow=-5),
+
+    'constantN2O': _model_factor('constant', 'N2O'),
+    'constantNO': _model_factor('constant', 'NO'),
+    'N_application_rate_constant': _model_factor('N application rate per kg N ha-1', 'N2O'),
+    'NO_application_rate_constant': _model_factor('N application rate per kg N ha-1', 'NO'),
+
+    ### SOIL PROPERTIES
+    'soil_properties': _subset('soil_ef_table', 'soil properties', 'end_table', 1),
+
+    'n2o_soc_options': _subset('inducedfertiliser_table',
+                               'SOC content (%)',
+                               'soil N content (%)', 1, addinitrow=-1),
+    'n_soc_options': _subset('inducedfertiliser_table',
+                             'soil N content (%)',
+                             'Soil pH', 1, addinitrow=-1),
+    'pH_n2o_options': _subset('inducedfertiliser_table',
+                              'Soil pH',
+                              'Soil texture', 1, addinitrow=-1),
+    'pH_nh3_options': _subset('nh3_factors_table',
+                              'Soil pH',
+                              'Climate', 0, addinitrow=-3),
+    'texture_n2o_options': _subset('inducedfertiliser_table',
+                                   'Soil texture',
+                                   'Climate', 1, addinitrow=-1),
+    'climate_options_table': _subset('inducedfertiliser_table',
+                                     'Climate',
+                                     'Crop type', 1, addinitrow=-1),
+    'cropbouwman_n2o_options_table': _subset('inducedfertiliser_table',
+                                             'Crop type',
+                                             'Length of experiment', 1, addinitrow=-1),
+    'climate_nh3_options': _subset('nh3_factors_table',
+                                   'Climate',
+                                   'Crop type', 0, addinitrow=-3),
+
+    'crop_factors': _subset('crop_factors_file', "Factors for crops",
+                            "Factors for calculating residue amount", 1, 1, 4),
+    'crop_nh3_options': _subset('nh3_factors_table',
+                                'Crop type',
+                                'CEC', 0, addinitrow=-3),
+
+    ### TILLAGE FACTORS
+    'tillage_factors': _subset('soil_ef_table',
+                               "Tillage change_All (except rice)",
+                               "Input practice change_All (except rice)", 1),
+
+    ### COVER CROP FACTORS
+    'cover_cropping_factors': _subset('soil_ef_table',
+                                      "Management change_Cover cropping",
+                                      "soil properties", 1),
+
+    ########### LUC
+    'luc_factors': _subset('luc_table',
+                           'land use change (LUC)',
+                           'end_table',
+                           1),
+
+    ######## burning residues
+    'ramount_factors_file': ('crop_factors_file', lambda table: table),
+    'ramount_factors': _subset('crop_factors_file',
+                               "Factors for calculating residue amount",
+                               "end_table", 1, addinitrow=3),
+
+    ######## cec
+    'cec_factors': _subset('cec_table',
+                           'Factors for CEC',
+                           'Factors for Limestone and Urea', 1, addinitrow=2),
+    'cec_nh3_options': _subset('nh3_factors_table',
+                               'CEC',
+                               'Method of N application', 0, addinitrow=-1, delendrow=1),
+
+    #### volatilization
+    'volatilizationfactors': _subset('inducedfertiliser_table',
+                                     'Factor for N volatilization and leaching',
+                                     'end_table', 5, addinitrow=0),
+
+    #### LEACHING
+    'leachingfactors': _subset('inducedfertiliser_table',
+                               'N leaching',
+                               'end_table', 3, addinitrow=1),
+
+    ### INDEXES
+    ## lookups used for each event, built from the tables above
+    'soil_properties_index': _language_index('soil_properties', ['eng_options', 'sp_options'],
+                                             [2, 3, 4, 5, 6]),
+    'n2o_soc_index': _index('n2o_soc_options', 1, 2),
+    'n_no_index': _index('n_soc_options', 1, 3),
+    'pH_n2o_index': _index('pH_n2o_options', 1, 2),
+    'pH_nh3_index': _index('pH_nh3_options', 0, 1),
+    'texture_n2o_index': _index('texture_n2o_options', 1, 2),
+    'climate_n2o_no_index': _index('climate_options_table', 1, [2, 3]),
+    'climate_nh3_index': _index('climate_nh3_options', 0, 1),
+    'crop_factors_index': _language_index('crop_factors', ['Crop', 'crop_spanish'],
+                                          ["Bouwman's equivalent", 'N content', 'Moisture content (%)']),
+    'crop_nh3_index': _index('crop_nh3_options', 0, 1, lowercase=True),
+    'cropbouwman_n2o_index': _index('cropbouwman_n2o_options_table', 1, 2, lowercase=True),
+    'cec_factors_index': _index('cec_factors', 1, 2),
+    'cec_nh3_index': _index('cec_nh3_options', 0, 1),
+    'tillage_factors_index': _index('tillage_factors', ['Climate', 'From_till', 'To_till'], 'Factor',
+                                    lowercase=True),
+    'tillage_climates': ('tillage_factors', lambda table: set(table.Climate.str.lower())),
+    'cover_cropping_index': _index('cover_cropping_factors', ['Climate', 'Change'], 'Factor',
+                                   lowercase=True),
+    'cover_cropping_climates': ('cover_cropping_factors', lambda table: set(table.Climate.str.lower())),
+    'luc_factors_index': _index('luc_factors', ['change-nr', 'Climate'], 'factor', lowercase=True),
+    'fertilizers_factors_index': _language_index('fertilizers_factors', ['fertiliser_sp', 'fertiliser_eng'],
+                                                 ['type', 'Product', 'N', 'Europe', 'China', 'Other',
+                                                  "Bouwman's estimate for NH3+", 'application_mehod',
+                                                  'rice_emission_factor']),
+    'inhibi_index': _index('inhibi_factors', 0, 'Upland', lowercase=True),
+    'inhibi_no_index': _index('inhibi_no_factors', 0, 'Upland', lowercase=True),
+    'method_appl_nh3_index': _index('method_appl_nh3_options', 0, 1, lowercase=True),
+    'leaching_climate_index': _index('leachingfactors', 1, 2),
+    'ramount_factors_index': _language_index('ramount_factors', ['Crop', 'crop_spanish'],
+                                             ['Slope_above ground residue',
+                                              'DRY(Dry matter fraction of harvested product)',
+                                              'Intercept_above ground residue',
+                                              'Ratio of belowground to aboveground residue'])
+}
 
-### RICE FACTORS
 
-rice_table = pd.read_excel(r'emission_factors/rice_factors.xlsx')
+def workbook_digest(name):
+    """content hash of an emission factor workbook, it is computed once per process"""
 
-rice_factors = gf.subsetpandas_byvalues(rice_table,
-                                               'Empirical method factors',
-                                               'IPCC  method factors', 1, addinitrow=1,)
+    if name not in _workbook_digests:
+        with open(FACTOR_WORKBOOKS[name], 'rb') as f:
+            _workbook_digests[name] = hashlib.sha256(f.read()).hexdigest()
 
-rice_soilm_factors = gf.subsetpandas_byvalues(rice_table,
-                                               'Management change_Rice based system' ,
-                                               'Management change_Cover cropping', 1, addinitrow=1)
+    return _workbook_digests[name]
 
-rice_covercrop_factors = gf.subsetpandas_byvalues(rice_table,
-                                               'Management change_Cover cropping' ,
-                                               'Factors - SOC change/baseline', 1, addinitrow=1)
 
-rice_ofert_factors = gf.subsetpandas_byvalues(rice_table,
-                                               'Factors - SOC change/baseline' ,
-                                               'end_table', 1, addinitrow=2,delendrow = 0)
+def workbooks_fingerprint(workbooks=FACTOR_WORKBOOKS):
+    """content hash of each emission factor workbook"""
 
+    return {name: workbook_digest(name) for name in workbooks}
 
-## INHIBITORS
 
+def source_workbook(name):
+    """workbook from which a factor table is sliced"""
 
-inhibi_factors = gf.subsetpandas_byvalues(fertilizers_table,
-                                          'Factors for N2O emission change with N inhibitor',
-                                          'Factors for NO emission change with N inhibitor', 1, addinitrow=0)
+    while name not in FACTOR_WORKBOOKS:
+        name = FACTOR_TABLES[name][0]
 
-inhibi_no_factors = gf.subsetpandas_byvalues(fertilizers_table,
-                                             'Factors for NO emission change with N inhibitor',
-                                             'end_table', 1, addinitrow=0)
+    return name
 
-### INDIRECT EMISSIONS BY FERTLISERS
-inducedfertiliser_table = pd.read_excel(r'emission_factors/N2O_and NO_model_factors.xlsx')
-inducedfertiliser_factors = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                                     'Stehfest and Bouwman 2006',
-                                                     'Factors for NH3 model', 1, addinitrow=1)
 
-nh3_factors_table = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                             'Factors for NH3 model',
-                                             'Method of N application', 1, addinitrow=2, delendrow=-5)
+def write_factor_bundle(bundle, bundle_path=None):
+    """write the compiled factor tables, the file is replaced atomically so that
+    concurrent workers never read a partial bundle"""
 
-method_appl_nh3_options = gf.subsetpandas_byvalues(nh3_factors_table,
-                                                   'Method of N application',
-                                                   'Method of N application', 0, addinitrow=-1, delendrow=-5)
+    bundle_path = FACTOR_BUNDLE_PATH if bundle_path is None else bundle_path
+    temp_path = '{}.{}.tmp'.format(bundle_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, bundle_path)
+    except OSError:
+        ## read only installations keep working, they just rebuild on every import
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
-constantN2O = inducedfertiliser_factors.loc[inducedfertiliser_factors.Variables == 'constant']['N2O'].values[0]
-constantNO = inducedfertiliser_factors.loc[inducedfertiliser_factors.Variables == 'constant']['NO'].values[0]
 
-N_application_rate_constant = inducedfertiliser_factors.loc[inducedfertiliser_factors.Variables ==
-                                                            'N application rate per kg N ha-1']['N2O'].values[0]
+def read_factor_bundle(bundle_path=None):
+    """read the compiled factor tables, an empty bundle is returned when the file
+    is missing, unreadable or was written by another FACTOR_BUNDLE_VERSION"""
 
-NO_application_rate_constant = inducedfertiliser_factors.loc[inducedfertiliser_factors.Variables ==
-                                                             'N application rate per kg N ha-1']['NO'].values[0]
+    bundle_path = FACTOR_BUNDLE_PATH if bundle_path is None else bundle_path
+    bundle = {'version': FACTOR_BUNDLE_VERSION, 'tables': {}}
+    if not os.path.exists(bundle_path):
+        return bundle
+    try:
+        with open(bundle_path, 'rb') as f:
+            stored_bundle = pickle.load(f)
+    except Exception:
+        ## a corrupted or incompatible bundle is rebuilt from the workbooks
+        return bundle
 
-### SOIL MANAGEMENT
+    if stored_bundle.get('version') == FACTOR_BUNDLE_VERSION:
+        bundle = stored_bundle
 
-### SOIL PROPERTIES
+    return bundle
 
-soil_ef_table = pd.read_excel(r'emission_factors/soil_factors.xlsx')
-soil_properties = gf.subsetpandas_byvalues(soil_ef_table, 'soil properties', 'end_table', 1)
 
-n2o_soc_options = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                           'SOC content (%)',
-                                           'soil N content (%)', 1, addinitrow=-1)
+def _factor_bundle():
+    if _bundle_cache.get('bundle') is None:
+        _bundle_cache['bundle'] = read_factor_bundle()
+        _bundle_cache['dirty'] = set()
 
-n_soc_options = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                         'soil N content (%)',
-                                         'Soil pH', 1, addinitrow=-1)
+    return _bundle_cache['bundle']
 
-pH_n2o_options = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                          'Soil pH',
-                                          'Soil texture', 1, addinitrow=-1)
 
-pH_nh3_options = gf.subsetpandas_byvalues(nh3_factors_table,
-                                          'Soil pH',
-                                          'Climate', 0, addinitrow=-3)
+def flush_factor_bundle():
+    """write the tables that were sliced again from the workbooks since the last flush.
+    The bundle on disk is read again and only those tables are replaced, so workers that
+    fill the bundle at the same time do not drop each other's tables"""
 
-texture_n2o_options = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                               'Soil texture',
-                                               'Climate', 1, addinitrow=-1)
+    dirty = _bundle_cache.get('dirty')
+    if not dirty:
+        return
+    bundle = read_factor_bundle()
+    for name in dirty:
+        bundle['tables'][name] = _bundle_cache['bundle']['tables'][name]
+    write_factor_bundle(bundle)
+    _bundle_cache['bundle'] = bundle
+    _bundle_cache['dirty'] = set()
 
-climate_options_table = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                                 'Climate',
-                                                 'Crop type', 1, addinitrow=-1)
 
-cropbouwman_n2o_options_table = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                                 'Crop type',
-                                                 'Length of experiment', 1, addinitrow=-1)
+@st.timed('factor tables')
+def get_factor_table(name):
+    """get a factor table by name. Tables are materialised on first access,
+    each one is taken from the bundle when its source workbook has not changed,
+    otherwise it is sliced again from the workbook and the bundle is updated"""
 
-climate_nh3_options = gf.subsetpandas_byvalues(nh3_factors_table,
-                                               'Climate',
-                                               'Crop type', 0, addinitrow=-3)
+    if name in globals():
+        return globals()[name]
 
-crop_factors_file = pd.read_excel(r'emission_factors/crop_factors.xlsx')
-crop_factors = gf.subsetpandas_byvalues(crop_factors_file, "Factors for crops",
-                                        "Factors for calculating residue amount", 1, 1, 4)
+    digest = workbook_digest(source_workbook(name))
+    bundle = _factor_bundle()
 
-crop_nh3_options = gf.subsetpandas_byvalues(nh3_factors_table,
-                                            'Crop type',
-                                            'CEC', 0, addinitrow=-3)
+    ## bundle entries are kept pickled, so only the tables that are used get decoded
+    entry = bundle['tables'].get(name)
+    if entry is not None and entry[0] == digest:
+        table = pickle.loads(entry[1])
+    else:
+        if name in FACTOR_WORKBOOKS:
+            table = pd.read_excel(FACTOR_WORKBOOKS[name])
+        else:
+            source, builder = FACTOR_TABLES[name]
+            table = builder(get_factor_table(source))
+
+        ## the bundle is written once by flush_factor_bundle, not after every table
+        bundle['tables'][name] = (digest, pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL))
+        _bundle_cache['dirty'].add(name)
+
+    globals()[name] = table
+    return table
 
-lengthexperimet_factors = {
-    'Per year (>300 days)': [1.991, 2.544],
-    'Per year (<300 days)': [0, 0]
-}
 
-### TILLAGE FACTORS
+def load_factor_tables(rebuild=False):
+    """materialise every factor table, e.g. before forking workers or for
+    building the bundle in advance"""
 
-tillage_factors = gf.subsetpandas_byvalues(soil_ef_table,
-                                           "Tillage change_All (except rice)",
-                                           "Input practice change_All (except rice)", 1)
+    if rebuild:
+        _bundle_cache['bundle'] = {'version': FACTOR_BUNDLE_VERSION, 'tables': {}}
+        _bundle_cache['dirty'] = set()
+        _workbook_digests.clear()
+        for name in list(FACTOR_WORKBOOKS) + list(FACTOR_TABLES):
+            globals().pop(name, None)
 
-### COVER CROP FACTORS
+    tables = {name: get_factor_table(name) for name in list(FACTOR_WORKBOOKS) + list(FACTOR_TABLES)}
+    flush_factor_bundle()
 
-cover_cropping_factors = gf.subsetpandas_byvalues(soil_ef_table,
-                                                  "Management change_Cover cropping",
-                                                  "soil properties", 1)
+    return tables
+
+
+def __getattr__(name):
+    """fertilizers_factors, rice_factors, luc_factors, ... are module attributes
+    that are loaded on first access"""
+
+    if name in FACTOR_WORKBOOKS or name in FACTOR_TABLES:
+        return get_factor_table(name)
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+_workbook_digests = {}
+_bundle_cache = {}
+## tables that are loaded one at a time are written when the process ends
+atexit.register(flush_factor_bundle)
+
+lengthexperimet_factors = {
+    'Per year (>300 days)': [1.991, 2.544],
+    'Per year (<300 days)': [0, 0]
+}
 
 ### organic fertliser tecnologies soc
 
@@ -149,13 +386,6 @@ factors_soc_change = {
     'residue': [0, 0.00131, 0, 0, 0.00131, 0]
 }
 
-########### LUC
-luc_table = pd.read_excel(r'emission_factors/luc_factors.xlsx')
-luc_factors = gf.subsetpandas_byvalues(luc_table,
-                                       'land use change (LUC)',
-                                       'end_table',
-                                       1)
-
 luc_options = {
     'forest to grassland': [1],
     'forest to arable': [2],
@@ -168,32 +398,3 @@ luc_options = {
 
 burned_CH4factor = 2.7
 burned_N2Ofactor = 0.07
-
-ramount_factors_file = pd.read_excel(r'emission_factors/crop_factors.xlsx')
-ramount_factors = gf.subsetpandas_byvalues(ramount_factors_file,
-                                           "Factors for calculating residue amount",
-                                           "end_table", 1, addinitrow=3)
-
-######## cec
-
-cec_table = pd.read_excel(r'emission_factors/cec_factors.xlsx')
-cec_factors = gf.subsetpandas_byvalues(cec_table,
-                                       'Factors for CEC',
-                                       'Factors for Limestone and Urea', 1, addinitrow=2)
-
-cec_nh3_options = gf.subsetpandas_byvalues(nh3_factors_table,
-                                           'CEC',
-                                           'Method of N application', 0, addinitrow=-1, delendrow=1)
-
-#### volatilization
-
-
-volatilizationfactors = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                                 'Factor for N volatilization and leaching',
-                                                 'end_table', 5, addinitrow=0)
-
-#### LEACHING
-
-leachingfactors = gf.subsetpandas_byvalues(inducedfertiliser_table,
-                                          'N leaching',
-                                            'end_table',3, addinitrow= 1)
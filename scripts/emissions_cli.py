@@ -0,0 +1,138 @@
+"""Command line runner, from the repository folder:
+
+    python -m scripts.emissions_cli run --general inputs.csv --fertiliser fertiliser_inputs.csv
+        --workers 8 --out emissions.parquet --format parquet
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+from scripts import stream_emissions as se
+
+
+def input_pairs(general_paths, fertiliser_paths):
+    """general information and fertiliser files that are gauged together, a single fertiliser
+    file is used for all the general information files"""
+    if len(fertiliser_paths) == 1:
+        fertiliser_paths = fertiliser_paths * len(general_paths)
+    if len(fertiliser_paths) != len(general_paths):
+        raise ValueError("give one fertiliser file for every general information file, or a single one for all")
+
+    return list(zip(general_paths, fertiliser_paths))
+
+
+class progress_report:
+    """events gauged so far, the lines are written to stderr"""
+
+    def update(self, nevents, input_path):
+        self.nevents += nevents
+        elapsed = time.perf_counter() - self.start
+        if self.enabled:
+            print("{}: {} events, {:.1f} s, {:.1f} events/s".format(
+                os.path.basename(str(input_path)), self.nevents, elapsed,
+                self.nevents / elapsed if elapsed > 0 else 0), file=self.stream, flush=True)
+
+    def __init__(self, enabled=True, stream=None):
+        self.enabled = enabled
+        self.stream = sys.stderr if stream is None else stream
+        self.nevents = 0
+        self.start = time.perf_counter()
+
+
+def run_emissions(general_paths, fertiliser_paths, output_path, output_format=None, n_workers=None,
+                  chunksize=10000, id_column_name='id_event', vectorized=False, progress=True,
+                  partition_columns=None, compression=se.PARQUET_COMPRESSION):
+    """Gauge the events of several input files chunk by chunk and write all the summaries to
+    a single csv or parquet file, or to a partitioned parquet dataset
+
+    :param general_paths: list of general information files
+    :param fertiliser_paths: list of fertiliser files, one for each general information file or a single one
+    :param output_path: csv or parquet file, or dataset folder when there are partition columns
+    :param output_format: csv or parquet, it is taken from the file extension when it is not given
+    :param n_workers: number of processes, all the cores are used by default
+    :param chunksize: number of rows read at a time
+    :param id_column_name: event identifier column
+    :param vectorized: gauge each chunk with the batch engine
+    :param progress: report the events gauged after each chunk
+    :param partition_columns: municipality or general information columns, e.g. ['crop']
+    :param compression: compression of the parquet files
+    :return: int: number of events written
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    pairs = input_pairs(general_paths, fertiliser_paths)
+    report = progress_report(progress)
+
+    if partition_columns:
+        writer = se.partitioned_emissions_writer(output_path, partition_columns, compression)
+    else:
+        writer = se.emissions_writer(output_path, output_format, compression)
+
+    with writer:
+        for general_path, fertilisers_path in pairs:
+            for summary, n_amount, crop_yield in se.stream_emissions(general_path, fertilisers_path, chunksize,
+                                                                     id_column_name, vectorized, n_workers,
+                                                                     partition_columns):
+                writer.write(summary)
+                report.update(summary.shape[0], general_path)
+
+    return writer.nevents
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(prog='python -m scripts.emissions_cli',
+                                     description="ghg emissions for multiple cropping events")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help="gauge the events of general information and fertiliser files")
+    run_parser.add_argument('--general', nargs='+', required=True,
+                            help="general information files (csv, parquet, feather or excel)")
+    run_parser.add_argument('--fertiliser', nargs='+', required=True,
+                            help="fertiliser files, one for each general information file or a single one")
+    run_parser.add_argument('--out', required=True, help="output file, or folder with --partition-by")
+    run_parser.add_argument('--format', choices=['csv', 'parquet'], default=None,
+                            help="output format, taken from the output extension by default, "
+                                 "datasets written with --partition-by are always parquet")
+    run_parser.add_argument('--partition-by', nargs='+', default=None,
+                            help="write a parquet dataset with a folder for each value of these columns, e.g. crop")
+    run_parser.add_argument('--compression', default=se.PARQUET_COMPRESSION,
+                            help="compression of the parquet files")
+    run_parser.add_argument('--workers', type=int, default=None, help="number of processes, all the cores by default")
+    run_parser.add_argument('--chunksize', type=int, default=10000, help="rows read at a time")
+    run_parser.add_argument('--id-column', default='id_event', help="event identifier column")
+    run_parser.add_argument('--vectorized', action='store_true', help="gauge each chunk with the batch engine")
+    run_parser.add_argument('--quiet', action='store_true', help="do not report the progress")
+
+    return parser
+
+
+def main(arguments=None):
+    parser = argument_parser()
+    args = parser.parse_args(arguments)
+
+    for path in args.general + args.fertiliser:
+        if not os.path.exists(path):
+            parser.error("input file {} does not exist".format(path))
+    if args.partition_by and args.format == 'csv':
+        parser.error("--partition-by writes a parquet dataset, it can not be used with --format csv")
+
+    ## the messages of each event are kept out of the standard output
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stderr):
+            nevents = run_emissions(args.general, args.fertiliser, args.out, args.format, args.workers,
+                                    args.chunksize, args.id_column, args.vectorized, not args.quiet,
+                                    args.partition_by, args.compression)
+    except ValueError as error:
+        print("error: {}".format(error), file=sys.stderr)
+        return 1
+
+    print("{} events written to {}".format(nevents, args.out))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
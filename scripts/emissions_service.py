@@ -0,0 +1,356 @@
+"""Local service that keeps the factor tables and rasters loaded between requests, from the
+repository folder:
+
+    python -m scripts.emissions_service --port 8765 --workers 4
+    python -m scripts.emissions_service --unix-socket /tmp/ghg_emissions.sock
+
+POST /emissions with a json body {"general_info": [{...}, ...], "fertilisers": [{...}, ...]}
+returns the emissions of each event by source. GET /health tells whether the service is up.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from scripts import climate_grid as cg
+from scripts import crop_ghg_emissions as ghg
+from scripts import emission_factors_mot as ef
+from scripts import general_functions as gf
+from scripts import soil_management as sme
+
+ARROW_STREAM_TYPE = 'application/vnd.apache.arrow.stream'
+## key of the events of a batch, events of different requests may share their identifiers
+BATCH_KEY_COLUMN = '_batch_key'
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class service_error(Exception):
+    """error that is returned to the client with an http status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def warm_up():
+    """load the factor tables and the climate grid or rasters once, it runs in each pool worker"""
+    ef.load_factor_tables()
+    try:
+        if cg.load_climate_grid() is None:
+            sme.get_climate_fromlayers(-75.0, 4.0)
+    except Exception as error:
+        print("climate rasters were not warmed up: {}".format(error))
+
+
+def batch_emissions(requests, id_column_name='id_event', vectorized=True):
+    """Gauge the events of several requests at once, the events are given batch keys so the
+    identifiers of different requests do not collide
+
+    :param requests: list of [general information, fertilisers] pandas dataframes
+    :param id_column_name: event identifier column
+    :param vectorized: use the batch engine, otherwise events are gauged one at a time
+    :return: list: summary, nitrogen applied by synthetic fertilisers and crop yield for each request
+    """
+    general_tables = []
+    fertiliser_tables = []
+    offset = 0
+    for general_info, fertilisers in requests:
+        codes, id_events = pd.factorize(general_info[id_column_name])
+        keys = pd.Series(np.where(codes >= 0, codes + offset, np.nan), index=general_info.index)
+        general_tables.append(general_info.assign(**{BATCH_KEY_COLUMN: keys}))
+        fertiliser_keys = pd.Index(id_events).get_indexer(fertilisers[id_column_name])
+        fertiliser_tables.append(fertilisers.assign(**{BATCH_KEY_COLUMN: np.where(fertiliser_keys >= 0,
+                                                                                fertiliser_keys + offset,
+                                                                                np.nan)}))
+        offset += len(id_events)
+
+    general_info = pd.concat(general_tables, ignore_index=True)
+    fertilisers = pd.concat(fertiliser_tables, ignore_index=True)
+    ## the messages of each event are kept out of the output of a long running service
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        summary, n_amount, crop_yield = ghg.tables_emissions(general_info, fertilisers, BATCH_KEY_COLUMN,
+                                                             vectorized)
+
+    ## summary rows follow the rows of the general information with an identifier
+    rows_request = np.repeat(np.arange(len(requests)), [i.shape[0] for i, _ in requests])
+    rows_request = rows_request[general_info[BATCH_KEY_COLUMN].notnull().values]
+    id_events = general_info[id_column_name].loc[general_info[BATCH_KEY_COLUMN].notnull()].values
+    summary = summary.reset_index(drop=True)
+    summary['id_event'] = id_events
+    n_amount = np.array(n_amount, dtype=float)
+    crop_yield = np.array(crop_yield, dtype=float)
+
+    return [[summary.loc[rows_request == i].reset_index(drop=True), n_amount[rows_request == i],
+             crop_yield[rows_request == i]] for i in range(len(requests))]
+
+
+def json_records(summary):
+    """summary rows as json records, missing values are null"""
+    return summary.astype(object).where(summary.notnull(), None).to_dict('records')
+
+
+def read_request_tables(body, content_type, headers, id_column_name='id_event'):
+    """general information and fertiliser tables of a request. Json bodies have general_info and
+    fertilisers lists of records, arrow bodies have both tables as ipc streams one after the other
+    and the length in bytes of the first one in the x-general-info-length header. Tables without
+    the columns that the engines read are refused"""
+    try:
+        if content_type == ARROW_STREAM_TYPE:
+            import pyarrow as pa
+            general_length = int(headers['x-general-info-length'])
+            general_info = pa.ipc.open_stream(body[:general_length]).read_all()
+            fertilisers = pa.ipc.open_stream(body[general_length:]).read_all()
+        else:
+            content = json.loads(body.decode('utf-8'))
+            general_info = pd.DataFrame(content['general_info'])
+            fertilisers = pd.DataFrame(content['fertilisers'])
+    except (KeyError, ValueError, TypeError) as error:
+        raise service_error(400, "request tables could not be read: {}".format(error))
+
+    general_info = gf.read_table(general_info)
+    fertilisers = gf.read_table(fertilisers, date_columns=[])
+    missing = []
+    for name, table, columns in [['general_info', general_info, ghg.GENERAL_INFO_COLUMNS],
+                                 ['fertilisers', fertilisers, ghg.FERTILISER_COLUMNS]]:
+        absent = [i for i in [id_column_name if i == 'id_event' else i for i in columns] if i not in table.columns]
+        if len(absent) > 0:
+            missing.append("{}: {}".format(name, ', '.join(absent)))
+    if len(missing) > 0:
+        raise service_error(400, "request tables are missing columns, {}".format('; '.join(missing)))
+
+    return [general_info, fertilisers]
+
+
+class emissions_service:
+    """Asyncio http service that gauges batches of events. Requests that arrive within a short
+    window are gauged together in a bounded process pool whose workers keep the factor tables
+    and rasters loaded.
+
+                   Parameters
+                   ----------
+
+                   n_workers : int
+                           processes of the pool
+
+                   vectorized : bool
+                           use the batch engine
+
+                   batch_window_ms : float
+                           time that a batch waits for more requests
+
+                   max_batch_events : int
+                           maximum number of events of a batch
+
+                   max_pending : int
+                           maximum number of requests waiting, more requests get a 503 response
+
+                   max_body_mb : float
+                           maximum size of a request body
+            """
+
+    async def gauge(self, general_info, fertilisers):
+        """emissions of the events of a request, it waits for the batch that takes it"""
+        if self._queue.qsize() >= self.max_pending:
+            raise service_error(503, "too many pending requests")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put([general_info, fertilisers, future])
+
+        return await future
+
+    async def batch_requests(self):
+        """take the pending requests in batches and send each batch to the pool, the number of
+        batches in the pool is bounded by the number of workers"""
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.n_workers)
+        while True:
+            batch = [await self._queue.get()]
+            nevents = batch[0][0].shape[0]
+            deadline = loop.time() + self.batch_window_ms / 1000
+            while nevents < self.max_batch_events:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                nevents += batch[-1][0].shape[0]
+
+            await slots.acquire()
+            task = loop.create_task(self.run_batch(batch))
+            task.add_done_callback(lambda _: slots.release())
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, batch_emissions,
+                                                 [[i[0], i[1]] for i in batch], self.id_column_name, self.vectorized)
+        except Exception as error:
+            ## a failing request makes the whole batch fail, so each request is tried alone
+            if len(batch) > 1:
+                for request in batch:
+                    await self.run_batch([request])
+                return
+            results = [service_error(500, "emissions could not be calculated: {!r}".format(error))]
+
+        for request, result in zip(batch, results):
+            if not request[2].done():
+                if isinstance(result, Exception):
+                    request[2].set_exception(result)
+                else:
+                    request[2].set_result(result)
+
+    async def respond(self, method, path, headers, body):
+        """status, content type and content of a response"""
+        if path == '/health':
+            return [200, 'application/json', json.dumps({'status': 'ok', 'workers': self.n_workers,
+                                                         'pending': self._queue.qsize(),
+                                                         'factor_bundle_version': ef.FACTOR_BUNDLE_VERSION})]
+        if path != '/emissions':
+            raise service_error(404, "unknown path {}".format(path))
+        if method != 'POST':
+            raise service_error(405, "emissions are requested with POST")
+
+        start = time.perf_counter()
+        ## large bodies are parsed in a thread, so the other connections are not held meanwhile
+        general_info, fertilisers = await asyncio.get_running_loop().run_in_executor(
+            None, read_request_tables, body, headers.get('content-type', ''), headers, self.id_column_name)
+        summary, n_amount, crop_yield = await self.gauge(general_info, fertilisers)
+
+        if ARROW_STREAM_TYPE in headers.get('accept', ''):
+            import pyarrow as pa
+            table = pa.Table.from_pandas(summary.assign(n_amount=n_amount, crop_yield=crop_yield),
+                                         preserve_index=False)
+            sink = io.BytesIO()
+            with pa.ipc.new_stream(sink, table.schema) as stream:
+                stream.write_table(table)
+            return [200, ARROW_STREAM_TYPE, sink.getvalue()]
+
+        return [200, 'application/json', json.dumps({
+            'emissions': json_records(summary),
+            'n_amount': [None if np.isnan(i) else i for i in n_amount.tolist()],
+            'crop_yield': [None if np.isnan(i) else i for i in crop_yield.tolist()],
+            'seconds': time.perf_counter() - start})]
+
+    async def handle_connection(self, reader, writer):
+        """http/1.1 connection, it is kept open while the client asks for it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path = request_line.decode('latin-1').split()[:2]
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0))
+                    if length > self.max_body_mb * 1024 * 1024:
+                        raise service_error(413, "request body is larger than {} mb".format(self.max_body_mb))
+                    body = await reader.readexactly(length)
+                    status, content_type, content = await self.respond(method, path.split('?')[0], headers, body)
+                except service_error as error:
+                    status, content_type, content = [error.status, 'application/json',
+                                                     json.dumps({'error': str(error)})]
+                    if status == 413:
+                        headers['connection'] = 'close'
+                except Exception as error:
+                    status, content_type, content = [500, 'application/json', json.dumps({'error': repr(error)})]
+
+                if isinstance(content, str):
+                    content = content.encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                    status, HTTP_REASONS.get(status, ''), content_type, len(content),
+                    'keep-alive' if keep_alive else 'close').encode('latin-1'))
+                writer.write(content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765, unix_socket=None):
+        """start the pool and the server, the pool workers are warmed up before the first request"""
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=warm_up)
+        await asyncio.gather(*[loop.run_in_executor(self._executor, time.sleep, 0.01)
+                               for _ in range(self.n_workers)])
+        self._batcher = loop.create_task(self.batch_requests())
+        if unix_socket is not None:
+            self._server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        else:
+            self._server = await asyncio.start_server(self.handle_connection, host, port)
+
+        return self._server
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        self._executor.shutdown()
+
+    async def serve_forever(self, host='127.0.0.1', port=8765, unix_socket=None):
+        server = await self.start(host, port, unix_socket)
+        print("ghg emissions service listening on {}".format(
+            unix_socket if unix_socket is not None else '{}:{}'.format(host, port)))
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop()
+
+    def __init__(self, n_workers=1, vectorized=True, batch_window_ms=5, max_batch_events=5000, max_pending=256,
+                 max_body_mb=64, id_column_name='id_event'):
+        self.n_workers = n_workers
+        self.vectorized = vectorized
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_events = max_batch_events
+        self.max_pending = max_pending
+        self.max_body_mb = max_body_mb
+        self.id_column_name = id_column_name
+        self._queue = None
+        self._executor = None
+        self._server = None
+        self._batcher = None
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='python -m scripts.emissions_service',
+                                     description="local service for ghg emissions of cropping events")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix-socket', default=None, help="listen on a unix socket instead of a tcp port")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="processes of the pool")
+    parser.add_argument('--serial', action='store_true', help="gauge the events one at a time")
+    parser.add_argument('--batch-window-ms', type=float, default=5)
+    parser.add_argument('--max-batch-events', type=int, default=5000)
+    parser.add_argument('--max-pending', type=int, default=256)
+    args = parser.parse_args(arguments)
+
+    service = emissions_service(args.workers, not args.serial, args.batch_window_ms, args.max_batch_events,
+                                args.max_pending)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
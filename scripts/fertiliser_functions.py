@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 from scripts import emission_factors_mot as ef
 from scripts import translations as tl
+from scripts import stage_timing as st
 
 
 def calculate_indiremissions_fertiliser_production(fertiliser, ammount_kg_ha,
@@ -65,6 +66,7 @@ def application_method(fert, emission_factors_table, col_name):
     return am
 
 
+@st.timed('fertiliser factor lookup')
 def calculate_multiple_fertiliser_emissions(fertiliser_list,
                                             emission_factors_table,
                                             fun_name='emissions_production',
@@ -143,6 +145,7 @@ def induced_emissions_by_inhibitor(inhibitor, n_ammount, inhibitor_factors, colu
     return n_ammount * inhibi_n2oproduct['Upland'].values[0]
 
 
+@st.timed('fertiliser factor lookup')
 def calculate_inhibitor_release_multiple(listoffertilisers, fert_factors_table,
                                          inhibitor_factors_table, fert_type='synthetic'):
     """gget N2O/NO inhibitor factors for multiple products among
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 from scripts import emission_factors_mot as ef
+from scripts import general_functions as gf
+from scripts import stage_timing as st
 from scripts import translations as tl
 from scripts import fertiliser_functions as ff
 from scripts import rice_estimations as rice
@@ -30,6 +32,7 @@ class fertiliser_management:
                    : str
            """
 
+    @st.timed('fertiliser splitting')
     def split_fertiliser_type(self):
 
         list_of_organicproducts = {}
@@ -101,6 +104,7 @@ class fertiliser_management:
         self.organic_products = list_of_organicproducts
         self.synthetic_products = list_of_syntheticproducts
 
+    @gf.memoized
     def calculate_emission_by_inhibitors(self):
 
         organic_inhi_n2o = ff.calculate_inhibitor_release_multiple(self.organic_products,
@@ -123,6 +127,7 @@ class fertiliser_management:
         return ([organic_inhi_n2o, synthetic_inhi_n2o,
                  organic_inhi_no, synthetic_inhi_no])
 
+    @gf.memoized
     def nh3_emissions_by_application(self):
         """ Calculate nh3 emission due to fertiliser application method"""
 
@@ -147,6 +152,7 @@ class fertiliser_management:
 
         return application_method_nh3
 
+    @gf.memoized
     def caco3_emissions_by_limestone_application(self):
 
         if self.language == "spanish":
@@ -205,6 +211,7 @@ class fertiliser_management:
         return [emission_factors,
                 org_splitted]
 
+    @gf.memoized
     def emissions_by_urea_application(self):
 
         if self.language == "spanish":
@@ -262,11 +269,12 @@ class fertiliser_management:
         self.total_n_application = np.array(self.application_inN_synthetic + self.application_inN_organic).sum()
 
         if self.total_n_application != 0:
-            self.weigthedsum = (np.array(self.calculate_emission_by_inhibitors()[0] +
-                                         self.calculate_emission_by_inhibitors()[1]).sum() / self.total_n_application)
-            self.weigthedsum_no = (np.array(self.calculate_emission_by_inhibitors()[2] +
-                                            self.calculate_emission_by_inhibitors()[
-                                                3]).sum() / self.total_n_application)
+            [organic_inhi_n2o, synthetic_inhi_n2o,
+             organic_inhi_no, synthetic_inhi_no] = self.calculate_emission_by_inhibitors()
+            self.weigthedsum = (np.array(organic_inhi_n2o +
+                                         synthetic_inhi_n2o).sum() / self.total_n_application)
+            self.weigthedsum_no = (np.array(organic_inhi_no +
+                                            synthetic_inhi_no).sum() / self.total_n_application)
         else:
             self.weigthedsum = 0
             self.weigthedsum_no = 0
@@ -1,6 +1,26 @@
+import functools
+import os
+
 import pandas as pd
 import numpy as np
 
+## columns that are read as dates in the general information, as excel does
+DATE_COLUMNS = ['sowing_date', 'harvest_date']
+
+
+def memoized(method):
+    """keep the result of a method without arguments in the object, so the
+    intermediate values of an event are computed once for all the calculations that use them"""
+    attribute = '_memo_' + method.__name__
+
+    @functools.wraps(method)
+    def memoized_method(self):
+        if attribute not in self.__dict__:
+            self.__dict__[attribute] = method(self)
+        return self.__dict__[attribute]
+
+    return memoized_method
+
 
 def subsetpandas_byvalues(df, initpos, endpos, column_num, addinitrow=1, delendrow=1):
     """subset a pandas dataframe using rows reference"""
@@ -20,3 +40,125 @@ def subsetpandas_byvalues(df, initpos, endpos, column_num, addinitrow=1, delendr
 
     return (subsetfactors.iloc[:, 1:].reset_index(drop=True))
 
+
+
+def index_byvalues(df, key_columns, value_columns, lowercase=False):
+    """build a dictionary index of a pandas dataframe so that a single value can be
+    looked up without scanning the table. Columns can be referred by position or name,
+    a list of key columns gives tuple keys and a list of value columns gives tuple values.
+    When a key is repeated the first row is kept, as .values[0] does"""
+
+    def get_column(column):
+        return df.iloc[:, column] if isinstance(column, int) else df[column]
+
+    def get_keys(column):
+        values = get_column(column).values
+        if lowercase:
+            values = [i.lower() if isinstance(i, str) else i for i in values]
+        return values
+
+    if isinstance(key_columns, list):
+        keys = list(zip(*[get_keys(column) for column in key_columns]))
+    else:
+        keys = get_keys(key_columns)
+
+    if isinstance(value_columns, list):
+        values = list(zip(*[get_column(column).values for column in value_columns]))
+    else:
+        values = get_column(value_columns).values
+
+    tableindex = {}
+    for key, value in zip(keys, values):
+        tableindex.setdefault(key, value)
+
+    return tableindex
+
+
+class event_slice_index:
+    """Partition a set of tables by an event identifier in a single pass, so the rows
+    of one event are taken by position instead of comparing the whole id column.
+
+                   Parameters
+                   ----------
+
+                   tables : dict
+                           pandas dataframes by name, each one with an event identifier column
+
+                   id_column_name : str
+                           event identifier column
+            """
+
+    def positions(self, event_id, table_name):
+        """row positions of an event in a table, an empty array when the event is not there"""
+        return self._positions[table_name].get(event_id, np.array([], dtype=int))
+
+    def get_slice(self, event_id, table_name):
+        """rows of an event in a table, keeping the original index"""
+        return self.tables[table_name].iloc[self.positions(event_id, table_name)]
+
+    def get_event(self, event_id):
+        """rows of an event in every table"""
+        return {table_name: self.get_slice(event_id, table_name) for table_name in self.tables.keys()}
+
+    def __contains__(self, event_id):
+        return any(event_id in self._positions[table_name] for table_name in self.tables.keys())
+
+    def __init__(self, tables, id_column_name='id_event'):
+        self.tables = tables
+        self.id_column_name = id_column_name
+        ## groupby indices gives the row positions of each event, missing ids are dropped
+        self._positions = {table_name: table.groupby(id_column_name, sort=False).indices
+                           for table_name, table in tables.items()}
+
+
+def file_format(path):
+    """table format given by the file extension, csv is assumed for unknown extensions"""
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension in ['.parquet', '.pq']:
+        return 'parquet'
+    if extension in ['.feather', '.arrow']:
+        return 'feather'
+    if extension in ['.xlsx', '.xls']:
+        return 'excel'
+
+    return 'csv'
+
+
+def parse_date_columns(table, date_columns=DATE_COLUMNS):
+    """text dates are converted as excel does with date cells"""
+    for column in date_columns:
+        if column in table.columns and not pd.api.types.is_datetime64_any_dtype(table[column]):
+            table[column] = pd.to_datetime(table[column], errors='coerce')
+
+    return table
+
+
+def read_table(source, input_format=None, date_columns=DATE_COLUMNS):
+    """Get a pandas dataframe from an input table
+
+    :param source: pandas dataframe, arrow table or path to an excel, csv, parquet or feather file
+    :param input_format: file format, when it is not given it is taken from the file extension
+    :param date_columns: columns that are converted to dates
+    :return: pandas dataframe
+    """
+
+    if isinstance(source, pd.DataFrame):
+        table = source.copy()
+    elif hasattr(source, 'to_pandas'):
+        ## arrow tables and record batches
+        table = source.to_pandas()
+    else:
+        if input_format is None:
+            input_format = file_format(source)
+        if input_format == 'excel':
+            table = pd.read_excel(source)
+        elif input_format == 'parquet':
+            table = pd.read_parquet(source)
+        elif input_format == 'feather':
+            table = pd.read_feather(source)
+        elif input_format == 'csv':
+            table = pd.read_csv(source)
+        else:
+            raise ValueError("input format {} is not supported".format(input_format))
+
+    return parse_date_columns(table, date_columns)
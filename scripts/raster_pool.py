@@ -0,0 +1,200 @@
+import collections
+import os
+import threading
+
+import numpy as np
+import rasterio as rio
+
+
+class raster_pool:
+    """Raster datasets that are kept open and their decoded blocks kept in memory, so reading
+    pixels of the same raster does not open the file nor decode the same block again. The
+    least recently used datasets and blocks are dropped above the limits. The files written
+    by this process (e.g. a new SoilGrids mosaic) are dropped with invalidate, a file that
+    changed on disk otherwise is noticed when its dataset is taken with check=True, which is
+    done once for each batch of points and not on every read.
+
+                   Parameters
+                   ----------
+
+                   max_open : int
+                           maximum number of open datasets
+
+                   cache_size_mb : float
+                           maximum memory of the decoded blocks
+            """
+
+    def dataset(self, raster_path, check=False):
+        """open dataset of a raster
+
+        :param check: open the raster again when its modification time or size changed since it was opened
+        """
+        return self._entry(raster_path, check)[0]
+
+    def read_window(self, raster_path, row, col, height, width):
+        """pixels of a window, the window is clipped to the raster as rasterio does"""
+        with self._lock:
+            entry = self._entry(raster_path)
+            dataset = entry[0]
+            rows = [max(row, 0), min(row + height, dataset.height)]
+            cols = [max(col, 0), min(col + width, dataset.width)]
+            values = np.empty((dataset.count, max(rows[1] - rows[0], 0), max(cols[1] - cols[0], 0)),
+                              dtype=dataset.dtypes[0])
+            if values.size == 0:
+                return values
+
+            block_height, block_width = dataset.block_shapes[0]
+            for block_row in range(rows[0] // block_height, (rows[1] - 1) // block_height + 1):
+                for block_col in range(cols[0] // block_width, (cols[1] - 1) // block_width + 1):
+                    block = self._block(entry, block_row, block_col)
+                    ## overlap of the window and the block in raster pixels
+                    top, left = block_row * block_height, block_col * block_width
+                    row_start, row_end = max(rows[0], top), min(rows[1], top + block.shape[1])
+                    col_start, col_end = max(cols[0], left), min(cols[1], left + block.shape[2])
+                    values[:, row_start - rows[0]:row_end - rows[0], col_start - cols[0]:col_end - cols[0]] = \
+                        block[:, row_start - top:row_end - top, col_start - left:col_end - left]
+
+            return values
+
+    def read_pixels(self, raster_path, rows, cols):
+        """values of pixels given their row and column arrays, which must be inside the raster.
+        The pixels are grouped by block so each block is taken once
+
+        :return: array of bands and pixels
+        """
+        with self._lock:
+            entry = self._entry(raster_path)
+            dataset = entry[0]
+            rows = np.asarray(rows, dtype=np.int64)
+            cols = np.asarray(cols, dtype=np.int64)
+            values = np.empty((dataset.count, len(rows)), dtype=dataset.dtypes[0])
+            if len(rows) == 0:
+                return values
+
+            block_height, block_width = dataset.block_shapes[0]
+            block_rows, block_cols = rows // block_height, cols // block_width
+            blocks, positions = np.unique(block_rows * (dataset.width // block_width + 1) + block_cols,
+                                          return_inverse=True)
+            order = np.argsort(positions, kind='stable')
+            starts = np.searchsorted(positions[order], np.arange(len(blocks) + 1))
+            for i in range(len(blocks)):
+                points = order[starts[i]:starts[i + 1]]
+                block_row, block_col = block_rows[points[0]], block_cols[points[0]]
+                block = self._block(entry, int(block_row), int(block_col))
+                values[:, points] = block[:, rows[points] - block_row * block_height,
+                                          cols[points] - block_col * block_width]
+
+            return values
+
+    def _entry(self, raster_path, check=False):
+        """open dataset, file signature and path of a raster, the file signature is only read
+        when the raster is opened or check is True, and then the dataset is opened again when
+        the modification time or size of the file changed"""
+        with self._lock:
+            self._check_process()
+            path = os.path.abspath(raster_path)
+            entry = self._datasets.get(path)
+            if entry is not None and check and entry[1] != file_signature(path):
+                self.invalidate(path)
+                entry = None
+            if entry is None:
+                if len(self._datasets) >= self.max_open:
+                    self._datasets.popitem(last=False)[1][0].close()
+                entry = self._datasets[path] = [rio.open(path), file_signature(path), path]
+                self.opened += 1
+            else:
+                self._datasets.move_to_end(path)
+
+            return entry
+
+    def _block(self, entry, block_row, block_col):
+        """decoded block of all the bands, as an array of bands, rows and columns"""
+        dataset, signature, path = entry
+        key = (path, signature, block_row, block_col)
+        values = self._blocks.get(key)
+        if values is None:
+            values = dataset.read(window=dataset.block_window(1, block_row, block_col))
+            self._blocks[key] = values
+            self._cache_bytes += values.nbytes
+            self.decoded += 1
+            while self._cache_bytes > self.cache_size_mb * 1024 * 1024 and len(self._blocks) > 1:
+                self._cache_bytes -= self._blocks.popitem(last=False)[1].nbytes
+        else:
+            self._blocks.move_to_end(key)
+            self.hits += 1
+
+        return values
+
+    def invalidate(self, raster_path):
+        """close a dataset and drop its blocks, e.g. after the file was written"""
+        with self._lock:
+            path = os.path.abspath(raster_path)
+            entry = self._datasets.pop(path, None)
+            if entry is not None:
+                entry[0].close()
+            for key in [i for i in self._blocks if i[0] == path]:
+                self._cache_bytes -= self._blocks.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            while self._datasets:
+                self._datasets.popitem()[1][0].close()
+            self._blocks.clear()
+            self._cache_bytes = 0
+
+    def _check_process(self):
+        """datasets opened before a fork are not shared with the child process, the blocks are kept"""
+        if self._pid != os.getpid():
+            self._datasets = collections.OrderedDict()
+            self._pid = os.getpid()
+
+    def __init__(self, max_open=32, cache_size_mb=256):
+        self.max_open = max_open
+        self.cache_size_mb = cache_size_mb
+        ## number of files opened, blocks decoded and blocks taken from the cache
+        self.opened = 0
+        self.decoded = 0
+        self.hits = 0
+        self._datasets = collections.OrderedDict()
+        self._blocks = collections.OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+
+def file_signature(path):
+    """modification time and size of a file"""
+    stats = os.stat(path)
+
+    return (stats.st_mtime_ns, stats.st_size)
+
+
+## pool shared by all the raster reads of a process
+_pool = raster_pool()
+
+
+def get_pool():
+    return _pool
+
+
+def configure(max_open=32, cache_size_mb=256):
+    """limits of the shared pool, the open datasets and blocks are dropped"""
+    global _pool
+    _pool.clear()
+    _pool = raster_pool(max_open, cache_size_mb)
+
+
+def dataset(raster_path, check=False):
+    return _pool.dataset(raster_path, check)
+
+
+def read_window(raster_path, row, col, height, width):
+    return _pool.read_window(raster_path, row, col, height, width)
+
+
+def read_pixels(raster_path, rows, cols):
+    return _pool.read_pixels(raster_path, rows, cols)
+
+
+def invalidate(raster_path):
+    _pool.invalidate(raster_path)
@@ -0,0 +1,121 @@
+import hashlib
+import numbers
+import os
+import pickle
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts import emission_factors_mot as ef
+
+## increase it when a change in the calculations makes the stored results obsolete
+RESULTS_CACHE_VERSION = 3
+
+
+def tables_digest(tables):
+    """content hash of a list of pandas dataframes, the values of each column are hashed with
+    its name, so the same rows give the same hash whatever the dtypes of the table they were
+    read from"""
+    digest = hashlib.sha256()
+    for table in tables:
+        for column in sorted(table.columns, key=str):
+            digest.update(repr(str(column)).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(normalised_values(table[column]), index=False).values.tobytes())
+        digest.update(b'|')
+
+    return digest.hexdigest()
+
+
+def normalised_values(column):
+    """numbers as float64 and any other value as a string, so the same values give the same
+    hash whatever the dtype of their column, e.g. an int column that was read back as float or
+    a column that only holds missing values"""
+    if not (pd.api.types.is_bool_dtype(column) or pd.api.types.is_numeric_dtype(column)):
+        values = [None if pd.isnull(i) else i for i in column]
+        if not all(isinstance(i, numbers.Number) for i in values if i is not None):
+            return pd.Series([None if i is None else str(i) for i in values], dtype=object)
+        column = pd.Series([np.nan if i is None else i for i in values], dtype=object)
+
+    return column.astype('float64')
+
+
+class event_results_cache:
+    """On-disk store of the results of single events, addressed by the content of the event
+    rows, the factor tables and the calculation mode. When the store grows above max_size_mb
+    the least recently used results are removed.
+
+                   Parameters
+                   ----------
+
+                   cache_path : str
+                           sqlite file where the results are kept
+
+                   max_size_mb : float
+                           maximum size of the stored results
+
+                   mode : str
+                           calculation mode, results of different modes are kept apart
+            """
+
+    def event_key(self, subset_generalinfo, subset_fertilisers):
+        """hash of the rows of an event together with the factors version"""
+        return hashlib.sha256((self._factors_key + tables_digest([subset_generalinfo,
+                                                                   subset_fertilisers])).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """stored results for a key, None when they are not in the cache"""
+        row = self._connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self._connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+
+        return pickle.loads(row[0])
+
+    def put(self, key, results):
+        value = pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)
+        self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                 (key, value, len(value), time.time()))
+
+    def size(self):
+        """bytes taken by the stored results"""
+        return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def evict(self):
+        """remove the least recently used results until the store is below its maximum size"""
+        excess = self.size() - self.max_size_mb * 1024 * 1024
+        if excess <= 0:
+            return
+        removed = 0
+        keys = []
+        for key, size in self._connection.execute('SELECT key, size FROM results ORDER BY last_used'):
+            keys.append((key,))
+            removed += size
+            if removed >= excess:
+                break
+        self._connection.executemany('DELETE FROM results WHERE key = ?', keys)
+
+    def commit(self):
+        self.evict()
+        self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def __init__(self, cache_path, max_size_mb=512, mode='serial'):
+        self.cache_path = cache_path
+        self.max_size_mb = max_size_mb
+
+        ## results depend on the factor tables and on the calculation mode
+        self._factors_key = repr([RESULTS_CACHE_VERSION, ef.FACTOR_BUNDLE_VERSION,
+                                  sorted(ef.workbooks_fingerprint().items()), mode])
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._connection = sqlite3.connect(cache_path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                 '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
@@ -0,0 +1,170 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from scripts import batch_emissions as be
+from scripts import emission_factors_mot as ef
+from scripts import fertiliser_practices as fp
+from scripts import general_functions as gf
+
+## management options that can be changed in a scenario
+SCENARIO_COLUMNS = ['n_rate_factor', 'tillage_input', 'inhibitor', 'residues_input']
+
+
+def scenario_grid(n_rate_factor=(1.0,), tillage_input=(None,), inhibitor=(None,), residues_input=(None,)):
+    """All the combinations of management alternatives, None keeps the option reported for each event
+
+    :param n_rate_factor: factors applied to the amount of the synthetic fertilisers
+    :param tillage_input: tillage options
+    :param inhibitor: inhibitor used with the synthetic fertilisers
+    :param residues_input: residue handling
+    :return: pandas dataframe with one row per scenario
+    """
+
+    return pd.DataFrame(list(itertools.product(n_rate_factor, tillage_input, inhibitor, residues_input)),
+                        columns=SCENARIO_COLUMNS)
+
+
+def option_codes(values):
+    """position of each scenario value among its distinct values, None is kept as an option"""
+    options = list(dict.fromkeys(values))
+
+    return [options, np.array([options.index(i) for i in values])]
+
+
+def scenario_emissions(general_info, fertilisers, scenarios=None, id_column_name='id_event', language="spanish",
+                       **options):
+    """Gauge ghg emissions of every event under a grid of management scenarios. The soil and climate
+    context of each event is resolved once, then the scenarios are evaluated as arrays of
+    events by scenarios.
+
+    :param general_info: general information of each event, see general_functions.read_table
+    :param fertilisers: fertilisers applied in each event, see general_functions.read_table
+    :param scenarios: pandas dataframe with the columns of scenario_grid, it is built from options when not given
+    :param id_column_name: event identifier column
+    :param language: language used in the input options
+    :param options: management alternatives passed to scenario_grid
+    :return: pandas dataframe with one row for each event and scenario
+    """
+
+    if scenarios is None:
+        scenarios = scenario_grid(**options)
+    scenarios = scenarios.reindex(columns=SCENARIO_COLUMNS).reset_index(drop=True)
+    scenarios['n_rate_factor'] = scenarios.n_rate_factor.astype(float).fillna(1.0)
+    scenarios = scenarios.astype(object).where(scenarios.notnull(), None)
+
+    general_info = gf.read_table(general_info)
+    fertilisers = gf.read_table(fertilisers, date_columns=[])
+    events = general_info.loc[general_info[id_column_name].notnull()]
+    events = events.drop_duplicates(id_column_name).reset_index(drop=True)
+    event_ids = events[id_column_name]
+
+    context = be.soil_context(events, language)
+    products = be.fertiliser_products(fertilisers.loc[fertilisers[id_column_name].isin(event_ids)],
+                                      id_column_name, language)
+    synthetic = products.loc[~products.organic]
+    organic = products.loc[products.organic]
+
+    ## sums by event for the reported amounts, the synthetic ones are scaled in each scenario
+    n_synthetic = be.sum_by_event(synthetic.n_amount, synthetic[id_column_name], event_ids)
+    n_organic = be.sum_by_event(organic.n_amount, organic[id_column_name], event_ids)
+    production = be.sum_by_event(synthetic.production, synthetic[id_column_name], event_ids)
+    urea_co2 = be.sum_by_event(synthetic.urea_co2, synthetic[id_column_name], event_ids)
+    soil_terms = be.soil_nitrogen_terms(context)
+    nh3_coefficients = be.nh3_by_event(products, soil_terms, event_ids, id_column_name)
+    organic_inhibitor_n2o = be.sum_by_event(organic.inhibitor_n2o, organic[id_column_name], event_ids)
+    organic_inhibitor_no = be.sum_by_event(organic.inhibitor_no, organic[id_column_name], event_ids)
+
+    ## inhibitors
+    inhibitor_options, inhibitor_codes = option_codes(scenarios.inhibitor)
+    inhibitor_n2o = np.zeros((len(event_ids), len(inhibitor_options)))
+    inhibitor_no = np.zeros((len(event_ids), len(inhibitor_options)))
+    for i, inhibitor in enumerate(inhibitor_options):
+        if inhibitor is None:
+            inhibitor_n2o[:, i] = be.sum_by_event(synthetic.inhibitor_n2o, synthetic[id_column_name], event_ids)
+            inhibitor_no[:, i] = be.sum_by_event(synthetic.inhibitor_no, synthetic[id_column_name], event_ids)
+        else:
+            inhibitor_n2o[:, i] = n_synthetic * ef.inhibi_index.get(inhibitor.lower(), np.nan)
+            inhibitor_no[:, i] = n_synthetic * ef.inhibi_no_index.get(inhibitor.lower(), np.nan)
+
+    ## tillage
+    tillage_options, tillage_codes = option_codes(scenarios.tillage_input)
+    tillage_soc_change = np.zeros((len(event_ids), len(tillage_options)))
+    til_eng_inputs = []
+    for i, tillage in enumerate(tillage_options):
+        if tillage is None:
+            til_eng_inputs.append(context.til_eng_input)
+            tillage_soc_change[:, i] = context.tillage_soc_change
+        else:
+            til_eng_input, tillage_soc_change[:, i] = be.tillage_soc_change(
+                pd.Series(tillage, index=events.index, dtype=object), events.time_using_tillage_system,
+                context.climate, context.soil_c_stock, language)
+            til_eng_inputs.append(til_eng_input)
+
+    ## burning residues
+    residues_options, residues_codes = option_codes(scenarios.residues_input)
+    burning_residues = np.zeros((len(event_ids), len(residues_options)))
+    for i, residues in enumerate(residues_options):
+        if residues is None:
+            burning_residues[:, i] = context.burning_residues
+        else:
+            burning_residues[:, i] = be.burning_residues(events.crop, context.crop_yield_kg_ha,
+                                                         pd.Series(residues, index=events.index, dtype=object),
+                                                         language)
+
+    ### SOIL MANAGEMENT
+    soc_changes = [context.cover_crop_soc_change.values]
+    org_amounts, org_years = be.get_organic_specific_amount(products, event_ids, id_column_name)
+    for org_type in fp.ORGANIC_FERTILISER_TYPES:
+        soc_changes.append(be.cumulative_organic_fertilizer_for20years(org_amounts[org_type].values,
+                                                                       context.soil_c_stock.values,
+                                                                       org_type,
+                                                                       org_years[org_type].values)[0])
+    soil_management_soc = np.round(np.minimum(tillage_soc_change,
+                                              np.array(soc_changes).min(axis=0)[:, np.newaxis]), 2)
+
+    #### RICE
+    methane = np.full(len(event_ids), np.nan)
+    rice_events = be.lower_values(context.crop).isin(["rice", "arroz"]).values
+    if rice_events.sum() > 0:
+        for i, til_eng_input in enumerate(til_eng_inputs):
+            rice_context = context.loc[rice_events].copy()
+            rice_context['til_eng_input'] = til_eng_input[rice_events]
+            rice_emissions, soil_management_soc[rice_events, i] = be.ghg_from_rice(
+                events.loc[rice_events], rice_context, products, id_column_name, language)
+        methane[rice_events] = rice_emissions
+
+    ### EVENTS BY SCENARIOS
+    n_rate_factor = scenarios.n_rate_factor.values.astype(float)[np.newaxis, :]
+    n_synthetic_scenario = n_synthetic[:, np.newaxis] * n_rate_factor
+    n_total = n_synthetic_scenario + n_organic[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weigthedsum = np.where(n_total != 0, (inhibitor_n2o[:, inhibitor_codes] * n_rate_factor +
+                                              organic_inhibitor_n2o[:, np.newaxis]) / n_total, 0)
+        weigthedsum_no = np.where(n_total != 0, (inhibitor_no[:, inhibitor_codes] * n_rate_factor +
+                                                 organic_inhibitor_no[:, np.newaxis]) / n_total, 0)
+
+    event_terms = {key: value[:, np.newaxis] for key, value in soil_terms.items()}
+    fertiliser_induced_field_emissions = (be.nitrogen_emissions(event_terms, n_total, n_synthetic_scenario,
+                                                                weigthedsum, weigthedsum_no,
+                                                                nh3_coefficients[:, np.newaxis] * n_rate_factor) +
+                                          urea_co2[:, np.newaxis] * n_rate_factor)
+
+    nscenarios = scenarios.shape[0]
+    results = pd.DataFrame({
+        'id_event': np.repeat(event_ids.values, nscenarios),
+        'municipality': np.repeat(events.municipality.values, nscenarios),
+        'scenario': np.tile(np.arange(nscenarios), len(event_ids))})
+    for column in SCENARIO_COLUMNS:
+        results[column] = np.tile(scenarios[column].values, len(event_ids))
+
+    results['Fertiliser production'] = np.round(production[:, np.newaxis] * n_rate_factor, 2).ravel()
+    results['Fertlises induced field emissions'] = np.round(fertiliser_induced_field_emissions, 2).ravel()
+    results['Soil Management'] = soil_management_soc[:, tillage_codes].ravel()
+    results['Soil Mining'] = be.soil_mining_emissions(context, n_total).ravel()
+    results['Land Use Change effect on soil'] = np.repeat(context.luc_effect_on_soil.values, nscenarios)
+    results['Burning residues'] = burning_residues[:, residues_codes].ravel()
+    results['Methane from rice'] = np.repeat(methane, nscenarios)
+
+    return results
@@ -4,9 +4,11 @@ import pandas as pd
 from scripts import emission_factors_mot as ef
 from scripts import translations as tl
 from scripts import soilgrid_functions as sgf
+from scripts import climate_grid as cg
 from scripts import general_functions as gf
 from scripts import fertiliser_practices as fp
 from scripts import rice_estimations as rice
+from scripts import stage_timing as st
 
 
 # SOILGRID_ORGANIC_CARBON_STOCK_PATH = "soilgrids/ocs_0_30cm_mean_southamerica.tif"
@@ -52,16 +54,8 @@ class soil_management_emissions:
             tipo_suelo = self.soil_inputs.soil.values[0]
 
             if tipo_suelo.lower() in [i.lower() for i in soil_type_options]:
-                self.soil_texture = ef.soil_properties.loc[
-                    ef.soil_properties[option_column].str.lower() == tipo_suelo].values[0][2]
-                self.soil_organic_c = ef.soil_properties.loc[
-                    ef.soil_properties[option_column].str.lower() == tipo_suelo].values[0][3]
-                self.n_content = ef.soil_properties.loc[
-                    ef.soil_properties[option_column].str.lower() == tipo_suelo].values[0][4]
-                self.pH_content = ef.soil_properties.loc[
-                    ef.soil_properties[option_column].str.lower() == tipo_suelo].values[0][5]
-                self.soil_bulk_density = ef.soil_properties.loc[
-                    ef.soil_properties[option_column].str.lower() == tipo_suelo].values[0][6]
+                [self.soil_texture, self.soil_organic_c, self.n_content,
+                 self.pH_content, self.soil_bulk_density] = ef.soil_properties_index[option_column][tipo_suelo.lower()]
         else:
             self.soil_organic_c = self.soil_inputs.soil_organic_content.values[0]
             self.n_content = self.soil_inputs.soil_n_content.values[0]
@@ -78,6 +72,7 @@ class soil_management_emissions:
 
             self.soil_organic_c = self.soil_inputs.soil_organic_content.values[0]
 
+    @gf.memoized
     def get_n2o_soil_organic_content(self):
         """ get N2O soil content due to soil organic"""
         attribute_temp = 'more than 3.0'
@@ -86,9 +81,10 @@ class soil_management_emissions:
         elif (float(self.soil_organic_c) >= 1.0) and (float(self.soil_organic_c) < 3.0):
             attribute_temp = '1.0-3.0'
 
-        soc_n2o_content = ef.n2o_soc_options.loc[ef.n2o_soc_options.iloc[:, 1] == attribute_temp].iloc[:, 2].values[0]
+        soc_n2o_content = ef.n2o_soc_index[attribute_temp]
         return soc_n2o_content
 
+    @gf.memoized
     def get_no_by_n_content(self):
         """ get No soil content due to soil organic"""
 
@@ -98,9 +94,10 @@ class soil_management_emissions:
         elif (float(self.n_content) >= 0.05) and (float(self.n_content) < 0.2):
             attribute_temp = '0.05-0.2'
 
-        n_no_content = ef.n_soc_options.loc[ef.n_soc_options.iloc[:, 1] == attribute_temp].iloc[:, 3].values[0]
+        n_no_content = ef.n_no_index[attribute_temp]
         return n_no_content
 
+    @gf.memoized
     def get_n2o_nh3_by_pH_content(self):
         """ get NH3 and N2O soil content due by pH"""
 
@@ -112,11 +109,12 @@ class soil_management_emissions:
         elif (float(self.pH_content) >= 7.3) and (float(self.pH_content) < 8.5):
             ph_attribute = '7.3-8.5'
 
-        pH_n2o_content = ef.pH_n2o_options.loc[ef.pH_n2o_options.iloc[:, 1] == ph_attribute].iloc[:, 2].values[0]
-        pH_nh3_content = ef.pH_nh3_options.loc[ef.pH_nh3_options.iloc[:, 0] == ph_attribute].iloc[:, 1].values[0]
+        pH_n2o_content = ef.pH_n2o_index[ph_attribute]
+        pH_nh3_content = ef.pH_nh3_index[ph_attribute]
 
         return ([pH_n2o_content, pH_nh3_content, ph_attribute])
 
+    @gf.memoized
     def rice_factors(self):
         """ rice factors"""
         years_tillage_tech = self.soil_inputs.time_using_tillage_system.values[0]
@@ -152,31 +150,24 @@ class soil_management_emissions:
 
         return ([rice_pH_factor, prew_factor, wr_factor, cl_factor, till_factor, cropadd_factor])
 
+    @gf.memoized
     def get_n2o_by_texture(self):
         """ get N2O soil content by texture"""
 
-        texture_n2o_content = \
-            ef.texture_n2o_options.loc[ef.texture_n2o_options.iloc[:, 1] == self.soil_texture.capitalize()].iloc[:,
-            2].values[
-                0]
+        texture_n2o_content = ef.texture_n2o_index[self.soil_texture.capitalize()]
         return (texture_n2o_content)
 
+    @gf.memoized
     def get_n2o_no_by_climate(self):
 
-        climate_n2o_content = \
-            ef.climate_options_table.loc[ef.climate_options_table.iloc[:, 1] == self._cl_eng_input.capitalize()
-                                         ].iloc[:, 2].values[0]
-        climate_no_content = \
-            ef.climate_options_table.loc[ef.climate_options_table.iloc[:, 1] == self._cl_eng_input.capitalize()
-                                         ].iloc[:, 3].values[0]
+        climate_n2o_content, climate_no_content = ef.climate_n2o_no_index[self._cl_eng_input.capitalize()]
 
-        climate_nh3_content = \
-            ef.climate_nh3_options.loc[ef.climate_nh3_options.iloc[:, 0] == self._cl_eng_input.capitalize()
-                                       ].iloc[:, 1].values[0]
+        climate_nh3_content = ef.climate_nh3_index[self._cl_eng_input.capitalize()]
 
         return [climate_n2o_content, climate_no_content,
                 climate_nh3_content]
 
+    @gf.memoized
     def get_nh3_n2o_by_crop(self):
 
         crop = self.soil_inputs.crop.values[0]
@@ -188,27 +179,21 @@ class soil_management_emissions:
 
         # major_class = ef.crop_factors['Major class'].loc[ef.crop_factors[col_name] == crop].values[0]
 
-        if crop.lower() in ef.crop_factors[col_name].str.lower().values:
-            bouwman_equi = ef.crop_factors["Bouwman's equivalent"].loc[
-                ef.crop_factors[col_name].str.lower().values == crop.lower()].values[0]
+        crop_factors = ef.crop_factors_index[col_name]
+        if crop.lower() in crop_factors:
+            bouwman_equi = crop_factors[crop.lower()][0]
         else:
-            bouwman_equi = ef.crop_factors["Bouwman's equivalent"].loc[
-                ef.crop_factors["crop_spanish"].str.lower().values == 'otro'].values[0]
+            bouwman_equi = ef.crop_factors_index["crop_spanish"]['otro'][0]
 
-        pos_list = list(ef.crop_nh3_options.iloc[:, 0].str.lower().values).index(bouwman_equi.lower())
-        crop_nh3_content = ef.crop_nh3_options.iloc[pos_list].values[1]
+        crop_nh3_content = ef.crop_nh3_index[bouwman_equi.lower()]
 
-        pos_list = list(ef.cropbouwman_n2o_options_table.iloc[:, 1].str.lower().values).index(bouwman_equi.lower())
-        crop_n2o_content = ef.cropbouwman_n2o_options_table.iloc[pos_list].values[2]
+        crop_n2o_content = ef.cropbouwman_n2o_index[bouwman_equi.lower()]
 
-        ### crop n content
-        crop_ncontent = \
-            ef.crop_factors["N content"].loc[ef.crop_factors[col_name].str.lower().values == crop.lower()].values[0]
-        ## crop Moisture content (%)
-        crop_harvestmoist = ef.crop_factors["Moisture content (%)"].loc[
-            ef.crop_factors[col_name].str.lower().values == crop.lower()].values[0]
+        ### crop n content and Moisture content (%)
+        crop_ncontent, crop_harvestmoist = crop_factors[crop.lower()][1:]
         return ([crop_nh3_content, crop_n2o_content, crop_ncontent, crop_harvestmoist])
 
+    @gf.memoized
     def get_n2o_no_by_experiment_length(self):
         """ by default less than 300 days to do change regarding the crop extension"""
 
@@ -217,14 +202,14 @@ class soil_management_emissions:
 
         return [lengthexpriment_n2ocontent, lengthexpriment_nocontent]
 
+    @gf.memoized
     def estimate_soil_cec(self):
 
         # pH
         ph_attribute = self.get_n2o_nh3_by_pH_content()[2]
-        ph_valueforcec = ef.cec_factors.loc[ef.cec_factors.iloc[:, 1] == ph_attribute].iloc[:, 2].values[0]
+        ph_valueforcec = ef.cec_factors_index[ph_attribute]
 
-        texture_factorforcec = \
-            ef.cec_factors.loc[ef.cec_factors.iloc[:, 1] == self.soil_texture.capitalize()].iloc[:, 2].values[0]
+        texture_factorforcec = ef.cec_factors_index[self.soil_texture.capitalize()]
         if self.soil_bulk_density != 0:
             estimated_soil_cec = ((-59 + 51 * ph_valueforcec) * self.soil_c_stock / 3000000 / self.soil_bulk_density +
                                   (30 + 4.4 * ph_valueforcec) * texture_factorforcec)
@@ -240,7 +225,7 @@ class soil_management_emissions:
         elif (float(estimated_soil_cec) >= 24) and (float(estimated_soil_cec) < 32):
             cec_attribute = '24-32'
 
-        cec_nh3 = ef.cec_nh3_options.loc[ef.cec_nh3_options.iloc[:, 0] == cec_attribute].iloc[:, 1].values[0]
+        cec_nh3 = ef.cec_nh3_index[cec_attribute]
 
         return [estimated_soil_cec, cec_nh3, cec_attribute]
 
@@ -280,27 +265,21 @@ class soil_management_emissions:
 
             til_eng_input = tl.tillage_options[1][tillage_options.index(tillage_input.lower())]
             self._til_eng_input = til_eng_input
-            to_tillagefilter = ef.tillage_factors.To_till.str.lower() == til_eng_input.lower()
-            defaulttillage = ef.tillage_factors.From_till.str.lower() == 'conventional tillage'
             print("Climate Classification: {}".format(self._cl_eng_input))
-            climatefilter = ef.tillage_factors.Climate.str.lower() == self._cl_eng_input.lower()
+            cl_eng_input = self._cl_eng_input
 
-            if climatefilter.sum() == 0:
+            if cl_eng_input.lower() not in ef.tillage_climates:
                 cl_eng_input = tl.world_climate_bouwman[1][tl.world_climate_bouwman[0].index(self._cl_eng_input)]
-                climatefilter = ef.tillage_factors.Climate.str.lower() == cl_eng_input.lower()
 
-            filter_conditions = climatefilter & defaulttillage & to_tillagefilter
-            if (np.array(filter_conditions).sum() != 0):
-                factor_change_20years = ef.tillage_factors.Factor.loc[
-                    climatefilter & defaulttillage & to_tillagefilter].values[0]
-            else:
-                factor_change_20years = 1
+            factor_change_20years = ef.tillage_factors_index.get(
+                (cl_eng_input.lower(), 'conventional tillage', til_eng_input.lower()), 1)
             self.tillage_soc_change = cumulative_socemissions_for_20years(years_tillage_tech,
                                                                           factor_change_20years,
                                                                           self.soil_c_stock)
         else:
             self.tillage_soc_change = [0]
 
+    @gf.memoized
     def burning_residues(self):
         """Gauging the emissions by burning residues"""
         burninginput = self.soil_inputs.residues_input.values[0]
@@ -312,14 +291,8 @@ class soil_management_emissions:
         else:
             col_name = "Crop"
 
-        slope_above_ground = ef.ramount_factors.loc[ef.ramount_factors[col_name].str.lower() == crop][
-            'Slope_above ground residue'].values[0]
-        drymatter_factor = ef.ramount_factors.loc[ef.ramount_factors[col_name].str.lower() == crop][
-            'DRY(Dry matter fraction of harvested product)'].values[0]
-        intercept_factor = ef.ramount_factors.loc[ef.ramount_factors[col_name].str.lower() == crop][
-            'Intercept_above ground residue'].values[0]
-        ratiobelowground_residue = ef.ramount_factors.loc[ef.ramount_factors[col_name].str.lower() == crop][
-            'Ratio of belowground to aboveground residue'].values[0]
+        [slope_above_ground, drymatter_factor,
+         intercept_factor, ratiobelowground_residue] = ef.ramount_factors_index[col_name][crop.lower()]
 
         above_residues = self.crop_yield_kg_ha / 1000 * slope_above_ground * drymatter_factor + intercept_factor
         belowground_residue = above_residues * ratiobelowground_residue
@@ -359,19 +332,13 @@ class soil_management_emissions:
             if luc_input.lower() in luc_options:
                 luc_eng_input = tl.luc_options[1][luc_options.index(luc_input.lower())]
 
-                changefilter = ef.luc_factors['change-nr'] == ef.luc_options[luc_eng_input][0]
-                climatefilter = ef.luc_factors.Climate.str.lower() == self._cl_eng_input.lower()
-                filter_conditions = climatefilter & changefilter
+                change_nr = ef.luc_options[luc_eng_input][0]
 
-                if np.array(filter_conditions).sum() != 0:
-                    luc_factor = ef.luc_factors.factor.loc[filter_conditions].values[0]
+                if (change_nr, self._cl_eng_input.lower()) in ef.luc_factors_index:
+                    luc_factor = ef.luc_factors_index[(change_nr, self._cl_eng_input.lower())]
                 else:
                     cl_eng_input = tl.world_climate_bouwman[1][tl.world_climate_bouwman[0].index(self._cl_eng_input)]
-
-                    changefilter = ef.luc_factors['change-nr'] == ef.luc_options[luc_eng_input][0]
-                    climatefilter = ef.luc_factors.Climate.str.lower() == cl_eng_input.lower()
-                    filter_conditions = climatefilter & changefilter
-                    luc_factor = ef.luc_factors.factor.loc[filter_conditions].values[0]
+                    luc_factor = ef.luc_factors_index[(change_nr, cl_eng_input.lower())]
 
                 self.luc_effect_on_soil = cumulative_socemissions_for_20years(luc_time, luc_factor, self.soil_c_stock)
         else:
@@ -406,18 +373,12 @@ class soil_management_emissions:
             self._cc_eng_input = cc_eng_input
             #cl_eng_input = tl.climate_options[1][climate_options.index(self._cl_eng_input.lower())]
 
-            covercropfilter = ef.cover_cropping_factors.Change.str.lower() == cc_eng_input.lower()
-            climatefilter = ef.cover_cropping_factors.Climate.str.lower() == self._cl_eng_input.lower()
+            cl_eng_input = self._cl_eng_input
 
-            if climatefilter.sum() == 0:
+            if cl_eng_input.lower() not in ef.cover_cropping_climates:
                 cl_eng_input = tl.world_climate_bouwman[1][tl.world_climate_bouwman[0].index(self._cl_eng_input)]
-                climatefilter = ef.cover_cropping_factors.Climate.str.lower() == cl_eng_input.lower()
 
-            filter_conditions = climatefilter & covercropfilter
-            if np.array(filter_conditions).sum() != 0:
-                factor_change_20years = ef.cover_cropping_factors.Factor.loc[filter_conditions].values[0]
-            else:
-                factor_change_20years = 1
+            factor_change_20years = ef.cover_cropping_index.get((cl_eng_input.lower(), cc_eng_input.lower()), 1)
 
             self.cover_crop_soc_change = cumulative_socemissions_for_20years(years_cropcover_tech,
                                                                              factor_change_20years,
@@ -425,6 +386,7 @@ class soil_management_emissions:
         else:
             self.cover_crop_soc_change = [0]
 
+    @gf.memoized
     def crop_duration(self):
         """Calculate crop duration using as a reference the sowing and
         harvesting dates"""
@@ -453,9 +415,15 @@ class soil_management_emissions:
 
         if (np.logical_not(pd.isnull(self._longitude)) and
                 np.logical_not(pd.isnull(self._latitude))):
-            climate_classification = get_climate_fromlayers(self._longitude,
-                                                            self._latitude)
-            self._cl_eng_input = mot_climate_classification(climate_classification)
+            grid = cg.load_climate_grid()
+            if grid is not None:
+                ## the class is taken from the precomputed climate grid
+                with st.stage('climate grid'):
+                    self._cl_eng_input = grid.climate_classes([self._longitude], [self._latitude])[0]
+            else:
+                climate_classification = get_climate_fromlayers(self._longitude,
+                                                                self._latitude)
+                self._cl_eng_input = mot_climate_classification(climate_classification)
 
         self.get_soil_properties()  ##.
 
@@ -474,45 +442,60 @@ class soil_management_emissions:
 
     def fill_with_gridsoilvalues(self):
 
-        soil_organic_stock = 0
-        soil_organic_content = 0
-        soil_bulk_density = 0
-        n_content = 0
-        pH_content = 0
+        return soilgrid_soil_properties(self._longitude, self._latitude,
+                                        self.n_content, self.pH_content)
 
-        if np.logical_not(pd.isnull(self._longitude) or
-                          pd.isnull(self._latitude)):
 
-            soil_organic_stock = sgf.get_soilgridpixelvalue("Soil organic carbon stock",
-                                                            self._longitude, self._latitude) * 1000
+@st.timed('soilgrids properties')
+def soilgrid_soil_properties(longitude, latitude, n_content=np.nan, pH_content=np.nan):
+    """ get soil properties from soilgrid, nitrogen and pH are only drawn when they are not provided
+    :param longitude: wgs 84 longitude
+    :param latitude: wgs 84 latitude
+    :return: list: soil organic carbon stock, bulk density, n content, pH and soil organic content
+    """
 
-            soil_bulk_density = sgf.get_soilgridpixelvalue("Bulk density",
-                                                           self._longitude, self._latitude) / 100
+    soil_organic_stock = 0
+    soil_organic_content = 0
+    soil_bulk_density = 0
+    input_n_content = n_content
+    input_pH_content = pH_content
+    n_content = 0
+    pH_content = 0
 
-            if pd.isnull(self.n_content):
-                n_content = sgf.get_soilgridpixelvalue("Nitrogen",
-                                                       self._longitude, self._latitude) / 1000
-            else:
-                n_content = self.n_content
+    if np.logical_not(pd.isnull(longitude) or
+                      pd.isnull(latitude)):
 
-            if pd.isnull(self.pH_content):
-                pH_content = sgf.get_soilgridpixelvalue("pH water",
-                                                        self._longitude, self._latitude) / 10
-            else:
-                pH_content = self.pH_content
+        soil_organic_stock = sgf.get_soilgridpixelvalue("Soil organic carbon stock",
+                                                        longitude, latitude) * 1000
 
-            soil_organic_content = sgf.get_soilgridpixelvalue("Organic carbon density",
-                                                              self._longitude, self._latitude) / 100
+        soil_bulk_density = sgf.get_soilgridpixelvalue("Bulk density",
+                                                       longitude, latitude) / 100
 
-        print(
-            "Soil properties were drawn from soilgrid\n bulk_density:{} n_content: {} pH_content: {}, soil_organic_content:{}".format(
-                soil_bulk_density,
-                n_content, pH_content,
-                soil_organic_content))
-        return [soil_organic_stock, soil_bulk_density,
-                n_content, pH_content, soil_organic_content]
+        if pd.isnull(input_n_content):
+            n_content = sgf.get_soilgridpixelvalue("Nitrogen",
+                                                   longitude, latitude) / 1000
+        else:
+            n_content = input_n_content
 
+        if pd.isnull(input_pH_content):
+            pH_content = sgf.get_soilgridpixelvalue("pH water",
+                                                    longitude, latitude) / 10
+        else:
+            pH_content = input_pH_content
 
+        soil_organic_content = sgf.get_soilgridpixelvalue("Organic carbon density",
+                                                          longitude, latitude) / 100
+
+    print(
+        "Soil properties were drawn from soilgrid\n bulk_density:{} n_content: {} pH_content: {}, soil_organic_content:{}".format(
+            soil_bulk_density,
+            n_content, pH_content,
+            soil_organic_content))
+    return [soil_organic_stock, soil_bulk_density,
+            n_content, pH_content, soil_organic_content]
+
+
+@st.timed('climate rasters')
 def get_climate_fromlayers(longitude, latitude):
     """ get climate classification from layers
     :param longitude: wgs 84 longitude
@@ -538,6 +521,23 @@ def get_climate_fromlayers(longitude, latitude):
     return [koppen_value, cliregion_value]
 
 
+@st.timed('climate rasters')
+def get_climate_fromlayers_points(longitudes, latitudes):
+    """ get climate classification values from layers for arrays of coordinates, as get_climate_fromlayers
+    :param longitudes: wgs 84 longitudes
+    :param latitudes: wgs 84 latitudes
+    :return: list of arrays: koppen classification and climateregion classification, points outside a layer take 0
+    """
+    koppen_path = "climate_classification/world_climate_class_koppen.tif"
+    koppen_values, koppen_inside, _ = sgf.sample_coordinates(koppen_path, longitudes, latitudes)
+
+    climateregion_path = "climate_classification/world_climate_regions_Sayre.tif"
+    cliregion_values, cliregion_inside, _ = sgf.sample_coordinates(climateregion_path, longitudes, latitudes)
+
+    return [np.where(koppen_inside, koppen_values, 0).astype(koppen_values.dtype),
+            np.where(cliregion_inside, cliregion_values, 0).astype(cliregion_values.dtype)]
+
+
 def cumulative_socemissions_for_20years(years_usingtec, factor_20years, soil_c_stock):
     """Function that calculates the soc changes for 20 years
     :param years_usingtec:
@@ -0,0 +1,182 @@
+import math
+import os
+import sqlite3
+import time
+
+from scripts import raster_pool as rp
+
+SOILGRID_CACHE_DIR = "temp/soilgrids"
+## width and height in degrees of the tiles that are downloaded and kept
+TILE_SIZE = 2
+
+
+def tile_id(longitude, latitude, tile_size=TILE_SIZE):
+    """column and row of the tile that holds a coordinate"""
+    return (int(math.floor(longitude / tile_size)), int(math.floor(latitude / tile_size)))
+
+
+def tile_bounds(tile, tile_size=TILE_SIZE):
+    """[min longitude, max longitude, min latitude, max latitude] of a tile"""
+    return [tile[0] * tile_size, (tile[0] + 1) * tile_size, tile[1] * tile_size, (tile[1] + 1) * tile_size]
+
+
+class soilgrid_tile_cache:
+    """SoilGrids tiles kept on disk, one file for each layer and tile of a fixed grid, so each
+    tile is only downloaded once across runs. The tiles are listed in an sqlite index and the
+    least recently used ones are removed when the cache grows above max_size_mb.
+
+                   Parameters
+                   ----------
+
+                   cache_dir : str
+                           folder of the tiles and the index
+
+                   max_size_mb : float
+                           disk quota of the tiles
+
+                   tile_size : float
+                           width and height of the tiles in degrees
+            """
+
+    def tile_path(self, layer, tile):
+        return os.path.join(self.cache_dir, layer, '{:g}deg_{}_{}.tif'.format(self.tile_size, *tile))
+
+    def get(self, layer, tile):
+        """path of a cached tile, None when it was not downloaded or was removed"""
+        path = self.tile_path(layer, tile)
+        if not os.path.exists(path):
+            self._used.discard(path)
+            return None
+        ## the use time is written once per process, reads of the same tile do not touch the index
+        if path not in self._used:
+            with self.connection() as connection:
+                updated = connection.execute('UPDATE tiles SET last_used = ? WHERE path = ?',
+                                             (time.time(), path)).rowcount
+            if updated == 0:
+                return None
+            self._used.add(path)
+
+        return path
+
+    def put(self, layer, tile, source_path):
+        """move a downloaded tile into the cache, the least recently used tiles are removed
+        when the quota is exceeded
+
+        :return: str: tile path
+        """
+        path = self.tile_path(layer, tile)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        rp.invalidate(path)
+        os.replace(source_path, path)
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)',
+                               (path, layer, tile[0], tile[1], os.path.getsize(path), time.time()))
+        self._used.add(path)
+        self.evict(keep=path)
+
+        return path
+
+    def size(self):
+        """bytes taken by the cached tiles"""
+        return self.connection().execute('SELECT COALESCE(SUM(size), 0) FROM tiles').fetchone()[0]
+
+    def protect(self, vrt_path, tile_paths):
+        """keep the tiles read by a VRT in the cache while the VRT file exists, see
+        soilgrid_functions.download_soilgrid_data"""
+        vrt_path = os.path.abspath(vrt_path)
+        with self.connection() as connection:
+            connection.execute('DELETE FROM vrt_tiles WHERE vrt_path = ?', (vrt_path,))
+            connection.executemany('INSERT OR IGNORE INTO vrt_tiles VALUES (?, ?)',
+                                   [(vrt_path, i) for i in tile_paths])
+
+    def protected(self):
+        """tiles read by the VRTs that still exist, the VRTs that were removed release their tiles"""
+        vrt_paths = [i[0] for i in self.connection().execute('SELECT DISTINCT vrt_path FROM vrt_tiles')]
+        removed = [(i,) for i in vrt_paths if not os.path.exists(i)]
+        if len(removed) > 0:
+            with self.connection() as connection:
+                connection.executemany('DELETE FROM vrt_tiles WHERE vrt_path = ?', removed)
+
+        return set(i[0] for i in self.connection().execute('SELECT DISTINCT path FROM vrt_tiles'))
+
+    def evict(self, keep=None):
+        """remove the least recently used tiles until the cache is below its quota, the tiles
+        of the VRTs are kept so the cache can stay above its quota while they exist"""
+        excess = self.size() - self.max_size_mb * 1024 * 1024
+        if excess <= 0:
+            return
+        keep = self.protected() | {keep}
+        removed = 0
+        paths = []
+        for path, size in self.connection().execute('SELECT path, size FROM tiles ORDER BY last_used'):
+            if path in keep:
+                continue
+            paths.append(path)
+            removed += size
+            if removed >= excess:
+                break
+        with self.connection() as connection:
+            connection.executemany('DELETE FROM tiles WHERE path = ?', [(i,) for i in paths])
+        for path in paths:
+            rp.invalidate(path)
+            self._used.discard(path)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def download_dir(self):
+        """folder where the tiles of this process are downloaded before they are moved into the cache"""
+        path = os.path.join(self.cache_dir, 'downloads', str(os.getpid()))
+        os.makedirs(path, exist_ok=True)
+
+        return path
+
+    def connection(self):
+        """index connection of this process, connections are not shared with forked processes"""
+        if self._pid != os.getpid():
+            self._connection = None
+            self._used = set()
+            self._pid = os.getpid()
+        if self._connection is None:
+            self._connection = sqlite3.connect(os.path.join(self.cache_dir, 'tiles.sqlite'), timeout=60)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS tiles (path TEXT PRIMARY KEY, layer TEXT, '
+                                     'tile_col INTEGER, tile_row INTEGER, size INTEGER, last_used REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS vrt_tiles (vrt_path TEXT, path TEXT, '
+                                     'PRIMARY KEY (vrt_path, path))')
+            self._connection.commit()
+
+        return self._connection
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def __init__(self, cache_dir=SOILGRID_CACHE_DIR, max_size_mb=2048, tile_size=TILE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self.tile_size = tile_size
+        os.makedirs(cache_dir, exist_ok=True)
+        self._connection = None
+        self._used = set()
+        self._pid = os.getpid()
+
+
+## tile cache used by get_soilgridpixelvalue
+_cache = {}
+
+
+def get_cache():
+    if _cache.get('cache') is None:
+        _cache['cache'] = soilgrid_tile_cache()
+
+    return _cache['cache']
+
+
+def configure(cache_dir=SOILGRID_CACHE_DIR, max_size_mb=2048, tile_size=TILE_SIZE):
+    """folder, disk quota and tile size of the tile cache"""
+    if _cache.get('cache') is not None:
+        _cache['cache'].close()
+    _cache['cache'] = soilgrid_tile_cache(cache_dir, max_size_mb, tile_size)
+
+    return _cache['cache']
@@ -1,12 +1,18 @@
 import rasterio as rio
 import requests
 import os
-import glob
-import sys
-from rasterio.merge import merge
+import threading
+import time
+import xml.etree.ElementTree as ET
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rasterio.coords import BoundingBox
 from shapely.geometry import Polygon
 
+from scripts import raster_pool as rp
+from scripts import soilgrid_cache as sgc
+from scripts import stage_timing as st
+
 SOIL_LAYERS = {"Organic carbon density": "ocd",
                "Soil organic carbon stock": "ocs",
                "Bulk density": "bdod",
@@ -22,97 +28,300 @@ SOIL_LAYERS = {"Organic carbon density": "ocd",
 AVAILABLE_DEPTHS = ["0-5"]
 ocs_depth = "0-30"
 
+## web coverage service of soilgrids, it can be pointed to a mirror
+SOILGRID_WCS_URL = "https://maps.isric.org/mapserv"
+## tiles that are downloaded at the same time
+SOILGRID_DOWNLOAD_THREADS = 8
+## tile requests are sent again up to SOILGRID_RETRIES times, waiting SOILGRID_BACKOFF seconds
+## after the first failure and twice as long after each of the next ones
+SOILGRID_RETRIES = 4
+SOILGRID_BACKOFF = 1.0
+## seconds to connect and to wait for each chunk of the answer
+SOILGRID_TIMEOUT = (10, 120)
+SOILGRID_CHUNK_BYTES = 1024 * 1024
+## gdal names of the raster data types, see write_vrt
+GDAL_DTYPES = {'uint8': 'Byte', 'int8': 'Int8', 'uint16': 'UInt16', 'int16': 'Int16', 'uint32': 'UInt32',
+               'int32': 'Int32', 'float32': 'Float32', 'float64': 'Float64'}
+## answers of a busy or failing service, the request is sent again
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+## http session of each process, see get_session
+_sessions = {}
+_session_lock = threading.Lock()
+## [coverage, tile] that could not be downloaded in this run, their events are not requested again
+_failed_tiles = set()
+
+
+class soilgrid_error(requests.RequestException):
+    """a soilgrid tile could not be downloaded, the coverage, bounds and http status (None when
+    there was no answer) are kept with the error"""
+
+    def __init__(self, coverage, bounds, message, status=None):
+        super().__init__("{} tile {}: {}".format(coverage, list(bounds), message))
+        self.coverage = coverage
+        self.bounds = list(bounds)
+        self.status = status
+
+
+def get_session():
+    """http session of a process, its connections are kept alive and shared by the download
+    threads, sessions are not shared with forked processes"""
+    with _session_lock:
+        session = _sessions.get(os.getpid())
+        if session is None:
+            _sessions.clear()
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                    pool_maxsize=max(SOILGRID_DOWNLOAD_THREADS, 10))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[os.getpid()] = session
+
+    return session
+
 
 def soilgrid_request(outputdir, layer, minlong, maxlong, minlat, maxlat):
+    """Download a soilgrid coverage subset as a GeoTIFF, the answer is written to disk by
+    chunks and failed requests are sent again after waiting SOILGRID_BACKOFF, 2 x SOILGRID_BACKOFF, ...
+
+    :param outputdir: destination folder
+    :param layer: soilgrid coverage, e.g. bdod_0-5cm_mean
+    :return: str: file path
+    :raises soilgrid_error: when the service refused the request or did not answer after
+    SOILGRID_RETRIES retries
+    """
     sproperty = layer[:layer.index('_')]
     ## set the url request
     url = (
-        "https://maps.isric.org/mapserv?map=/map/{}.map&SERVICE=WCS&VERSION=2.0.1&REQUEST=GetCoverage&COVERAGEID={}&FORMAT=image/tiff&SUBSET=long({},{})&SUBSET=lat({},{})&SUBSETTINGCRS=http://www.opengis.net/def/crs/EPSG/0/4326&OUTPUTCRS=http://www.opengis.net/def/crs/EPSG/0/4326").format(
+        SOILGRID_WCS_URL + "?map=/map/{}.map&SERVICE=WCS&VERSION=2.0.1&REQUEST=GetCoverage&COVERAGEID={}&FORMAT=image/tiff&SUBSET=long({},{})&SUBSET=lat({},{})&SUBSETTINGCRS=http://www.opengis.net/def/crs/EPSG/0/4326&OUTPUTCRS=http://www.opengis.net/def/crs/EPSG/0/4326").format(
         sproperty, layer, minlong, maxlong, minlat, maxlat)
 
-    r = requests.get(url)
     fileexportname = '{}_{}_{}_{}_{}_temp.tif'.format(layer, minlong, maxlong, minlat, maxlat)
     outputpath = os.path.join(outputdir, fileexportname)
-    if "200" in str(r):
-        with open(outputpath, 'wb') as f:
-            f.write(r.content)
-        #print(fileexportname + ' file was download')
-    else:
-        print(fileexportname + ' file was not posible to download\ncheck longitude and latitude distance or run again')
-
-
+    ## the file only takes its name once it is complete
+    partpath = '{}.{}.part'.format(outputpath, threading.get_ident())
+    bounds = [minlong, maxlong, minlat, maxlat]
+    error = None
+    for attempt in range(SOILGRID_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(SOILGRID_BACKOFF * 2 ** (attempt - 1))
+        try:
+            with get_session().get(url, stream=True, timeout=SOILGRID_TIMEOUT) as r:
+                if r.status_code != 200:
+                    ## the short error answer is read so the connection is kept alive
+                    r.content
+                    error = soilgrid_error(layer, bounds, "the service answered {} {}".format(
+                        r.status_code, r.reason), r.status_code)
+                    if r.status_code in RETRY_STATUS:
+                        continue
+                    ## e.g. a wrong coverage or subset, it is not requested again
+                    raise error
+                if 'xml' in r.headers.get('Content-Type', ''):
+                    raise soilgrid_error(layer, bounds, "the service answered with an exception report",
+                                         r.status_code)
+                with open(partpath, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=SOILGRID_CHUNK_BYTES):
+                        f.write(chunk)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as failure:
+            error = soilgrid_error(layer, bounds, "no answer, {}".format(failure))
+            if os.path.exists(partpath):
+                os.remove(partpath)
+            continue
+        os.replace(partpath, outputpath)
+
+        return outputpath
+
+    raise error
+
+
+@st.timed('raster sampling')
 def getCoordinatePixel(raster_path, lon, lat, n=1):
-    # open map
-    with rio.open(raster_path) as dataset:
-        # get pixel x+y of the coordinate
-        py, px = dataset.index(lon, lat)
-        # create 1x1px window of the pixel
-        window = rio.windows.Window(px - n // 2, py - n // 2, n, n)
-        # read rgb values of the window
-        clip = dataset.read(window=window)
+    ## the map is kept open and its decoded blocks in memory, see raster_pool
+    dataset = rp.dataset(raster_path)
+    # get pixel x+y of the coordinate
+    py, px = dataset.index(lon, lat)
+    # read the values of the nxn window of the pixel
+    clip = rp.read_window(raster_path, py - n // 2, px - n // 2, n, n)
 
     return (clip)
 
 
-def get_soilgridpixelvalue(layer, long, lat, donwload=True):
-    """ Get soilgrid data from either soilgrid repository or a local folder"""
+@st.timed('raster sampling')
+def sample_coordinates(raster_path, longitudes, latitudes, band=1):
+    """Pixel values of a raster for arrays of coordinates, the pixel indices of all the
+    points are taken from the affine transform at once and each block is read once
 
-    if donwload:
+    :param raster_path: raster file
+    :param longitudes: array of longitudes in the raster coordinate system
+    :param latitudes: array of latitudes in the raster coordinate system
+    :param band: band number
+    :return: list: pixel values, in the raster type, and masks of the points that are
+    inside the raster and of the points whose value is nodata or that are outside the raster or
+    have no coordinates. Points outside the raster take the nodata value, or 0 without it
+    """
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    ## the file is checked for changes once for all the points
+    dataset = rp.dataset(raster_path, check=True)
+    nodata = dataset.nodata
 
-        if not (os.path.exists("temp")):
-            os.mkdir("temp")
+    rows = np.full(len(longitudes), -1, dtype=np.int64)
+    cols = np.full(len(longitudes), -1, dtype=np.int64)
+    withcoordinates = np.isfinite(longitudes) & np.isfinite(latitudes)
+    if withcoordinates.any():
+        ## the same operation as dataset.index
+        rows[withcoordinates], cols[withcoordinates] = rio.transform.rowcol(
+            dataset.transform, longitudes[withcoordinates], latitudes[withcoordinates])
+    inside = withcoordinates & (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
 
-        long = float(long)
-        lat = float(lat)
-        increase = float(3)
-        minimum_longitude = (long - increase)
-        maximum_longitude = (long + increase)
-        minimum_latitude = (lat - increase)
-        maximum_latitude = (lat + increase) #if lat >= 0 else (lat + increase)
-        if layer == "Soil organic carbon stock":
-            depth = "0-30"
-        else:
-            depth = AVAILABLE_DEPTHS[0]
+    values = np.full(len(longitudes), 0 if nodata is None else nodata, dtype=dataset.dtypes[band - 1])
+    values[inside] = rp.read_pixels(raster_path, rows[inside], cols[inside])[band - 1]
 
-        final_name = "temp/{}_{}cm_mean.tif".format( SOIL_LAYERS[layer], depth)
-        if os.path.exists(final_name):
+    nodata_mask = ~inside
+    if nodata is not None:
+        nodata_mask |= values == nodata
+    if np.issubdtype(values.dtype, np.floating):
+        nodata_mask |= np.isnan(values)
 
-            coord_sys = [[long + 0.001, lat - 0.001],
-                         [long - 0.001, lat - 0.001],
-                         [long - 0.001, lat + 0.001],
-                         [long + 0.001, lat + 0.001]]
+    return [values, inside, nodata_mask]
 
-            pol_r = Polygon(coord_sys)
 
-            with rio.open(final_name) as src:
-                metada = src.meta.copy()
+def get_soilgridpixelvalue(layer, long, lat, donwload=True):
+    """ Get soilgrid data from either soilgrid repository or a local folder"""
 
-            percentage = get_intersetion_polygons(pol_r, getraster_boundingbox(metada))
+    if donwload:
 
-            if percentage > 90:
-                path = final_name
-            else:
-                path = download_soilgrid_data("temp",
-                                      layer,
-                                      [minimum_longitude, maximum_longitude,
-                                       minimum_latitude, maximum_latitude],
-                                      depth=depth)
-        else:
-            path = download_soilgrid_data("temp",
-                                          layer,
-                                          [minimum_longitude, maximum_longitude,
-                                           minimum_latitude, maximum_latitude],
-                                          depth=depth)
+        long = float(long)
+        lat = float(lat)
+        path = soilgrid_tile(soilgrid_coverage(layer), long, lat)
+        if path is None:
+            return np.nan
 
     soilgridvalue = getCoordinatePixel(path, long, lat)
 
+    ## soilgrid layers are int16, they are taken as floats so the soil calculations do not overflow
     if len(soilgridvalue[0]) > 0:
-        soilgridvalue = soilgridvalue[0][0][0]
+        soilgridvalue = float(soilgridvalue[0][0][0])
     else:
         soilgridvalue = 0
     return soilgridvalue
 
 
+def soilgrid_tile(layer, long, lat):
+    """path of the cached tile of a layer that holds a coordinate, the tile is downloaded
+    when it is not in the cache, see soilgrid_cache
+
+    :param layer: soilgrid coverage, e.g. bdod_0-5cm_mean
+    :return: str: tile path, None when it could not be downloaded
+    """
+    cache = sgc.get_cache()
+    tile = sgc.tile_id(long, lat, cache.tile_size)
+    path = cache.get(layer, tile)
+    if path is None and (layer, tile) in _failed_tiles:
+        return None
+    if path is None:
+        try:
+            with st.stage('soilgrids download'):
+                downloaded = soilgrid_request(cache.download_dir(), layer, *sgc.tile_bounds(tile, cache.tile_size))
+        except soilgrid_error as error:
+            ## the event takes missing soil values instead of stopping the whole run
+            print("{}, the soil values of ({}, {}) are missing".format(error, long, lat))
+            _failed_tiles.add((layer, tile))
+            return None
+        path = cache.put(layer, tile, downloaded)
+
+    return path
+
+
+def soilgrid_coverage(layer):
+    """coverage of a soilgrid layer, soil organic carbon stock is only available for 0-30 cm"""
+    depth = ocs_depth if layer == "Soil organic carbon stock" else AVAILABLE_DEPTHS[0]
+
+    return "{}_{}cm_mean".format(SOIL_LAYERS[layer], depth)
+
+
+def plan_soilgrid_tiles(layer_coordinates):
+    """Tiles that hold the coordinates of each layer and are not in the cache, each tile is
+    listed once however many events fall in it
+
+    :param layer_coordinates: dict: soilgrid layer and [longitudes, latitudes]
+    :return: list of [coverage, tile]
+    """
+    cache = sgc.get_cache()
+    plan = []
+    for layer, (longitudes, latitudes) in layer_coordinates.items():
+        coverage = soilgrid_coverage(layer)
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        withcoordinates = np.isfinite(longitudes) & np.isfinite(latitudes)
+        tiles = np.unique(np.floor(np.column_stack([longitudes[withcoordinates],
+                                                    latitudes[withcoordinates]]) / cache.tile_size), axis=0)
+        for tile in tiles.astype(int):
+            tile = (int(tile[0]), int(tile[1]))
+            if cache.get(coverage, tile) is None:
+                plan.append([coverage, tile])
+
+    return plan
+
+
+@st.timed('soilgrids download')
+def fetch_soilgrid_tiles(layer_coordinates, n_threads=None, progress=True):
+    """Download the missing tiles of the soilgrid layers at the same time in a bounded pool
+    of threads, the tiles are moved into the cache as they arrive
+
+    :param layer_coordinates: dict: soilgrid layer and [longitudes, latitudes]
+    :param n_threads: tiles downloaded at the same time, SOILGRID_DOWNLOAD_THREADS by default
+    :param progress: print the tiles downloaded so far
+    :return: list: downloaded and failed [coverage, tile] lists, the events of failed tiles take
+    missing soil values
+    """
+    plan = plan_soilgrid_tiles(layer_coordinates)
+    _failed_tiles.clear()
+
+    return download_soilgrid_tiles(plan, n_threads, progress)
+
+
+def download_soilgrid_tiles(plan, n_threads=None, progress=True):
+    """Download [coverage, tile] pairs into the tile cache in a bounded pool of threads
+
+    :return: list: downloaded and failed [coverage, tile] lists
+    """
+    downloaded, failed = [], []
+    if len(plan) == 0:
+        return [downloaded, failed]
+
+    cache = sgc.get_cache()
+    download_dir = cache.download_dir()
+    n_threads = SOILGRID_DOWNLOAD_THREADS if n_threads is None else n_threads
+    report_every = max(1, len(plan) // 20)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = {executor.submit(soilgrid_request, download_dir, coverage,
+                                   *sgc.tile_bounds(tile, cache.tile_size)): [coverage, tile]
+                   for coverage, tile in plan}
+        for future in as_completed(futures):
+            coverage, tile = futures[future]
+            try:
+                path = future.result()
+            except soilgrid_error as error:
+                print(error)
+                path = None
+            ## the index is only written from this thread
+            if path is None:
+                failed.append([coverage, tile])
+                _failed_tiles.add((coverage, tile))
+            else:
+                cache.put(coverage, tile, path)
+                downloaded.append([coverage, tile])
+            done = len(downloaded) + len(failed)
+            if progress and (done % report_every == 0 or done == len(plan)):
+                print("{}/{} soilgrid tiles were downloaded, {:.1f} s".format(
+                    len(downloaded), len(plan), time.perf_counter() - start))
+
+    return [downloaded, failed]
+
+
+@st.timed('soilgrids download')
 def download_soilgrid_data(output_path, soillayer, boundary_box, depth="0-5"):
     """Dowload a soilgrid layer data using a boundary box
     for more information please check out https://soilgrids.org/
@@ -129,7 +338,8 @@ def download_soilgrid_data(output_path, soillayer, boundary_box, depth="0-5"):
 
     Output
           ----------
-          Tiff files
+          VRT file that reads the cached tiles of the boundary box, the tiles stay in the
+          tile cache (see soilgrid_cache) and are not removed while the VRT exists
 
     """
 
@@ -137,76 +347,85 @@ def download_soilgrid_data(output_path, soillayer, boundary_box, depth="0-5"):
     layer = SOIL_LAYERS[soillayer]
     ## exception for Soil organic carbon stock
     if layer == "ocs" and depth != "0-30":
-        print("0-30cm depth is the only one available for this product {}".format(soillayer))
-        sys.exit(1)
+        raise ValueError("0-30cm depth is the only one available for this product {}".format(soillayer))
 
     layer = "{}_{}cm_mean".format(layer, depth)
 
-    ## setting longitudes and latitudes
-
+    ## the tiles are kept in the tile cache, only the missing ones are downloaded
+    cache = sgc.get_cache()
     minlong, maxlong, minlat, maxlat = boundary_box
-
-    lat = minlat
-
-    while lat < maxlat:
-        long = minlong
-        mn_lat = lat
-        mx_lat = lat + 2
-
-        while long < maxlong:
-            mn_long = long
-            mx_long = long + 2
-            soilgrid_request(output_path, layer, mn_long, mx_long, mn_lat, mx_lat)
-            long += 2
-        lat += 2
-
-    ## merge tiles
-    pattern = '*temp.tif'
-    files_to_mosaic = glob.glob(os.path.join(output_path, pattern))
-    image, metadaa = merge_tiles(files_to_mosaic)
-    fileexportname = '{}.tif'.format(layer)
-
-    ## write file
-    out_fp = os.path.join(output_path, fileexportname)
-    with rio.open(out_fp, "w", **metadaa) as dest:
-        dest.write(image)
-
-    print(fileexportname + ' file was created')
-
-    ## remove temporary files
-    remove_files(files_to_mosaic)
+    first_tile = sgc.tile_id(minlong, minlat, cache.tile_size)
+    last_tile = [int(np.ceil(maxlong / cache.tile_size)) - 1, int(np.ceil(maxlat / cache.tile_size)) - 1]
+    tiles = [(col, row) for row in range(first_tile[1], max(last_tile[1], first_tile[1]) + 1)
+             for col in range(first_tile[0], max(last_tile[0], first_tile[0]) + 1)]
+    _, failed = download_soilgrid_tiles([[layer, tile] for tile in tiles if cache.get(layer, tile) is None])
+    if len(failed) > 0:
+        raise soilgrid_error(layer, boundary_box, "{} of {} tiles could not be downloaded".format(
+            len(failed), len(tiles)))
+    tile_paths = [cache.get(layer, tile) for tile in tiles]
+    if None in tile_paths:
+        raise soilgrid_error(layer, boundary_box, "the area needs more tiles than the cache quota, "
+                                                  "see soilgrid_cache.configure")
+
+    ## the mosaic is a virtual raster that reads the cached tiles, no pixels are written
+    out_fp = os.path.join(output_path, '{}.vrt'.format(layer))
+    ## the previous mosaic is closed before it is written again
+    rp.invalidate(out_fp)
+    write_vrt(tile_paths, out_fp)
+    ## the tiles of the mosaic are not removed from the cache while the file exists
+    cache.protect(out_fp, tile_paths)
+
+    print('{}.vrt file was created'.format(layer))
 
     return out_fp
 
 
-def remove_files(file_list):
-    for fp in file_list:
-        os.remove(fp)
-
-
-def merge_tiles(rasterfilepaths):
-    """ Function created for merging multiple raster files using
-    rasterio"""
+def write_vrt(rasterfilepaths, output_path):
+    """Write a GDAL virtual raster (VRT) that places each raster at its bounds, the rasters
+    must share the crs and bands, the resolution of the first one is taken. Only the headers
+    of the rasters are read, so the file size grows with the number of rasters and not with
+    their pixels
 
-    ## reading files
-    src_files_to_mosaic = []
+    :return: str: VRT path
+    """
+    sources = []
     for fp in rasterfilepaths:
-        src = rio.open(fp)
-        src_files_to_mosaic.append(src)
-
-    mosaic, out_trans = merge(src_files_to_mosaic)
-
-    out_meta = src.meta.copy()
-
-    # Update the metadata
-    out_meta.update({"driver": "GTiff",
-                     "height": mosaic.shape[1],
-                     "width": mosaic.shape[2],
-                     "transform": out_trans,
-                     "crs": src.meta.copy()['crs']
-                     })
-
-    return [mosaic, out_meta]
+        with rio.open(fp) as src:
+            sources.append([os.path.abspath(fp), src.bounds, src.width, src.height,
+                            src.res, src.count, src.dtypes[0], src.nodata, src.crs])
+    xres, yres = sources[0][4]
+    left = min(i[1].left for i in sources)
+    top = max(i[1].top for i in sources)
+    right = max(i[1].right for i in sources)
+    bottom = min(i[1].bottom for i in sources)
+
+    dataset = ET.Element('VRTDataset', rasterXSize=str(int(round((right - left) / xres))),
+                         rasterYSize=str(int(round((top - bottom) / yres))))
+    ET.SubElement(dataset, 'SRS').text = sources[0][8].to_wkt()
+    ET.SubElement(dataset, 'GeoTransform').text = ', '.join(
+        repr(float(i)) for i in [left, xres, 0, top, 0, -yres])
+    for band in range(1, sources[0][5] + 1):
+        vrtband = ET.SubElement(dataset, 'VRTRasterBand', dataType=GDAL_DTYPES[sources[0][6]], band=str(band))
+        if sources[0][7] is not None:
+            ET.SubElement(vrtband, 'NoDataValue').text = repr(sources[0][7])
+        for fp, bounds, width, height, _, _, _, nodata, _ in sources:
+            source = ET.SubElement(vrtband, 'ComplexSource')
+            ET.SubElement(source, 'SourceFilename', relativeToVRT='0').text = fp
+            ET.SubElement(source, 'SourceBand').text = str(band)
+            ET.SubElement(source, 'SrcRect', xOff='0', yOff='0', xSize=str(width), ySize=str(height))
+            ET.SubElement(source, 'DstRect', xOff=repr((bounds.left - left) / xres),
+                          yOff=repr((top - bounds.top) / yres),
+                          xSize=repr((bounds.right - bounds.left) / xres),
+                          ySize=repr((bounds.top - bounds.bottom) / yres))
+            if nodata is not None:
+                ET.SubElement(source, 'NODATA').text = repr(nodata)
+
+    ## readers never find a partial file
+    temp_path = '{}.{}.tmp'.format(output_path, os.getpid())
+    ET.ElementTree(dataset).write(temp_path)
+    os.replace(temp_path, output_path)
+
+    return output_path
 
 
 def getraster_boundingbox(metadata):
@@ -0,0 +1,203 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+## None while the timing is disabled, so the instrumented functions only check a global
+_recorder = None
+
+
+class stage_recorder:
+    """Wall time of the calculation stages of each event, kept in the process that runs them.
+
+               Attributes
+               ----------
+
+               records : list
+                       one [stage, event id, start, duration, process id, thread id] list per stage call,
+                       times are given in seconds of time.perf_counter, which is shared by the
+                       processes of a pool
+        """
+
+    @property
+    def event_id(self):
+        """event that is being calculated in the current thread"""
+        return getattr(self._thread_state, 'event_id', None)
+
+    @event_id.setter
+    def event_id(self, event_id):
+        self._thread_state.event_id = event_id
+
+    def add(self, stage, event_id, start, duration):
+        self.records.append([stage, event_id, start, duration, os.getpid(), threading.get_ident()])
+
+    def __init__(self):
+        self.records = []
+        ## threads that record stages, e.g. the soilgrids downloads, keep their own current event
+        self._thread_state = threading.local()
+
+
+class _null_stage:
+    """context used when the timing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_context = _null_stage()
+
+
+def enable():
+    """start recording the stage times, previous records are removed"""
+    global _recorder
+    _recorder = stage_recorder()
+
+    return _recorder
+
+
+def disable():
+    """stop recording, the records taken so far are returned"""
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+
+    return recorder
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+@contextlib.contextmanager
+def _timed_stage(recorder, name, event_id):
+    start = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        recorder.add(name, event_id if event_id is not None else recorder.event_id, start,
+                     time.perf_counter() - start)
+
+
+def stage(name, event_id=None):
+    """context that records the wall time of a stage, it does nothing when the timing is disabled
+
+    :param name: stage name
+    :param event_id: event identifier, by default the event that is being calculated
+    """
+    if _recorder is None:
+        return _null_context
+
+    return _timed_stage(_recorder, name, event_id)
+
+
+@contextlib.contextmanager
+def _timed_event(recorder, event_id):
+    previous = recorder.event_id
+    recorder.event_id = event_id
+    start = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        recorder.add('event', event_id, start, time.perf_counter() - start)
+        recorder.event_id = previous
+
+
+def event(event_id):
+    """context for the calculation of a single event, the stages inside it are assigned to the event"""
+    if _recorder is None:
+        return _null_context
+
+    return _timed_event(_recorder, event_id)
+
+
+def timed(name):
+    """decorator that records each call of a function as a stage"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            with _timed_stage(_recorder, name, None):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    return decorator
+
+
+def collect_records():
+    """take the records of this process out of the recorder, pool workers send them back
+    with their results"""
+    if _recorder is None:
+        return []
+    records = _recorder.records
+    _recorder.records = []
+
+    return records
+
+
+def add_records(records):
+    """join the records collected in another process"""
+    if _recorder is not None:
+        _recorder.records.extend(records)
+
+
+def stage_records(recorder=None):
+    """table with a row for each recorded stage call, start times are taken from the first record"""
+    recorder = _recorder if recorder is None else recorder
+    records = [] if recorder is None else recorder.records
+    records = pd.DataFrame(records, columns=['stage', 'id_event', 'start', 'duration', 'pid', 'tid'])
+    if records.shape[0] > 0:
+        records['start'] = records.start - records.start.min()
+
+    return records
+
+
+def stage_stats(recorder=None):
+    """aggregated wall time by stage, in seconds
+
+    :return: pandas dataframe with calls, total, mean, median and max by stage, sorted by total time
+    """
+    records = stage_records(recorder)
+    stats = records.groupby('stage').duration.agg(['count', 'sum', 'mean', 'median', 'max'])
+    stats.columns = ['calls', 'total', 'mean', 'median', 'max']
+
+    return stats.sort_values('total', ascending=False)
+
+
+def event_stage_times(recorder=None):
+    """wall time of each stage by event, in seconds"""
+    records = stage_records(recorder)
+
+    return records.pivot_table(index='id_event', columns='stage', values='duration', aggfunc='sum')
+
+
+def write_chrome_trace(output_path, recorder=None):
+    """export the records as a trace file that can be opened in chrome://tracing or ui.perfetto.dev
+
+    :param output_path: json file path
+    """
+    records = stage_records(recorder)
+    trace_events = []
+    for stage_name, event_id, start, duration, pid, tid in records.itertuples(index=False):
+        trace_events.append({'name': stage_name,
+                             'cat': 'ghg_emissions',
+                             'ph': 'X',
+                             'ts': start * 1e6,
+                             'dur': duration * 1e6,
+                             'pid': int(pid),
+                             'tid': int(tid),
+                             'args': {'id_event': None if pd.isnull(event_id) else str(event_id)}})
+
+    with open(output_path, 'w') as trace_file:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, trace_file)
+
+    return output_path
@@ -0,0 +1,428 @@
+import collections
+import os
+import sqlite3
+import tempfile
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import emission_factors_mot as ef
+from scripts import general_functions as gf
+
+
+## columns of the written summary, chunks without rice events do not have the methane column
+SUMMARY_COLUMNS = ['id_event', 'municipality'] + ghg.EMISSION_COLUMNS
+## compression of the parquet files
+PARQUET_COMPRESSION = 'zstd'
+## folder of the rows without a value in a partition column, as pyarrow reads it
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def read_table_chunks(path, chunksize=10000):
+    """read a csv or parquet table by chunks of rows, excel and feather files can not be read
+    by parts so they are loaded once and split"""
+    fileformat = gf.file_format(path)
+    if fileformat == 'csv':
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield chunk
+
+    elif fileformat == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+    else:
+        table = gf.read_table(path, date_columns=[])
+        for i in range(0, table.shape[0], chunksize):
+            yield table.iloc[i:i + chunksize]
+
+
+class fertiliser_spill:
+    """Fertiliser rows kept in a temporary sqlite file indexed by event, so the rows of a
+    chunk of events can be drawn without holding the whole table in memory nor needing
+    both files sorted in the same order.
+
+                   Parameters
+                   ----------
+
+                   fertilisers_path : str
+                           csv, parquet or excel file with the fertilisers applied in each event
+
+                   id_column_name : str
+                           event identifier column
+            """
+
+    def get_events(self, id_events):
+        """fertiliser rows of a list of events, in the same order as in the input file"""
+        id_events = list(id_events)
+        chunks = []
+        ## sqlite limits the number of parameters in a query
+        for i in range(0, len(id_events), 500):
+            subset = [j.item() if isinstance(j, np.generic) else j for j in id_events[i:i + 500]]
+            query = 'SELECT * FROM fertilisers WHERE "{}" IN ({}) ORDER BY _row'.format(
+                self.id_column_name, ','.join('?' * len(subset)))
+            chunks.append(pd.read_sql_query(query, self._connection, params=subset))
+
+        fertilisers = pd.concat(chunks).sort_values('_row')
+        fertilisers.index = fertilisers.pop('_row').values
+
+        return self.restore_dtypes(fertilisers)
+
+    def restore_dtypes(self, fertilisers):
+        """sqlite returns None for missing values and integers for whole numbers"""
+        fertilisers = fertilisers.reindex(columns=list(self.dtypes.keys()))
+        for column, dtype in self.dtypes.items():
+            if dtype == float:
+                fertilisers[column] = pd.to_numeric(fertilisers[column]).astype(dtype)
+            else:
+                fertilisers[column] = fertilisers[column].where(fertilisers[column].notnull(), np.nan)
+
+        return fertilisers
+
+    def close(self):
+        self._connection.close()
+        os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __init__(self, fertilisers_path, id_column_name='id_event', chunksize=10000):
+        self.id_column_name = id_column_name
+        self.dtypes = {}
+
+        filedescriptor, self._path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(filedescriptor)
+        self._connection = sqlite3.connect(self._path)
+
+        nrows = 0
+        for chunk in read_table_chunks(fertilisers_path, chunksize):
+            for column in chunk.columns:
+                ## a column that is numeric in every chunk is restored as float
+                if pd.api.types.is_numeric_dtype(chunk[column]) and (
+                        self.dtypes.get(column, float) != object):
+                    self.dtypes[column] = float
+                else:
+                    self.dtypes[column] = object
+            chunk = chunk.copy()
+            chunk.insert(0, '_row', np.arange(nrows, nrows + chunk.shape[0]))
+            nrows += chunk.shape[0]
+            chunk.to_sql('fertilisers', self._connection, if_exists='append', index=False)
+
+        if nrows > 0:
+            self._connection.execute('CREATE INDEX fertilisers_event ON fertilisers ("{}")'.format(id_column_name))
+        else:
+            self._connection.execute('CREATE TABLE fertilisers ("_row" INTEGER, "{}" TEXT)'.format(id_column_name))
+            self.dtypes[id_column_name] = object
+
+
+def event_chunks(general_path, fertilisers_path, chunksize=10000, id_column_name='id_event'):
+    """pairs of general information and fertiliser tables for chunks of events"""
+    with fertiliser_spill(fertilisers_path, id_column_name, chunksize) as fertilisers:
+        for general_info in read_table_chunks(general_path, chunksize):
+            general_info = gf.parse_date_columns(general_info)
+            id_events = general_info[id_column_name].dropna().unique()
+            if len(id_events) == 0:
+                continue
+            yield general_info, fertilisers.get_events(id_events)
+
+
+def stream_emissions(general_path, fertilisers_path, chunksize=10000, id_column_name='id_event',
+                     vectorized=False, n_workers=1, general_columns=None):
+    """Gauge ghg emissions chunk by chunk, a summary table is yielded for each chunk of events
+    so the memory use depends on the chunk size and not on the number of events.
+
+    :param general_path: csv, parquet or excel file with the general information of each event
+    :param fertilisers_path: csv, parquet or excel file with the fertilisers applied in each event
+    :param chunksize: number of rows read at a time
+    :param id_column_name: event identifier column
+    :param vectorized: gauge each chunk with the batch engine
+    :param n_workers: number of processes, chunks are sent to a process pool when it is more than one
+    :param general_columns: general information columns added to each summary, e.g. ['crop']
+    :return: generator of lists: summary table, nitrogen applied by synthetic fertilisers and crop yield
+    """
+
+    chunks = event_chunks(general_path, fertilisers_path, chunksize, id_column_name)
+    if n_workers <= 1:
+        for general_info, fertilisers in chunks:
+            yield add_general_columns(ghg.tables_emissions(general_info, fertilisers, id_column_name, vectorized),
+                                      general_info, general_columns, id_column_name)
+        return
+
+    ## only a few chunks are sent ahead so the pending results stay bounded
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=ef.load_factor_tables) as executor:
+        pending = []
+        for general_info, fertilisers in chunks:
+            pending.append([executor.submit(ghg.tables_emissions, general_info, fertilisers,
+                                            id_column_name, vectorized), general_info])
+            if len(pending) >= n_workers * 2:
+                future, general_info = pending.pop(0)
+                yield add_general_columns(future.result(), general_info, general_columns, id_column_name)
+        for future, general_info in pending:
+            yield add_general_columns(future.result(), general_info, general_columns, id_column_name)
+
+
+def add_general_columns(chunk_results, general_info, general_columns=None, id_column_name='id_event'):
+    """add columns of the general information, e.g. the crop, to the summary of a chunk of events"""
+    if not general_columns:
+        return chunk_results
+
+    summary = chunk_results[0]
+    events = general_info.drop_duplicates(id_column_name).set_index(id_column_name)
+    for column in general_columns:
+        if column not in summary.columns:
+            if column not in events.columns:
+                raise ValueError("column {} is not in the general information".format(column))
+            summary[column] = events[column].reindex(summary['id_event'].values).values
+
+    return chunk_results
+
+
+def summary_frame(summary, partition_columns=()):
+    """summary with the columns of SUMMARY_COLUMNS and the partition columns, the emissions
+    are floats and the municipality and partition values strings"""
+    label_columns = ['municipality'] + [i for i in partition_columns if i != 'municipality']
+    summary = summary.reindex(columns=['id_event'] + label_columns + ghg.EMISSION_COLUMNS)
+    summary = summary.astype({column: float for column in ghg.EMISSION_COLUMNS})
+    for column in label_columns:
+        summary[column] = [None if pd.isnull(i) else str(i) for i in summary[column]]
+
+    return summary
+
+
+def summary_schema(summary, partition_columns=()):
+    """arrow schema of the written summaries, the identifier keeps the integer type when the
+    events of the first table are numbered, otherwise it is a string"""
+    import pyarrow as pa
+    id_type = pa.int64() if pd.api.types.is_integer_dtype(summary['id_event']) else pa.string()
+    label_columns = ['municipality'] + [i for i in partition_columns if i != 'municipality']
+
+    return pa.schema([pa.field('id_event', id_type)] +
+                     [pa.field(column, pa.string()) for column in label_columns] +
+                     [pa.field(column, pa.float64()) for column in ghg.EMISSION_COLUMNS])
+
+
+def emissions_table(summary, partition_columns=(), schema=None):
+    """Summary table as an arrow table with typed columns, it can be handed to other arrow
+    based tools (duckdb, polars, pyarrow.compute) without converting it again
+
+    :param summary: pandas dataframe, as ghg_emissions.emissions_summary
+    :param partition_columns: general information columns that were added to the summary, e.g. crop
+    :param schema: arrow schema, see summary_schema
+    :return: pyarrow table
+    """
+    import pyarrow as pa
+    summary = summary_frame(summary, partition_columns)
+    if schema is None:
+        schema = summary_schema(summary, partition_columns)
+
+    return pa.Table.from_pandas(summary, schema=schema, preserve_index=False)
+
+
+class emissions_writer:
+    """Append summary tables to a csv or parquet file, all the tables are written with the
+    columns of SUMMARY_COLUMNS.
+
+                   Parameters
+                   ----------
+
+                   output_path : str
+                           csv or parquet file
+
+                   output_format : str
+                           csv or parquet, it is taken from the file extension when it is not given
+
+                   compression : str
+                           compression of the parquet file
+            """
+
+    def write(self, summary):
+        if self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            table = emissions_table(summary, schema=None if self._writer is None else self._writer.schema)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.output_path, table.schema, compression=self.compression)
+            self._writer.write_table(table)
+        else:
+            summary = summary.reindex(columns=SUMMARY_COLUMNS).astype({'Methane from rice': float})
+            summary.to_csv(self.output_path, mode='w' if self.nevents == 0 else 'a',
+                           header=self.nevents == 0, index=False)
+        self.nevents += summary.shape[0]
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __init__(self, output_path, output_format=None, compression=PARQUET_COMPRESSION):
+        self.output_path = output_path
+        self.output_format = gf.file_format(output_path) if output_format is None else output_format
+        if self.output_format not in ['csv', 'parquet']:
+            raise ValueError("summaries can only be written as csv or parquet, not {}".format(self.output_format))
+        self.compression = compression
+        self.nevents = 0
+        self._writer = None
+
+
+class partitioned_emissions_writer:
+    """Append summary tables to a parquet dataset with a folder for each value of the partition
+    columns (e.g. crop=arroz/part-0.parquet). The rows of each partition are kept until a row
+    group is filled, and only a few files are open at a time, a partition whose file was closed
+    goes on in a new part file.
+
+                   Parameters
+                   ----------
+
+                   output_path : str
+                           dataset folder, it must be empty or not exist
+
+                   partition_columns : list
+                           summary columns, general information columns have to be added to the
+                           summaries first, see stream_emissions
+
+                   compression : str
+                           compression of the parquet files
+
+                   row_group_rows : int
+                           rows of a partition written at a time
+
+                   max_buffered_rows : int
+                           all the partitions are written when the rows kept in memory reach this number
+
+                   max_open_files : int
+                           the least recently written files are closed above this number
+            """
+
+    def partition_folder(self, values):
+        """hive folder names, the values are percent encoded as pyarrow decodes them"""
+        return os.path.join(*['{}={}'.format(column, NULL_PARTITION if value is None else
+                                             urllib.parse.quote(value, safe=''))
+                              for column, value in zip(self.partition_columns, values)])
+
+    def write(self, summary):
+        summary = summary_frame(summary, self.partition_columns)
+        if self.schema is None:
+            self.schema = summary_schema(summary, self.partition_columns)
+            self._file_schema = self.schema
+            for column in self.partition_columns:
+                self._file_schema = self._file_schema.remove(self._file_schema.get_field_index(column))
+
+        for values, rows in summary.groupby(self.partition_columns, dropna=False, sort=False):
+            values = values if isinstance(values, tuple) else (values,)
+            folder = self.partition_folder([None if pd.isnull(i) else i for i in values])
+            self._buffers[folder].append(rows.drop(columns=self.partition_columns))
+            self._buffered_rows[folder] += rows.shape[0]
+            if self._buffered_rows[folder] >= self.row_group_rows:
+                self.flush(folder)
+
+        self.nevents += summary.shape[0]
+        if sum(self._buffered_rows.values()) >= self.max_buffered_rows:
+            for folder in list(self._buffers):
+                self.flush(folder)
+
+    def flush(self, folder):
+        """write the rows kept for a partition"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = self._buffers.pop(folder, [])
+        self._buffered_rows.pop(folder, None)
+        if len(rows) == 0:
+            return
+
+        if folder in self._writers:
+            self._writers.move_to_end(folder)
+        else:
+            if len(self._writers) >= self.max_open_files:
+                self._writers.popitem(last=False)[1].close()
+            os.makedirs(os.path.join(self.output_path, folder), exist_ok=True)
+            path = os.path.join(self.output_path, folder, 'part-{}.parquet'.format(self._parts[folder]))
+            self._parts[folder] += 1
+            self._writers[folder] = pq.ParquetWriter(path, self._file_schema, compression=self.compression)
+
+        table = pa.Table.from_pandas(pd.concat(rows), schema=self._file_schema, preserve_index=False)
+        self._writers[folder].write_table(table)
+
+    def close(self):
+        for folder in list(self._buffers):
+            self.flush(folder)
+        while self._writers:
+            self._writers.popitem()[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __init__(self, output_path, partition_columns=('municipality',), compression=PARQUET_COMPRESSION,
+                 row_group_rows=100000, max_buffered_rows=1000000, max_open_files=64):
+        if os.path.isdir(output_path) and len(os.listdir(output_path)) > 0:
+            raise ValueError("the output folder {} is not empty".format(output_path))
+        if len(partition_columns) == 0:
+            raise ValueError("at least one partition column is needed")
+        self.output_path = output_path
+        self.partition_columns = list(partition_columns)
+        self.compression = compression
+        self.row_group_rows = row_group_rows
+        self.max_buffered_rows = max_buffered_rows
+        self.max_open_files = max_open_files
+        self.nevents = 0
+        self.schema = None
+        self._file_schema = None
+        self._buffers = collections.defaultdict(list)
+        self._buffered_rows = collections.defaultdict(int)
+        self._parts = collections.defaultdict(int)
+        self._writers = collections.OrderedDict()
+
+
+def read_emissions(path, partition_columns=None, filters=None):
+    """Read the summaries written by write_emissions as an arrow table
+
+    :param path: parquet file or partitioned dataset folder
+    :param partition_columns: partition columns of the dataset, they are read as strings
+    :param filters: pyarrow.dataset expression, e.g. pyarrow.dataset.field('crop') == 'arroz'
+    :return: pyarrow table
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    partitioning = None
+    if partition_columns:
+        partitioning = ds.partitioning(pa.schema([pa.field(i, pa.string()) for i in partition_columns]),
+                                       flavor='hive')
+
+    return ds.dataset(path, format='parquet', partitioning=partitioning).to_table(filter=filters)
+
+
+def write_emissions(general_path, fertilisers_path, output_path, chunksize=10000, id_column_name='id_event',
+                    vectorized=False, n_workers=1, output_format=None, partition_columns=None,
+                    compression=PARQUET_COMPRESSION):
+    """Gauge ghg emissions chunk by chunk and append each summary to a csv or parquet file, or
+    to a parquet dataset partitioned by municipality or general information columns such as crop
+
+    :return: int: number of events written
+    """
+
+    if partition_columns:
+        writer = partitioned_emissions_writer(output_path, partition_columns, compression)
+    else:
+        writer = emissions_writer(output_path, output_format, compression)
+
+    with writer:
+        for summary, n_amount, crop_yield in stream_emissions(general_path, fertilisers_path, chunksize,
+                                                               id_column_name, vectorized, n_workers,
+                                                               partition_columns):
+            writer.write(summary)
+
+    return writer.nevents
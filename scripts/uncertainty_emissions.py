@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+
+from scripts import batch_emissions as be
+from scripts import emission_factors_mot as ef
+from scripts import fertiliser_practices as fp
+from scripts import general_functions as gf
+
+## relative standard deviation of each uncertain input
+DEFAULT_UNCERTAINTY = {
+    ## soil properties, drawn for each event
+    'soil_organic_c': 0.2,
+    'soil_bulk_density': 0.1,
+    'n_content': 0.2,
+    'pH_content': 0.05,
+    ## all the fertiliser amounts of an event are scaled by the same draw
+    'fertiliser_amount': 0.1,
+    ## model coefficients and global warming potentials, shared by all the events of a draw
+    'constantN2O': 0.1,
+    'constantNO': 0.1,
+    'N_application_rate_constant': 0.1,
+    'NO_application_rate_constant': 0.1,
+    'pc_N2O_MOT': 0.1,
+    'pc_CH4': 0.1}
+
+EMISSION_COMPONENTS = ['Fertiliser production', 'Fertlises induced field emissions', 'Soil Management',
+                       'Soil Mining', 'Land Use Change effect on soil', 'Burning residues', 'Methane from rice']
+## components of the event total, as crop_ghg_emissions.event_emissions adds them, soil mining and
+## methane from rice are reported but are not part of the total
+TOTAL_COMPONENTS = ['Fertiliser production', 'Fertlises induced field emissions', 'Soil Management',
+                    'Land Use Change effect on soil', 'Burning residues']
+
+
+def sample_multipliers(rng, relative_sd, shape):
+    """normal multipliers centred in one, negative draws are truncated to zero"""
+    if relative_sd == 0:
+        return np.ones(shape)
+
+    return np.clip(1 + relative_sd * rng.standard_normal(shape), 0, None)
+
+
+def event_terms(general_info, fertilisers, id_column_name='id_event', language="spanish"):
+    """per event terms of the emission models that do not change between draws"""
+    events = general_info.loc[general_info[id_column_name].notnull()]
+    events = events.drop_duplicates(id_column_name).reset_index(drop=True)
+    event_ids = events[id_column_name]
+
+    context = be.soil_context(events, language)
+    products = be.fertiliser_products(fertilisers.loc[fertilisers[id_column_name].isin(event_ids)],
+                                      id_column_name, language)
+    synthetic = products.loc[~products.organic]
+
+    terms = {'events': events, 'context': context}
+    terms['n_synthetic'] = be.sum_by_event(synthetic.n_amount, synthetic[id_column_name], event_ids)
+    terms['n_total'] = be.sum_by_event(products.n_amount, products[id_column_name], event_ids)
+    terms['production'] = be.sum_by_event(synthetic.production, synthetic[id_column_name], event_ids)
+    terms['urea_co2'] = be.sum_by_event(synthetic.urea_co2, synthetic[id_column_name], event_ids)
+    ## the inhibitor weights do not change when all the amounts are scaled by the same factor
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms['weigthedsum'] = np.where(terms['n_total'] != 0, be.sum_by_event(
+            products.inhibitor_n2o, products[id_column_name], event_ids) / terms['n_total'], 0)
+        terms['weigthedsum_no'] = np.where(terms['n_total'] != 0, be.sum_by_event(
+            products.inhibitor_no, products[id_column_name], event_ids) / terms['n_total'], 0)
+    ## volatilization of the products without the soil term
+    terms['nh3_products'] = be.nh3_by_event(products, {'nh3': np.zeros(len(event_ids))}, event_ids, id_column_name)
+    terms['org_amounts'], terms['org_years'] = be.get_organic_specific_amount(products, event_ids, id_column_name)
+
+    ## soil and climate terms that are not drawn
+    length_factor = ef.lengthexperimet_factors['Per year (<300 days)'][0]
+    soil_terms = be.soil_nitrogen_terms(context)
+    terms['fixed_n2o'] = (context.texture_n2o + context.climate_n2o + context.crop_n2o +
+                          length_factor).values.astype(float)
+    terms['fixed_no'] = (context.climate_no + length_factor).values.astype(float)
+    terms['fixed_nh3'] = (context.climate_nh3 + context.crop_nh3).values.astype(float)
+    terms['leaching_climate'] = soil_terms['leaching_climate']
+    texture = context.soil_texture.map(lambda i: i.capitalize() if isinstance(i, str) else i)
+    terms['texture_cec'] = texture.map(ef.cec_factors_index).values.astype(float)
+
+    terms['burning_n2o'], terms['burning_ch4'] = be.burning_residues_kg(events.crop, context.crop_yield_kg_ha,
+                                                                        events.residues_input, language)
+
+    ## rice emissions for the reported soil, they are scaled in each draw
+    terms['rice_events'] = be.lower_values(context.crop).isin(["rice", "arroz"]).values
+    terms['methane'] = np.full(len(event_ids), np.nan)
+    terms['rice_soil_management'] = np.full(len(event_ids), np.nan)
+    if terms['rice_events'].sum() > 0:
+        terms['methane'][terms['rice_events']], terms['rice_soil_management'][terms['rice_events']] = (
+            be.ghg_from_rice(events.loc[terms['rice_events']], context.loc[terms['rice_events']],
+                             products, id_column_name, language))
+
+    return terms
+
+
+def draw_emissions(terms, positions, coefficients, uncertainty, rng):
+    """emission components for a block of events and all the draws, arrays of events by draws"""
+    context = terms['context'].iloc[positions]
+    n_draws = len(coefficients['constantN2O'])
+    shape = (len(positions), n_draws)
+
+    def event_values(values):
+        return np.asarray(values, dtype=float)[positions][:, np.newaxis]
+
+    ## soil properties
+    soil_organic_c = event_values(terms['context'].soil_organic_c)
+    soil_bulk_density = event_values(terms['context'].soil_bulk_density)
+    organic_c_draw = soil_organic_c * sample_multipliers(rng, uncertainty['soil_organic_c'], shape)
+    bulk_density_draw = soil_bulk_density * sample_multipliers(rng, uncertainty['soil_bulk_density'], shape)
+    n_content = event_values(terms['context'].n_content) * sample_multipliers(rng, uncertainty['n_content'], shape)
+    pH_content = event_values(terms['context'].pH_content) * sample_multipliers(rng, uncertainty['pH_content'],
+                                                                                shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stock_ratio = (np.where(soil_organic_c > 0, organic_c_draw / soil_organic_c, 1) *
+                       np.where(soil_bulk_density > 0, bulk_density_draw / soil_bulk_density, 1))
+    soil_c_stock = event_values(terms['context'].soil_c_stock) * stock_ratio
+    amount_factor = sample_multipliers(rng, uncertainty['fertiliser_amount'], shape)
+
+    ## soil classes of each draw
+    ph_classes = ['less than 5.5', '5.5-7.3', '7.3-8.5', 'more than 8.5']
+    soc_n2o = be.classify_factors(organic_c_draw, [1.0, 3.0], ['less than 1.0', '1.0-3.0', 'more than 3.0'],
+                                  ef.n2o_soc_index)
+    n_no = be.classify_factors(n_content, [0.05, 0.2], ['less than 0.05', '0.05-0.2', 'more than 0.2'],
+                               ef.n_no_index)
+    pH_n2o = be.classify_factors(pH_content, [5.5, 7.3, 8.5], ph_classes, ef.pH_n2o_index)
+    pH_nh3 = be.classify_factors(pH_content, [5.5, 7.3, 8.5], ph_classes, ef.pH_nh3_index)
+    ph_valueforcec = be.classify_factors(pH_content, [5.5, 7.3, 8.5], ph_classes, ef.cec_factors_index)
+    bulk_density = np.where(bulk_density_draw != 0, bulk_density_draw, 1)
+    soil_cec = ((-59 + 51 * ph_valueforcec) * soil_c_stock / 3000000 / bulk_density +
+                (30 + 4.4 * ph_valueforcec) * event_values(terms['texture_cec']))
+    cec_nh3 = be.classify_factors(soil_cec, [16, 24, 32], ['less than 16', '16-24', '24-32', 'more than 32'],
+                                  ef.cec_nh3_index)
+
+    ### FERTILISERS
+    n_total = event_values(terms['n_total']) * amount_factor
+    n_synthetic = event_values(terms['n_synthetic']) * amount_factor
+    soil_terms = {
+        'log_n2o': coefficients['constantN2O'] + soc_n2o + pH_n2o + event_values(terms['fixed_n2o']),
+        'log_no': coefficients['constantNO'] + n_no + event_values(terms['fixed_no']),
+        'leaching_climate': event_values(terms['leaching_climate'])}
+    nh3_coefficients = (np.exp(pH_nh3 + cec_nh3 + event_values(terms['fixed_nh3'])) *
+                        event_values(terms['nh3_products']) * amount_factor)
+    components = {
+        'Fertiliser production': event_values(terms['production']) * amount_factor,
+        'Fertlises induced field emissions': (
+            be.nitrogen_emissions(soil_terms, n_total, n_synthetic, event_values(terms['weigthedsum']),
+                                  event_values(terms['weigthedsum_no']), nh3_coefficients, coefficients) +
+            event_values(terms['urea_co2']) * amount_factor)}
+
+    ### SOIL MANAGEMENT
+    soc_changes = [event_values(terms['context'].tillage_soc_change) * stock_ratio,
+                   event_values(terms['context'].cover_crop_soc_change) * stock_ratio]
+    for org_type in fp.ORGANIC_FERTILISER_TYPES:
+        soc_changes.append(be.cumulative_organic_fertilizer_for20years(
+            event_values(terms['org_amounts'][org_type].values) * amount_factor, soil_c_stock, org_type,
+            event_values(terms['org_years'][org_type].values))[0])
+    soil_management = np.array(soc_changes).min(axis=0)
+    rice_events = terms['rice_events'][positions]
+    ## rice soil carbon changes are proportional to the soil carbon stock
+    soil_management[rice_events] = (event_values(terms['rice_soil_management']) * stock_ratio)[rice_events]
+    components['Soil Management'] = soil_management
+
+    components['Soil Mining'] = be.soil_mining_emissions(context, n_total)
+    components['Land Use Change effect on soil'] = event_values(terms['context'].luc_effect_on_soil) * stock_ratio
+    components['Burning residues'] = (event_values(terms['burning_n2o']) * coefficients['pc_N2O_MOT'] +
+                                      event_values(terms['burning_ch4']) * coefficients['pc_CH4'])
+
+    ## methane flux changes with the soil organic carbon as soc ** 0.3371
+    with np.errstate(divide='ignore', invalid='ignore'):
+        soc_flux = (np.where(organic_c_draw > 0, organic_c_draw, 1) ** 0.3371 /
+                    np.where(soil_organic_c > 0, soil_organic_c, 1) ** 0.3371)
+    components['Methane from rice'] = (event_values(terms['methane']) * soc_flux *
+                                       coefficients['pc_CH4'] / ef.pc_CH4)
+
+    return components
+
+
+def monte_carlo_emissions(general_info, fertilisers, n_draws=1000, uncertainty=None, percentiles=(2.5, 50, 97.5),
+                          seed=None, events_per_block=500, id_column_name='id_event', language="spanish"):
+    """Gauge the uncertainty of the emissions of each event with Monte Carlo draws. Soil properties,
+    fertiliser amounts, model coefficients and global warming potentials are drawn together and
+    every draw is evaluated as arrays of events by draws, events_per_block events at a time.
+
+    :param general_info: general information of each event, see general_functions.read_table
+    :param fertilisers: fertilisers applied in each event, see general_functions.read_table
+    :param n_draws: number of draws
+    :param uncertainty: relative standard deviation of the uncertain inputs, see DEFAULT_UNCERTAINTY
+    :param percentiles: percentiles reported for each emission component
+    :param seed: seed of the random generator
+    :param events_per_block: number of events evaluated at once, it bounds the memory use
+    :param id_column_name: event identifier column
+    :param language: language used in the input options
+    :return: pandas dataframe with the mean and percentiles of each event and emission component,
+     Total is the sum of TOTAL_COMPONENTS in each draw, the same total as ghg_emissions
+    """
+
+    relative_sd = dict(DEFAULT_UNCERTAINTY)
+    if uncertainty is not None:
+        relative_sd.update(uncertainty)
+
+    rng = np.random.default_rng(seed)
+    terms = event_terms(gf.read_table(general_info), gf.read_table(fertilisers, date_columns=[]),
+                        id_column_name, language)
+
+    ## coefficients are shared by all the events of a draw
+    coefficients = {}
+    for name in ['constantN2O', 'constantNO', 'N_application_rate_constant', 'NO_application_rate_constant',
+                 'pc_N2O_MOT', 'pc_CH4']:
+        coefficients[name] = getattr(ef, name) * sample_multipliers(rng, relative_sd[name], n_draws)
+
+    events = terms['events']
+    summaries = []
+    for start in range(0, events.shape[0], events_per_block):
+        positions = np.arange(start, min(start + events_per_block, events.shape[0]))
+        components = draw_emissions(terms, positions, coefficients, relative_sd, rng)
+        components['Total'] = np.array([components[i] for i in TOTAL_COMPONENTS]).sum(axis=0)
+
+        for component, draws in components.items():
+            summary = pd.DataFrame({'id_event': events[id_column_name].values[positions],
+                                    'municipality': events.municipality.values[positions],
+                                    'component': component,
+                                    'mean': draws.mean(axis=1)})
+            for percentile, values in zip(percentiles, np.percentile(draws, percentiles, axis=1)):
+                summary['p{:g}'.format(percentile)] = values
+            summaries.append(summary)
+
+    summary = pd.concat(summaries, ignore_index=True)
+    ## one block of rows per event
+    component_order = {component: i for i, component in enumerate(EMISSION_COMPONENTS + ['Total'])}
+    summary['event_order'] = summary.id_event.map({j: i for i, j in enumerate(events[id_column_name].values)})
+    summary['component_order'] = summary.component.map(component_order)
+    summary = summary.sort_values(['event_order', 'component_order']).drop(
+        ['event_order', 'component_order'], axis=1).reset_index(drop=True)
+
+    return summary
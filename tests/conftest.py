@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def repository_folder(monkeypatch):
+    """the factor workbooks and rasters are read with paths relative to the repository"""
+    monkeypatch.chdir(ROOT)
+
+
+def example_tables(general_file='data/inputs_mot_example.xlsx',
+                   fertiliser_file='data/fertiliser_inputs_mot_example.xlsx'):
+    """bundled example inputs without coordinates, the climate and soil are not drawn from
+    the climate region raster nor from soilgrids"""
+    import numpy as np
+    import pandas as pd
+
+    general_info = pd.read_excel(os.path.join(ROOT, general_file))
+    general_info[['longitude', 'latitude']] = np.nan
+
+    return [general_info, pd.read_excel(os.path.join(ROOT, fertiliser_file))]
+
+
+@pytest.fixture(scope='session')
+def mot_example():
+    return example_tables()
+
+
+@pytest.fixture(scope='session')
+def example2():
+    """example without rice events"""
+    return example_tables('data/inputs_example2.xlsx', 'data/fertiliser_inputs_example2.xlsx')
+
+
+@pytest.fixture
+def tile_cache(tmp_path, monkeypatch):
+    """soilgrid tile cache in a temporary folder, the cache of the repository is not touched"""
+    from scripts import soilgrid_cache as sgc
+    from scripts import soilgrid_functions as sgf
+
+    cache = sgc.soilgrid_tile_cache(str(tmp_path / 'soilgrids'))
+    monkeypatch.setitem(sgc._cache, 'cache', cache)
+    monkeypatch.setattr(sgf, '_failed_tiles', set())
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def wcs(tile_cache, monkeypatch):
+    """stand-in soilgrids service, failed requests are sent again without waiting"""
+    from scripts import soilgrid_functions as sgf
+    from stand_in_wcs import stand_in_wcs
+
+    server = stand_in_wcs().start()
+    monkeypatch.setattr(sgf, 'SOILGRID_WCS_URL', server.url)
+    monkeypatch.setattr(sgf, 'SOILGRID_BACKOFF', 0)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def no_climate_layers(monkeypatch):
+    """events with coordinates take the default climate, the climate region raster is not in
+    the repository"""
+    import numpy as np
+    from scripts import climate_grid as cg
+    from scripts import soil_management as sme
+
+    monkeypatch.setattr(cg, 'load_climate_grid', lambda *args: None)
+    monkeypatch.setattr(sme, 'get_climate_fromlayers', lambda longitude, latitude: [0, 0])
+    monkeypatch.setattr(sme, 'get_climate_fromlayers_points',
+                        lambda longitudes, latitudes: [np.zeros(len(longitudes), dtype=np.uint8)] * 2)
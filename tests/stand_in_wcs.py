@@ -0,0 +1,101 @@
+"""Stand-in for the soilgrids web coverage service, it serves int16 GeoTIFF subsets whose pixel
+values are a function of the pixel centers, so the values read from the tiles can be checked"""
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import rasterio as rio
+from rasterio.io import MemoryFile
+
+RESOLUTION = 1 / 400
+LAYER_OFFSETS = {'ocs': 11, 'bdod': 120, 'nitrogen': 300, 'phh2o': 50, 'ocd': 7, 'soc': 3}
+
+
+def pixel_value(coverage, longitudes, latitudes):
+    """value of the pixels that hold the coordinates"""
+    cols = np.floor(np.asarray(longitudes) / RESOLUTION).astype(np.int64)
+    rows = np.floor(np.asarray(latitudes) / RESOLUTION).astype(np.int64)
+
+    return (cols * 3 + rows * 5 + LAYER_OFFSETS[coverage.split('_')[0]]) % 997 + 1
+
+
+def coverage_tiff(coverage, minlong, maxlong, minlat, maxlat):
+    cols = np.arange(int(round(minlong / RESOLUTION)), int(round(maxlong / RESOLUTION)))
+    rows = np.arange(int(round(maxlat / RESOLUTION)) - 1, int(round(minlat / RESOLUTION)) - 1, -1)
+    longitudes, latitudes = np.meshgrid((cols + 0.5) * RESOLUTION, (rows + 0.5) * RESOLUTION)
+    values = pixel_value(coverage, longitudes, latitudes).astype(np.int16)[None]
+    with MemoryFile() as memory_file:
+        with memory_file.open(driver='GTiff', dtype='int16', count=1, width=values.shape[2], height=values.shape[1],
+                              crs='EPSG:4326', nodata=-32768, tiled=True,
+                              transform=rio.transform.from_origin(minlong, maxlat, RESOLUTION, RESOLUTION)) as dataset:
+            dataset.write(values)
+        return memory_file.read()
+
+
+class stand_in_wcs:
+    """Threaded http server on a free local port
+
+                   Parameters
+                   ----------
+
+                   fail_every : int
+                           every n-th request is answered with a 503, 0 to answer all of them
+            """
+
+    def requests_count(self):
+        return len(self.requests)
+
+    def start(self):
+        service = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                coverage = query['COVERAGEID'][0]
+                subsets = ' '.join(query['SUBSET'])
+                longs = [float(i) for i in re.findall(r'long\(([^,]+),([^)]+)\)', subsets)[0]]
+                lats = [float(i) for i in re.findall(r'lat\(([^,]+),([^)]+)\)', subsets)[0]]
+                bounds = (longs[0], longs[1], lats[0], lats[1])
+                with service._lock:
+                    service.requests.append([coverage, bounds])
+                    count = len(service.requests)
+                    service.connections.add(self.client_address)
+                status = service.failing_tiles.get((coverage, bounds))
+                if status is None and service.fail_every and count % service.fail_every == 0:
+                    status = 503
+                if status is not None:
+                    body = b'busy'
+                    self.send_response(status)
+                else:
+                    body = coverage_tiff(coverage, *bounds)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/tiff')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/mapserv'.format(self._server.server_address[1])
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __init__(self, fail_every=0):
+        self.fail_every = fail_every
+        ## (coverage, bounds) and the http status of their answers
+        self.failing_tiles = {}
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
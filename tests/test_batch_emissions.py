@@ -0,0 +1,45 @@
+import pandas as pd
+
+from scripts import batch_emissions as be
+from scripts import crop_ghg_emissions as ghg
+
+
+def assert_same_summary(summary, reference):
+    assert list(summary.columns) == list(reference.columns)
+    pd.testing.assert_frame_equal(summary.reset_index(drop=True), reference.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_vectorized_summary_without_rice_events(example2):
+    general_info, fertilisers = example2
+    serial = ghg.ghg_emissions(general_info, fertilisers).emissions_summary
+    vectorized = ghg.ghg_emissions(general_info, fertilisers, vectorized=True).emissions_summary
+
+    assert 'Methane from rice' not in vectorized.columns
+    assert_same_summary(vectorized, serial)
+
+
+def test_vectorized_summary_with_rice_events(mot_example):
+    general_info, fertilisers = mot_example
+    serial = ghg.ghg_emissions(general_info, fertilisers).emissions_summary
+    vectorized = ghg.ghg_emissions(general_info, fertilisers, vectorized=True).emissions_summary
+
+    assert vectorized['Methane from rice'].notnull().sum() == 2
+    assert_same_summary(vectorized, serial)
+
+
+def test_chunk_without_known_soil_types(mot_example):
+    general_info, fertilisers = mot_example
+    general_info = general_info.copy()
+    general_info['soil'] = ['suelo desconocido', None] * (len(general_info) // 2)
+    general_info['soil_organic_content'] = 2.0
+    general_info['bulk_density'] = 1.2
+
+    ## events without a soil type keep their own soil values
+    soil = be.soil_properties(general_info)
+    assert soil.soil_organic_c.tolist()[1::2] == [2.0] * (len(general_info) // 2)
+
+    general_info['soil'] = None
+    serial = ghg.ghg_emissions(general_info, fertilisers).emissions_summary
+    vectorized = ghg.ghg_emissions(general_info, fertilisers, vectorized=True).emissions_summary
+    assert_same_summary(vectorized, serial)
@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio as rio
+
+from scripts import climate_grid as cg
+from scripts import crop_ghg_emissions as ghg
+from scripts import soil_management as sme
+from scripts import translations as tl
+
+
+def write_layer(path, bounds, resolution, values):
+    minlong, maxlong, minlat, maxlat = bounds
+    width = int(round((maxlong - minlong) / resolution))
+    height = int(round((maxlat - minlat) / resolution))
+    with rio.open(path, 'w', driver='GTiff', dtype='uint8', count=1, width=width, height=height, crs='EPSG:4326',
+                  transform=rio.transform.from_origin(minlong, maxlat, resolution, resolution)) as dataset:
+        dataset.write(values(height, width).astype(np.uint8)[None])
+
+    return str(path)
+
+
+def layer_values(path, longitudes, latitudes):
+    """pixel values as get_climate_fromlayers takes them, 0 outside the layer"""
+    with rio.open(path) as dataset:
+        rows, cols = rio.transform.rowcol(dataset.transform, longitudes, latitudes)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+        values = np.zeros(len(rows), dtype=np.uint8)
+        values[inside] = dataset.read(1)[rows[inside], cols[inside]]
+
+    return values
+
+
+@pytest.fixture
+def climate_layers(tmp_path, monkeypatch):
+    """koppen and climate region layers of different resolutions and extents, with the classes of
+    the translations and other values"""
+    rng = np.random.default_rng(0)
+    koppen_codes = [code for codes, _ in tl.world_climate_koppen.values() for code in codes] + [1, 2, 30]
+    region_codes = [code for codes, _ in tl.world_climate_sayre.values() for code in codes] + [0, 1, 3]
+    koppen_path = write_layer(tmp_path / 'koppen.tif', [-80, -60, -10, 10], 0.5,
+                              lambda height, width: rng.choice(koppen_codes, (height, width)))
+    region_path = write_layer(tmp_path / 'regions.tif', [-84, -56, -12, 12], 0.125,
+                              lambda height, width: rng.choice(region_codes, (height, width)))
+    ## grids loaded by another test are not taken
+    monkeypatch.setattr(cg, '_grids', {})
+
+    return [koppen_path, region_path]
+
+
+def test_grid_gives_the_class_of_the_layers(climate_layers, tmp_path):
+    koppen_path, region_path = climate_layers
+    grid_path = cg.build_climate_grid(str(tmp_path / 'classes.npy'), koppen_path, region_path, rows_per_strip=50)
+    grid = cg.load_climate_grid(grid_path)
+    assert [grid.width, grid.height] == [224, 192]
+
+    rng = np.random.default_rng(1)
+    ## points inside both layers, only inside the climate regions, and outside both
+    longitudes = rng.uniform(-86, -54, 2000)
+    latitudes = rng.uniform(-14, 14, 2000)
+    koppen_values = layer_values(koppen_path, longitudes, latitudes)
+    region_values = layer_values(region_path, longitudes, latitudes)
+    expected = [sme.mot_climate_classification([koppen, region])
+                for koppen, region in zip(koppen_values, region_values)]
+
+    assert grid.climate_classes(longitudes, latitudes).tolist() == expected
+    assert len(set(expected)) == len(cg.CLIMATE_CLASSES)
+    ## points without coordinates take the default class
+    assert grid.climate_classes([np.nan], [0.0]).tolist() == [cg.DEFAULT_CLIMATE]
+
+
+def test_grid_is_not_used_after_a_layer_changes(climate_layers, tmp_path, monkeypatch):
+    koppen_path, region_path = climate_layers
+    grid_path = cg.build_climate_grid(str(tmp_path / 'classes.npy'), koppen_path, region_path)
+    assert cg.load_climate_grid(grid_path) is not None
+
+    ## the same size and a later modification time
+    stats = os.stat(region_path)
+    os.utime(region_path, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10 ** 9))
+    monkeypatch.setattr(cg, '_grids', {})
+    assert cg.load_climate_grid(grid_path) is None
+
+    ## a layer of another size
+    cg.build_climate_grid(grid_path, koppen_path, region_path)
+    monkeypatch.setattr(cg, '_grids', {})
+    assert cg.load_climate_grid(grid_path) is not None
+    write_layer(koppen_path, [-80, -60, -10, 10], 0.25, lambda height, width: np.zeros((height, width)))
+    monkeypatch.setattr(cg, '_grids', {})
+    assert cg.load_climate_grid(grid_path) is None
+
+    ## a missing grid
+    monkeypatch.setattr(cg, '_grids', {})
+    assert cg.load_climate_grid(str(tmp_path / 'missing.npy')) is None
+
+
+def test_engines_take_the_climate_from_the_grid(climate_layers, mot_example, tmp_path, monkeypatch):
+    koppen_path, region_path = climate_layers
+    grid = cg.climate_grid(cg.build_climate_grid(str(tmp_path / 'classes.npy'), koppen_path, region_path))
+    general_info, fertilisers = mot_example
+    ## events whose soil properties are given, so nothing is taken from soilgrids
+    general_info = general_info.iloc[[2, 3, 4, 6]].copy()
+    ## points of different classes, temperate dry has no factors in the emission tables
+    rng = np.random.default_rng(2)
+    longitudes, latitudes = rng.uniform(-84, -56, 200), rng.uniform(-12, 12, 200)
+    classes = grid.climate_classes(longitudes, latitudes)
+    points = [np.flatnonzero(classes == i)[0] for i in ['temperate oceanic', 'subtropical moist',
+                                                        'tropical dry', cg.DEFAULT_CLIMATE]]
+    general_info['longitude'] = longitudes[points]
+    general_info['latitude'] = latitudes[points]
+    fertilisers = fertilisers.loc[fertilisers.id_event.isin(general_info.id_event)]
+
+    def layers_summaries():
+        return [ghg.ghg_emissions(general_info, fertilisers, **options).emissions_summary
+                for options in [{}, {'vectorized': True}]]
+
+    monkeypatch.setattr(cg, 'load_climate_grid', lambda *args: None)
+    monkeypatch.setattr(sme, 'get_climate_fromlayers', lambda longitude, latitude: [
+        layer_values(path, [longitude], [latitude])[0] for path in climate_layers])
+    monkeypatch.setattr(sme, 'get_climate_fromlayers_points', lambda longitudes, latitudes: [
+        layer_values(path, longitudes, latitudes) for path in climate_layers])
+    from_layers = layers_summaries()
+
+    ## the layers are not read when the grid is there
+    monkeypatch.setattr(cg, 'load_climate_grid', lambda *args: grid)
+    monkeypatch.setattr(sme, 'get_climate_fromlayers', None)
+    monkeypatch.setattr(sme, 'get_climate_fromlayers_points', None)
+    from_grid = layers_summaries()
+    ## the climate changes the emissions of the events
+    default_climate = ghg.ghg_emissions(general_info.assign(longitude=np.nan, latitude=np.nan),
+                                        fertilisers).emissions_summary
+    assert not default_climate.equals(from_grid[0])
+
+    for summary, reference in zip(from_grid, from_layers):
+        pd.testing.assert_frame_equal(summary.reset_index(drop=True), reference.reset_index(drop=True))
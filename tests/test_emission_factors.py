@@ -0,0 +1,43 @@
+import pytest
+
+from scripts import emission_factors_mot as ef
+
+
+@pytest.fixture
+def bundle_path(tmp_path, monkeypatch):
+    """factor bundle in a temporary folder, the bundle of the repository is not touched"""
+    path = str(tmp_path / 'factors_bundle.pkl')
+    monkeypatch.setattr(ef, 'FACTOR_BUNDLE_PATH', path)
+    monkeypatch.setattr(ef, '_bundle_cache', {})
+    writes = []
+    write_factor_bundle = ef.write_factor_bundle
+    monkeypatch.setattr(ef, 'write_factor_bundle', lambda bundle: writes.append(1) or write_factor_bundle(bundle))
+
+    return [path, writes]
+
+
+def test_rebuild_writes_the_bundle_once(bundle_path):
+    path, writes = bundle_path
+    tables = ef.load_factor_tables(rebuild=True)
+
+    assert len(writes) == 1
+    assert set(tables) <= set(ef.read_factor_bundle(path)['tables'])
+
+    ef.load_factor_tables()
+    assert len(writes) == 1
+
+
+def test_flush_keeps_the_tables_of_other_processes(bundle_path):
+    path, writes = bundle_path
+    ef.load_factor_tables(rebuild=True)
+    ## another worker added a table after this process read the bundle
+    stored_bundle = ef.read_factor_bundle(path)
+    stored_bundle['tables']['other_table'] = ('digest', b'table')
+    ef.write_factor_bundle(stored_bundle)
+
+    ef._bundle_cache['dirty'].add('rice_table')
+    ef.flush_factor_bundle()
+
+    tables = ef.read_factor_bundle(path)['tables']
+    assert 'other_table' in tables
+    assert 'rice_table' in tables
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+
+import pandas as pd
+import pytest
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import emissions_service as es
+
+
+def records(table):
+    table = table.copy()
+    for column in table.columns:
+        if pd.api.types.is_datetime64_any_dtype(table[column]):
+            table[column] = table[column].dt.strftime('%Y-%m-%d')
+
+    return json.loads(table.to_json(orient='records'))
+
+
+def request_body(general_info, fertilisers):
+    return json.dumps({'general_info': records(general_info), 'fertilisers': records(fertilisers)}).encode('utf-8')
+
+
+async def post(port, body):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('POST /emissions HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                 'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(len(body)).encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+
+    return [int(head.split()[1]), json.loads(content)]
+
+
+def test_missing_columns_are_refused(mot_example):
+    general_info, fertilisers = mot_example
+    body = request_body(general_info.drop(columns=['crop_yield_kg_ha']),
+                        fertilisers.drop(columns=['id_event', 'amount_kg_ha']))
+
+    with pytest.raises(es.service_error) as error:
+        es.read_request_tables(body, 'application/json', {})
+    assert error.value.status == 400
+    assert 'general_info: crop_yield_kg_ha' in str(error.value)
+    assert 'fertilisers: id_event, amount_kg_ha' in str(error.value)
+
+
+def test_service_emissions(mot_example):
+    general_info, fertilisers = mot_example
+    reference = ghg.ghg_emissions(general_info, fertilisers).emissions_summary.reset_index(drop=True)
+
+    async def requests():
+        service = es.emissions_service(n_workers=1)
+        server = await service.start('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.gather(post(port, request_body(general_info, fertilisers)),
+                                        post(port, request_body(general_info.drop(columns=['id_event']),
+                                                                fertilisers)))
+        finally:
+            await service.stop()
+
+    (status, content), (missing_status, missing_content) = asyncio.run(requests())
+    assert status == 200
+    emissions = pd.DataFrame(content['emissions'])
+    pd.testing.assert_frame_equal(emissions[reference.columns], reference, check_dtype=False)
+    assert missing_status == 400
+    assert 'general_info: id_event' in missing_content['error']
+
+
+def test_batches_do_not_print_the_events(mot_example, capsys):
+    general_info, fertilisers = mot_example
+    for vectorized in [False, True]:
+        results = es.batch_emissions([[general_info, fertilisers], [general_info.iloc[:2], fertilisers]],
+                                     vectorized=vectorized)
+        assert [i[0].shape[0] for i in results] == [general_info.shape[0], 2]
+
+    assert capsys.readouterr().out == ''
+
+
+def test_request_tables_are_read_outside_the_event_loop(mot_example, monkeypatch):
+    general_info, fertilisers = mot_example
+    read_request_tables = es.read_request_tables
+    threads = []
+
+    def recorded_read(*args):
+        threads.append(threading.get_ident())
+        return read_request_tables(*args)
+
+    monkeypatch.setattr(es, 'read_request_tables', recorded_read)
+
+    async def request():
+        service = es.emissions_service(n_workers=1)
+        server = await service.start('127.0.0.1', 0)
+        try:
+            return await post(server.sockets[0].getsockname()[1], request_body(general_info, fertilisers))
+        finally:
+            await service.stop()
+
+    status, content = asyncio.run(request())
+    assert status == 200
+    assert len(content['emissions']) == general_info.shape[0]
+    assert threads != [threading.get_ident()] and len(threads) == 1
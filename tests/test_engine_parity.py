@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from scripts import crop_ghg_emissions as ghg
+
+
+def assert_same_summary(summary, reference):
+    assert list(summary.columns) == list(reference.columns)
+    pd.testing.assert_frame_equal(summary.reset_index(drop=True), reference.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+@pytest.fixture(params=['mot_example', 'example2'])
+def example(request):
+    return request.getfixturevalue(request.param)
+
+
+@pytest.fixture
+def serial_summary(example):
+    return ghg.ghg_emissions(*example).emissions_summary
+
+
+@pytest.mark.parametrize('options', [{'vectorized': True},
+                                     {'n_workers': 2},
+                                     {'n_workers': 2, 'chunksize': 1}],
+                         ids=['vectorized', 'pool', 'pool_chunks_of_one_event'])
+def test_engines_give_the_serial_summary(example, serial_summary, options):
+    summary = ghg.ghg_emissions(*example, **options).emissions_summary
+
+    assert_same_summary(summary, serial_summary)
+
+
+@pytest.mark.parametrize('options', [{}, {'vectorized': True}, {'n_workers': 2}],
+                         ids=['serial', 'vectorized', 'pool'])
+def test_cached_runs_give_the_serial_summary(example, serial_summary, options, tmp_path):
+    general_info, fertilisers = example
+    cache_path = str(tmp_path / 'events.sqlite')
+
+    first = ghg.ghg_emissions(general_info, fertilisers, cache_path=cache_path, **options)
+    assert first.cache_hits == 0
+    assert_same_summary(first.emissions_summary, serial_summary)
+
+    second = ghg.ghg_emissions(general_info, fertilisers, cache_path=cache_path, **options)
+    assert second.cache_hits == general_info.id_event.nunique()
+    assert_same_summary(second.emissions_summary, serial_summary)
+
+
+def test_cache_only_gauges_the_changed_events(mot_example, tmp_path):
+    general_info, fertilisers = mot_example
+    cache_path = str(tmp_path / 'events.sqlite')
+    ghg.ghg_emissions(general_info, fertilisers, cache_path=cache_path)
+
+    changed = general_info.copy()
+    changed.loc[0, 'crop_yield_kg_ha'] = changed.loc[0, 'crop_yield_kg_ha'] * 2
+    cached = ghg.ghg_emissions(changed, fertilisers, cache_path=cache_path)
+
+    assert cached.cache_hits == general_info.id_event.nunique() - 1
+    assert_same_summary(cached.emissions_summary, ghg.ghg_emissions(changed, fertilisers).emissions_summary)
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from scripts import raster_pool as rp
+
+
+def write_raster(path, values, block_size=16):
+    """uint16 GeoTIFF of a 2d array, tiled in blocks of block_size pixels"""
+    with rio.open(path, 'w', driver='GTiff', dtype='uint16', count=1, width=values.shape[1],
+                  height=values.shape[0], crs='EPSG:4326', transform=rio.transform.from_origin(0, 1, 0.01, 0.01),
+                  tiled=True, blockxsize=block_size, blockysize=block_size) as dataset:
+        dataset.write(values.astype(np.uint16)[None])
+
+    return str(path)
+
+
+def pixel_grid(height=64, width=64, offset=0):
+    return np.arange(height * width).reshape(height, width) + offset
+
+
+## pool that the forked children inherit
+_inherited = {}
+
+
+def read_in_child(raster_path):
+    pool = _inherited['pool']
+    values = pool.read_pixels(raster_path, [5, 40], [7, 50])[0].tolist()
+
+    return [values, pool.opened, os.getpid()]
+
+
+def test_least_recently_used_datasets_are_closed(tmp_path):
+    paths = [write_raster(tmp_path / '{}.tif'.format(i), pixel_grid(offset=i)) for i in range(3)]
+    pool = rp.raster_pool(max_open=2)
+
+    first = pool.dataset(paths[0])
+    pool.dataset(paths[1])
+    pool.dataset(paths[0])
+    ## the second raster is the least recently used one
+    second = pool._datasets[os.path.abspath(paths[1])][0]
+    pool.dataset(paths[2])
+
+    assert not first.closed and second.closed
+    assert len(pool._datasets) == 2
+    assert pool.read_pixels(paths[1], [0], [0])[0].tolist() == [1]
+    assert pool.opened == 4
+    pool.clear()
+
+
+def test_decoded_blocks_stay_below_the_cache_size(tmp_path):
+    path = write_raster(tmp_path / 'blocks.tif', pixel_grid(128, 128))
+    block_bytes = 16 * 16 * 2
+    ## room for three blocks
+    pool = rp.raster_pool(cache_size_mb=3.5 * block_bytes / 1024 / 1024)
+
+    values = pool.read_window(path, 0, 0, 16, 64)
+    assert values[0].tolist() == pixel_grid(128, 128)[:16, :64].tolist()
+    assert pool.decoded == 4
+    assert len(pool._blocks) == 3
+    assert pool._cache_bytes == 3 * block_bytes
+
+    ## the last blocks are still decoded, the first one was dropped
+    pool.read_pixels(path, [3, 4], [60, 33])
+    assert pool.hits == 2
+    pool.read_pixels(path, [0], [0])
+    assert pool.decoded == 5
+    assert pool._cache_bytes <= pool.cache_size_mb * 1024 * 1024
+    pool.clear()
+
+
+def test_written_raster_is_read_again_after_invalidate(tmp_path):
+    path = write_raster(tmp_path / 'mosaic.tif', pixel_grid())
+    pool = rp.raster_pool()
+    assert pool.read_pixels(path, [1], [1])[0].tolist() == [65]
+
+    write_raster(path, pixel_grid(offset=1000))
+    pool.invalidate(path)
+
+    assert pool.read_pixels(path, [1], [1])[0].tolist() == [1065]
+    assert pool.opened == 2
+    pool.clear()
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="fork is not available")
+def test_child_process_opens_its_own_datasets(tmp_path):
+    path = write_raster(tmp_path / 'shared.tif', pixel_grid())
+    pool = rp.raster_pool()
+    expected = pool.read_pixels(path, [5, 40], [7, 50])[0].tolist()
+
+    _inherited['pool'] = pool
+    try:
+        with multiprocessing.get_context('fork').Pool(1) as process_pool:
+            values, opened, pid = process_pool.apply(read_in_child, (path,))
+    finally:
+        _inherited.clear()
+
+    assert pid != os.getpid()
+    assert values == expected
+    ## the child opened the raster again, the dataset of the parent is still open
+    assert opened == 2
+    assert pool.opened == 1
+    assert not pool.dataset(path).closed
+    pool.clear()
+
+
+def test_changed_raster_is_opened_again_when_checked(tmp_path, monkeypatch):
+    path = write_raster(tmp_path / 'layer.tif', pixel_grid())
+    pool = rp.raster_pool()
+    pool.read_pixels(path, [1], [1])
+    ## a larger file written by another process
+    write_raster(path, pixel_grid(128, 128, offset=1000))
+
+    signatures = []
+    file_signature = rp.file_signature
+    monkeypatch.setattr(rp, 'file_signature', lambda i: signatures.append(i) or file_signature(i))
+    ## the reads do not look at the file
+    assert pool.read_pixels(path, [1], [1])[0].tolist() == [65]
+    assert pool.read_window(path, 1, 1, 1, 1)[0].tolist() == [[65]]
+    assert pool.dataset(path).width == 64
+    assert signatures == []
+
+    assert pool.dataset(path, check=True).width == 128
+    assert pool.read_pixels(path, [1], [1])[0].tolist() == [1129]
+    assert pool.opened == 2
+    assert len(signatures) == 2
+    pool.clear()
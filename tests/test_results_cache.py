@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import results_cache as rc
+
+
+def test_digest_does_not_depend_on_the_column_dtypes():
+    table = pd.DataFrame({'id_event': ['event_0'], 'amount_kg_ha': [150], 'inhibitor': [None]})
+    ## the same row read from another file, with the columns in another order
+    same_row = pd.DataFrame({'inhibitor': [np.nan], 'amount_kg_ha': [150.0],
+                             'id_event': pd.Series(['event_0'], dtype='string')})
+    other_row = pd.DataFrame({'id_event': ['event_0'], 'amount_kg_ha': [151], 'inhibitor': [None]})
+
+    assert rc.tables_digest([table]) == rc.tables_digest([same_row])
+    assert rc.tables_digest([table]) != rc.tables_digest([other_row])
+
+
+def test_events_read_with_other_dtypes_are_taken_from_the_cache(mot_example, tmp_path):
+    general_info, fertilisers = mot_example
+    cache_path = str(tmp_path / 'events.sqlite')
+    first = ghg.ghg_emissions(general_info, fertilisers, cache_path=cache_path)
+    assert first.cache_hits == 0
+
+    second = ghg.ghg_emissions(general_info, fertilisers.astype({'amount_kg_ha': float}), cache_path=cache_path)
+    assert second.cache_hits == len(general_info)
+    pd.testing.assert_frame_equal(second.emissions_summary, first.emissions_summary)
+
+
+def test_cached_events_without_rice_do_not_add_the_methane_column(mot_example, tmp_path):
+    general_info, fertilisers = mot_example
+    cache_path = str(tmp_path / 'events.sqlite')
+    ## the events are stored from a batch with rice events
+    ghg.ghg_emissions(general_info, fertilisers, cache_path=cache_path, vectorized=True)
+
+    no_rice = general_info.loc[~general_info.crop.str.lower().isin(['arroz', 'rice'])]
+    cached = ghg.ghg_emissions(no_rice, fertilisers, cache_path=cache_path, vectorized=True)
+
+    assert cached.cache_hits == no_rice.id_event.nunique()
+    assert 'Methane from rice' not in cached.emissions_summary.columns
+    pd.testing.assert_frame_equal(cached.emissions_summary, ghg.ghg_emissions(no_rice, fertilisers).emissions_summary,
+                                  check_dtype=False)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from scripts import batch_emissions as be
+from scripts import scenario_emissions as sc
+
+
+def assert_same_emissions(scenario, summary):
+    for column in summary.columns:
+        pd.testing.assert_series_equal(scenario[column].reset_index(drop=True),
+                                       summary[column].reset_index(drop=True), check_dtype=False)
+
+
+def test_reported_scenario_gives_the_batch_summary(mot_example, example2):
+    for general_info, fertilisers in [mot_example, example2]:
+        summary = be.calculate_emissions(general_info, fertilisers)[0]
+        scenarios = sc.scenario_emissions(general_info, fertilisers)
+
+        assert scenarios.scenario.unique().tolist() == [0]
+        assert_same_emissions(scenarios, summary)
+
+
+def test_n_rate_factor_scales_the_synthetic_amounts(mot_example):
+    general_info, fertilisers = mot_example
+    ## the rows of the synthetic products are halved, the organic ones are kept
+    synthetic = ~be.fertiliser_products(fertilisers, 'id_event', 'spanish').organic.values
+    halved = fertilisers.astype({'amount_kg_ha': float})
+    halved.loc[synthetic, 'amount_kg_ha'] = halved.loc[synthetic, 'amount_kg_ha'] * 0.5
+
+    scenarios = sc.scenario_emissions(general_info, fertilisers, n_rate_factor=[0.5])
+
+    assert_same_emissions(scenarios, be.calculate_emissions(general_info, halved)[0])
+
+
+def test_grid_has_a_row_for_each_event_and_scenario(mot_example):
+    general_info, fertilisers = mot_example
+    options = {'n_rate_factor': [0.5, 0.75, 1.0], 'tillage_input': [None, 'cero labranza'],
+               'inhibitor': [None, 'Nitrification inhibitors'], 'residues_input': [None, 'no']}
+    grid = sc.scenario_grid(**options)
+    scenarios = sc.scenario_emissions(general_info, fertilisers, **options)
+
+    assert grid.shape == (24, 4)
+    assert grid.drop_duplicates().shape[0] == 24
+    event_ids = general_info.id_event.unique()
+    assert scenarios.shape[0] == len(event_ids) * 24
+    assert scenarios.id_event.tolist() == np.repeat(event_ids, 24).tolist()
+    assert scenarios.scenario.tolist() == list(range(24)) * len(event_ids)
+    ## each event takes the options of the grid in the same order
+    for event_id, rows in scenarios.groupby('id_event'):
+        pd.testing.assert_frame_equal(rows[sc.SCENARIO_COLUMNS].reset_index(drop=True), grid.astype(object),
+                                      check_dtype=False)
+    ## a scenario that keeps every option gives the batch summary
+    reported = scenarios.loc[scenarios.n_rate_factor.eq(1.0) & scenarios.tillage_input.isnull() &
+                             scenarios.inhibitor.isnull() & scenarios.residues_input.isnull()]
+    assert_same_emissions(reported, be.calculate_emissions(general_info, fertilisers)[0])
@@ -0,0 +1,253 @@
+import os
+import socket
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+import rasterio as rio
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import soil_management as sme
+from scripts import soilgrid_cache as sgc
+from scripts import soilgrid_functions as sgf
+
+## pixel size of the tiles, as the soilgrids maps in geographic coordinates
+RESOLUTION = 1 / 400
+
+
+def write_tile(path, bounds, value):
+    """int16 GeoTIFF of a tile, the value is a constant or a function of the pixel centers"""
+    minlong, maxlong, minlat, maxlat = bounds
+    width = int(round((maxlong - minlong) / RESOLUTION))
+    height = int(round((maxlat - minlat) / RESOLUTION))
+    longitudes, latitudes = np.meshgrid(minlong + (np.arange(width) + 0.5) * RESOLUTION,
+                                        maxlat - (np.arange(height) + 0.5) * RESOLUTION)
+    values = value(longitudes, latitudes) if callable(value) else np.full((height, width), value)
+    with rio.open(path, 'w', driver='GTiff', dtype='int16', count=1, width=width, height=height, crs='EPSG:4326',
+                  transform=rio.transform.from_origin(minlong, maxlat, RESOLUTION, RESOLUTION), nodata=-32768,
+                  tiled=True) as dataset:
+        dataset.write(values.astype(np.int16)[None])
+
+    return path
+
+
+def test_soilgrid_values_do_not_overflow(tile_cache, tmp_path):
+    longitude, latitude = -75.3, 4.1
+    tile = sgc.tile_id(longitude, latitude, tile_cache.tile_size)
+    ## organic carbon stock 50 t/ha, a stock of 50000 kg/ha does not fit in int16
+    for layer, value in [['Soil organic carbon stock', 50], ['Bulk density', 130], ['Nitrogen', 200],
+                         ['pH water', 60], ['Organic carbon density', 300]]:
+        coverage = sgf.soilgrid_coverage(layer)
+        path = write_tile(str(tmp_path / '{}.tif'.format(coverage)), sgc.tile_bounds(tile, tile_cache.tile_size),
+                          value)
+        tile_cache.put(coverage, tile, path)
+
+    stock, bulk_density, n_content, ph, organic_content = sme.soilgrid_soil_properties(longitude, latitude)
+
+    assert [stock, bulk_density, n_content, ph, organic_content] == [50000, 1.3, 0.2, 6.0, 3.0]
+
+
+def tile_key(coverage, tile, tile_size=sgc.TILE_SIZE):
+    return (coverage, tuple(float(i) for i in sgc.tile_bounds(tile, tile_size)))
+
+
+def test_plan_lists_each_missing_tile_once(tile_cache, tmp_path):
+    longitudes = [-75.3, -75.1, -73.5, np.nan]
+    latitudes = [4.1, 4.9, 4.2, 4.0]
+    ## the tile of the first two points is already cached
+    tile_cache.put('bdod_0-5cm_mean', (-38, 2), write_tile(str(tmp_path / 'bdod.tif'), [-76, -74, 4, 6], 120))
+
+    plan = sgf.plan_soilgrid_tiles({'Bulk density': [longitudes, latitudes],
+                                    'Soil organic carbon stock': [longitudes, latitudes]})
+
+    assert sorted(plan) == [['bdod_0-5cm_mean', (-37, 2)],
+                            ['ocs_0-30cm_mean', (-38, 2)], ['ocs_0-30cm_mean', (-37, 2)]]
+
+
+def test_fetched_tiles_are_not_requested_again(wcs):
+    rng = np.random.default_rng(0)
+    longitudes, latitudes = rng.uniform(-79, -71, 50), rng.uniform(-2, 6, 50)
+    layers = {'Bulk density': [longitudes, latitudes], 'Nitrogen': [longitudes[:10], latitudes[:10]]}
+    plan = sgf.plan_soilgrid_tiles(layers)
+
+    downloaded, failed = sgf.fetch_soilgrid_tiles(layers, progress=False)
+
+    assert sorted(downloaded) == sorted(plan) and failed == []
+    assert wcs.requests_count() == len(plan)
+    assert sgf.fetch_soilgrid_tiles(layers, progress=False) == [[], []]
+    values = [sgf.get_soilgridpixelvalue('Bulk density', x, y) for x, y in zip(longitudes, latitudes)]
+    assert values == pixel_values('bdod_0-5cm_mean', longitudes, latitudes)
+    assert wcs.requests_count() == len(plan)
+
+
+def test_failing_tile_gives_missing_values(wcs):
+    wcs.failing_tiles[tile_key('bdod_0-5cm_mean', (-38, 2))] = 503
+    layers = {'Bulk density': [[-75.3013, -73.5013], [4.1011, 4.2011]]}
+
+    downloaded, failed = sgf.fetch_soilgrid_tiles(layers, progress=False)
+
+    assert failed == [['bdod_0-5cm_mean', (-38, 2)]]
+    assert wcs.requests_count() == 1 + sgf.SOILGRID_RETRIES + 1
+    assert np.isnan(sgf.get_soilgridpixelvalue('Bulk density', -75.3013, 4.1011))
+    assert sgf.get_soilgridpixelvalue('Bulk density', -73.5013, 4.2011) == pixel_values('bdod_0-5cm_mean',
+                                                                                        [-73.5013], [4.2011])[0]
+    ## the events of the failed tile do not request it again in the same run
+    assert wcs.requests_count() == 1 + sgf.SOILGRID_RETRIES + 1
+
+
+def test_engines_with_soilgrid_tiles(mot_example, wcs, no_climate_layers):
+    general_info, fertilisers = mot_example
+    general_info = general_info.copy()
+    ## the coordinates are away from the pixel edges
+    general_info['longitude'] = np.array([-75.3, -75.1, -73.5, -73.9, -71.2, -77.6, -74.4, -75.8]) + 0.0013
+    general_info['latitude'] = np.array([4.1, 4.9, 4.2, 2.3, 6.7, 1.1, 5.5, 3.3]) + 0.0011
+    general_info[['soil', 'soil_organic_content', 'bulk_density']] = np.nan
+
+    serial = ghg.ghg_emissions(general_info, fertilisers).emissions_summary
+    n_requests = wcs.requests_count()
+    assert n_requests > 0
+    vectorized = ghg.ghg_emissions(general_info, fertilisers, vectorized=True).emissions_summary
+    pool = ghg.ghg_emissions(general_info, fertilisers, n_workers=2).emissions_summary
+
+    ## the tiles are only downloaded by the first run
+    assert wcs.requests_count() == n_requests
+    pd.testing.assert_frame_equal(vectorized.reset_index(drop=True), serial.reset_index(drop=True),
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(pool, serial)
+
+
+def test_busy_service_is_requested_again(wcs, tmp_path):
+    wcs.fail_every = 3
+    paths = [sgf.soilgrid_request(str(tmp_path), 'bdod_0-5cm_mean', long, long + 2, 0, 2)
+             for long in range(-80, -60, 2)]
+
+    ## 10 tiles, a third of the requests are answered with a 503
+    assert wcs.requests_count() == 14
+    assert len(set(paths)) == 10
+    for path, long in zip(paths, range(-80, -60, 2)):
+        with rio.open(path) as dataset:
+            assert dataset.read(1)[0, 0] == pixel_values('bdod_0-5cm_mean', [long + 0.001], [1.999])[0]
+    ## the connection is kept alive across the tiles and the 503 answers
+    assert len({i[1] for i in wcs.connections}) == 1
+    assert [i for i in tmp_path.iterdir() if i.suffix == '.part'] == []
+
+
+def test_failing_service_raises_soilgrid_error(wcs, tmp_path, monkeypatch):
+    waits = []
+    monkeypatch.setattr(sgf, 'SOILGRID_BACKOFF', 0.5)
+    monkeypatch.setattr(sgf.time, 'sleep', waits.append)
+    wcs.fail_every = 1
+
+    with pytest.raises(sgf.soilgrid_error) as error:
+        sgf.soilgrid_request(str(tmp_path), 'bdod_0-5cm_mean', 0, 2, 0, 2)
+
+    assert isinstance(error.value, requests.RequestException)
+    assert [error.value.coverage, error.value.bounds, error.value.status] == ['bdod_0-5cm_mean', [0, 2, 0, 2], 503]
+    assert wcs.requests_count() == sgf.SOILGRID_RETRIES + 1
+    ## the wait doubles after each failure
+    assert waits == [0.5, 1.0, 2.0, 4.0]
+
+
+def test_refused_request_is_not_sent_again(wcs, tmp_path):
+    wcs.failing_tiles[('bdod_0-5cm_mean', (0.0, 2.0, 0.0, 2.0))] = 400
+
+    with pytest.raises(sgf.soilgrid_error) as error:
+        sgf.soilgrid_request(str(tmp_path), 'bdod_0-5cm_mean', 0, 2, 0, 2)
+
+    assert error.value.status == 400
+    assert wcs.requests_count() == 1
+
+
+def test_unreachable_service_raises_soilgrid_error(tile_cache, tmp_path, monkeypatch):
+    with socket.socket() as closed_socket:
+        closed_socket.bind(('127.0.0.1', 0))
+        port = closed_socket.getsockname()[1]
+    monkeypatch.setattr(sgf, 'SOILGRID_WCS_URL', 'http://127.0.0.1:{}/mapserv'.format(port))
+    monkeypatch.setattr(sgf, 'SOILGRID_BACKOFF', 0)
+
+    with pytest.raises(sgf.soilgrid_error) as error:
+        sgf.soilgrid_request(str(tmp_path), 'bdod_0-5cm_mean', 0, 2, 0, 2)
+
+    assert error.value.status is None
+
+
+def test_carbon_stock_is_only_available_for_30_cm():
+    with pytest.raises(ValueError):
+        sgf.download_soilgrid_data('temp', 'Soil organic carbon stock', [0, 2, 0, 2], depth='0-5')
+
+
+def test_area_is_read_from_a_vrt_of_the_cached_tiles(wcs, tmp_path):
+    vrt_path = sgf.download_soilgrid_data(str(tmp_path), 'Bulk density', [-77, -73, 3, 6])
+    ## 3 x 2 tiles of 2 degrees
+    assert vrt_path == str(tmp_path / 'bdod_0-5cm_mean.vrt')
+    assert wcs.requests_count() == 6
+
+    longitudes = np.array([-76.9, -75.2, -73.1, -74.6]) + 0.0013
+    latitudes = np.array([2.1, 5.9, 3.3, 4.4]) + 0.0011
+    values, inside, nodata = sgf.sample_coordinates(vrt_path, longitudes, latitudes)
+    assert inside.all() and not nodata.any()
+    assert [float(i) for i in values] == pixel_values('bdod_0-5cm_mean', longitudes, latitudes)
+    with rio.open(vrt_path) as dataset:
+        assert [round(i, 6) for i in dataset.bounds] == [-78, 2, -72, 6]
+
+    ## the tiles are taken from the cache
+    sgf.download_soilgrid_data(str(tmp_path), 'Bulk density', [-77, -73, 3, 6])
+    assert wcs.requests_count() == 6
+
+
+def test_vrt_places_each_tile_at_its_bounds(tmp_path):
+    paths = [write_tile(str(tmp_path / 'a.tif'), [0, 1, 0, 1], 10),
+             write_tile(str(tmp_path / 'b.tif'), [1, 2, 0, 1], 20),
+             write_tile(str(tmp_path / 'c.tif'), [1, 2, 1, 2], 30)]
+    vrt_path = sgf.write_vrt(paths, str(tmp_path / 'tiles.vrt'))
+
+    with rio.open(vrt_path) as dataset:
+        assert [dataset.width, dataset.height] == [800, 800]
+        values = [float(i[0]) for i in dataset.sample([(0.5, 0.5), (1.5, 0.5), (1.5, 1.5), (0.5, 1.5)])]
+    ## the area without a tile takes the nodata value
+    assert values == [10, 20, 30, -32768]
+
+
+def test_area_above_the_cache_quota_raises_soilgrid_error(wcs, tmp_path, monkeypatch):
+    ## each tile that is added removes the previous ones
+    small_cache = sgc.soilgrid_tile_cache(str(tmp_path / 'small'), max_size_mb=1e-6)
+    monkeypatch.setitem(sgc._cache, 'cache', small_cache)
+
+    try:
+        with pytest.raises(sgf.soilgrid_error, match='cache quota'):
+            sgf.download_soilgrid_data(str(tmp_path), 'Bulk density', [-77, -73, 3, 6])
+    finally:
+        small_cache.close()
+    assert not (tmp_path / 'bdod_0-5cm_mean.vrt').exists()
+
+
+def test_tiles_of_a_vrt_are_kept_while_it_exists(wcs, tile_cache, tmp_path):
+    for folder in ['a', 'b', 'c']:
+        (tmp_path / folder).mkdir()
+    ## one tile for each area
+    first_vrt = sgf.download_soilgrid_data(str(tmp_path / 'a'), 'Bulk density', [-77, -76, 3, 4])
+    first_tile = tile_cache.get('bdod_0-5cm_mean', (-39, 1))
+    tile_cache.max_size_mb = 1.5 * tile_cache.size() / 1024 / 1024
+
+    ## the second tile is above the quota, the tile of the first VRT is not removed
+    second_vrt = sgf.download_soilgrid_data(str(tmp_path / 'b'), 'Bulk density', [-73, -72, 3, 4])
+    assert os.path.exists(first_tile)
+    longitudes, latitudes = [-76.4987], [3.5011]
+    values, inside, _ = sgf.sample_coordinates(first_vrt, longitudes, latitudes)
+    assert inside.all()
+    assert [float(i) for i in values] == pixel_values('bdod_0-5cm_mean', longitudes, latitudes)
+
+    ## a removed VRT releases its tiles
+    os.remove(first_vrt)
+    sgf.download_soilgrid_data(str(tmp_path / 'c'), 'Bulk density', [-71, -70, 3, 4])
+    assert not os.path.exists(first_tile)
+    with rio.open(second_vrt) as dataset:
+        assert dataset.read(1).shape == (dataset.height, dataset.width)
+    assert wcs.requests_count() == 3
+
+
+def pixel_values(coverage, longitudes, latitudes):
+    from stand_in_wcs import pixel_value
+
+    return [float(i) for i in pixel_value(coverage, longitudes, latitudes)]
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import stage_timing as st
+
+
+@st.timed('decorated stage')
+def decorated_stage():
+    return 1
+
+
+@pytest.fixture
+def recorder():
+    recorder = st.enable()
+    yield recorder
+    st.disable()
+
+
+def test_nothing_is_recorded_while_disabled():
+    assert not st.is_enabled()
+    with st.event('event_0'):
+        with st.stage('stage'):
+            assert decorated_stage() == 1
+
+    assert st.collect_records() == []
+    assert st.stage_records().shape[0] == 0
+
+
+def test_stages_are_assigned_to_their_event(recorder):
+    with st.event('event_0'):
+        with st.stage('outer'):
+            with st.stage('inner'):
+                decorated_stage()
+        with st.event('event_1'):
+            decorated_stage()
+        with st.stage('other event', event_id='event_2'):
+            pass
+    decorated_stage()
+
+    records = st.stage_records()
+    assert records[['stage', 'id_event']].fillna('no event').values.tolist() == [
+        ['decorated stage', 'event_0'], ['inner', 'event_0'], ['outer', 'event_0'],
+        ['decorated stage', 'event_1'], ['event', 'event_1'], ['other event', 'event_2'],
+        ['event', 'event_0'], ['decorated stage', 'no event']]
+    ## a stage takes the time of the stages called inside it
+    durations = records.set_index('stage').duration
+    assert durations['outer'] >= durations['inner']
+    assert records.start.min() == 0
+    assert st.stage_stats().loc['decorated stage', 'calls'] == 3
+    assert st.event_stage_times().loc['event_0', 'outer'] == durations['outer']
+
+
+def test_records_of_the_pool_workers_are_joined(recorder, mot_example):
+    general_info, fertilisers = mot_example
+    ghg.ghg_emissions(general_info, fertilisers, n_workers=2, chunksize=2)
+
+    records = st.stage_records()
+    events = records.loc[records.stage == 'event']
+    assert sorted(events.id_event) == sorted(general_info.id_event.unique())
+    assert os.getpid() not in set(events.pid)
+    ## the stages of each event were recorded in the same worker as the event
+    stages = records.loc[records.stage != 'event'].dropna(subset=['id_event'])
+    assert stages.shape[0] > 0
+    assert (stages.pid.values == stages.id_event.map(events.set_index('id_event').pid).values).all()
+
+
+def test_collected_records_leave_the_recorder(recorder):
+    with st.event('event_0'):
+        decorated_stage()
+    records = st.collect_records()
+
+    assert len(records) == 2
+    assert st.collect_records() == []
+    st.add_records(records)
+    assert st.stage_records().shape[0] == 2
+
+
+def test_chrome_trace_is_valid_json(recorder, tmp_path):
+    with st.event('event_0'):
+        decorated_stage()
+    decorated_stage()
+
+    with open(st.write_chrome_trace(str(tmp_path / 'trace.json'))) as trace_file:
+        trace = json.load(trace_file)
+
+    assert trace['displayTimeUnit'] == 'ms'
+    assert [i['name'] for i in trace['traceEvents']] == ['decorated stage', 'event', 'decorated stage']
+    assert [i['args']['id_event'] for i in trace['traceEvents']] == ['event_0', 'event_0', None]
+    for trace_event in trace['traceEvents']:
+        assert trace_event['ph'] == 'X'
+        assert trace_event['ts'] >= 0 and trace_event['dur'] >= 0
+        assert trace_event['pid'] == os.getpid()
+
+
+def test_threads_keep_their_own_event(recorder):
+    started = threading.Barrier(2)
+
+    def thread_stage(event_id):
+        with st.event(event_id):
+            ## both threads are inside their events before either records its stage
+            started.wait()
+            decorated_stage()
+            started.wait()
+
+    with st.event('main event'):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(thread_stage, ['event_0', 'event_1']))
+        decorated_stage()
+
+    records = st.stage_records()
+    stages = records.loc[records.stage == 'decorated stage']
+    assert sorted(stages.id_event) == ['event_0', 'event_1', 'main event']
+    assert stages.groupby('id_event').tid.nunique().max() == 1
+    ## a thread without an event does not take the event of another thread
+    with st.event('main event'):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(decorated_stage).result()
+    assert st.stage_records().id_event.isnull().sum() == 1
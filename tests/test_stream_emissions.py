@@ -0,0 +1,139 @@
+import os
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import emissions_cli as cli
+from scripts import stream_emissions as se
+
+
+def write_inputs(tables, folder, fileformat):
+    """general information and fertiliser files of the example tables"""
+    paths = []
+    for table, name in zip(tables, ['inputs', 'fertiliser_inputs']):
+        path = str(folder / '{}.{}'.format(name, fileformat))
+        if fileformat == 'csv':
+            table.to_csv(path, index=False)
+        else:
+            table.to_parquet(path, index=False)
+        paths.append(path)
+
+    return paths
+
+
+def expected_summary(tables, partition_columns=()):
+    summary = ghg.ghg_emissions(*tables).emissions_summary
+    if len(partition_columns) > 0:
+        events = tables[0].drop_duplicates('id_event').set_index('id_event')
+        for column in partition_columns:
+            summary[column] = events[column].reindex(summary.id_event.values).values
+
+    return se.summary_frame(summary, partition_columns).reset_index(drop=True)
+
+
+def assert_same_rows(written, expected):
+    written = written[list(expected.columns)].sort_values('id_event').reset_index(drop=True)
+    expected = expected.sort_values('id_event').reset_index(drop=True)
+    pd.testing.assert_frame_equal(written, expected, check_dtype=False)
+
+
+@pytest.fixture(params=['mot_example', 'example2'])
+def example(request):
+    return request.getfixturevalue(request.param)
+
+
+@pytest.mark.parametrize('input_format', ['csv', 'parquet'])
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_written_summary_reads_back(example, tmp_path, input_format, output_format):
+    paths = write_inputs(example, tmp_path, input_format)
+    output_path = str(tmp_path / 'emissions.{}'.format(output_format))
+
+    ## chunks of a few events, the fertiliser rows of an event can be in another chunk
+    nevents = se.write_emissions(*paths, output_path, chunksize=3)
+
+    assert nevents == example[0].id_event.nunique()
+    if output_format == 'csv':
+        written = pd.read_csv(output_path)
+        assert list(written.columns) == se.SUMMARY_COLUMNS
+    else:
+        written = se.read_emissions(output_path).to_pandas()
+    assert_same_rows(written, expected_summary(example))
+
+
+def test_partitioned_summary_reads_back(example, tmp_path):
+    paths = write_inputs(example, tmp_path, 'csv')
+    output_path = str(tmp_path / 'emissions_dataset')
+
+    se.write_emissions(*paths, output_path, chunksize=3, partition_columns=['crop'])
+
+    crops = example[0].crop.unique()
+    ## the folder names are percent encoded, the values are read back decoded
+    folders = ['crop={}'.format(urllib.parse.quote(i, safe='')) for i in crops]
+    assert sorted(os.listdir(output_path)) == sorted(folders)
+    expected = expected_summary(example, ['crop'])
+    assert_same_rows(se.read_emissions(output_path, ['crop']).to_pandas(), expected)
+
+    crop = crops[0]
+    filtered = se.read_emissions(output_path, ['crop'], filters=ds.field('crop') == crop).to_pandas()
+    assert_same_rows(filtered, expected.loc[expected.crop == crop])
+
+
+def test_streamed_chunks_give_the_serial_summary(mot_example, tmp_path):
+    paths = write_inputs(mot_example, tmp_path, 'parquet')
+    expected = expected_summary(mot_example)
+
+    for options in [{}, {'vectorized': True}, {'n_workers': 2}]:
+        summaries = [chunk[0] for chunk in se.stream_emissions(*paths, chunksize=3, **options)]
+        assert len(summaries) == int(np.ceil(mot_example[0].shape[0] / 3))
+        assert_same_rows(se.summary_frame(pd.concat(summaries)), expected)
+
+
+def test_arrow_table_keeps_the_summary(mot_example):
+    summary = ghg.ghg_emissions(*mot_example).emissions_summary
+    table = se.emissions_table(summary)
+
+    assert table.schema.field('Fertiliser production').type == 'double'
+    assert_same_rows(table.to_pandas(), se.summary_frame(summary).reset_index(drop=True))
+
+
+@pytest.mark.parametrize('output', [['emissions.csv'], ['emissions.parquet'],
+                                    ['emissions_dataset', '--partition-by', 'crop']],
+                         ids=['csv', 'parquet', 'partitioned'])
+def test_cli_run_reads_back(mot_example, tmp_path, capsys, output):
+    paths = write_inputs(mot_example, tmp_path, 'csv')
+    output_path = str(tmp_path / output[0])
+
+    status = cli.main(['run', '--general', paths[0], '--fertiliser', paths[1], '--out', output_path,
+                       '--workers', '2', '--chunksize', '3', '--quiet'] + output[1:])
+
+    assert status == 0
+    assert capsys.readouterr().out == "{} events written to {}\n".format(mot_example[0].id_event.nunique(),
+                                                                        output_path)
+    if output_path.endswith('.csv'):
+        written = pd.read_csv(output_path)
+    else:
+        written = se.read_emissions(output_path, output[2:] or None).to_pandas()
+    assert_same_rows(written, expected_summary(mot_example, output[2:]))
+
+
+def test_cli_refuses_missing_inputs(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        cli.main(['run', '--general', str(tmp_path / 'missing.csv'), '--fertiliser', str(tmp_path / 'missing.csv'),
+                  '--out', str(tmp_path / 'emissions.csv')])
+
+    assert 'does not exist' in capsys.readouterr().err
+
+
+def test_cli_refuses_partitioned_csv(mot_example, tmp_path, capsys):
+    paths = write_inputs(mot_example, tmp_path, 'csv')
+
+    with pytest.raises(SystemExit):
+        cli.main(['run', '--general', paths[0], '--fertiliser', paths[1], '--out', str(tmp_path / 'emissions'),
+                  '--format', 'csv', '--partition-by', 'crop'])
+
+    assert '--format csv' in capsys.readouterr().err
+    assert not (tmp_path / 'emissions').exists()
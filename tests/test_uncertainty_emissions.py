@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import crop_ghg_emissions as ghg
+from scripts import uncertainty_emissions as ue
+
+
+def component_table(uncertainty, column):
+    """events by components table of a statistic"""
+    return uncertainty.pivot(index='id_event', columns='component', values=column)
+
+
+@pytest.fixture(scope='module')
+def no_uncertainty():
+    return {name: 0 for name in ue.DEFAULT_UNCERTAINTY}
+
+
+def test_draws_without_uncertainty_give_the_engine_results(mot_example, no_uncertainty):
+    general_info, fertilisers = mot_example
+    summary = ghg.ghg_emissions(general_info, fertilisers).emissions_summary.set_index('id_event')
+    median = component_table(ue.monte_carlo_emissions(general_info, fertilisers, n_draws=20, seed=0,
+                                                      uncertainty=no_uncertainty), 'p50')
+
+    for component in summary.columns.drop('municipality'):
+        ## the engine rounds some of the components to two decimals
+        np.testing.assert_allclose(median.loc[summary.index, component].values,
+                                   summary[component].values.astype(float), atol=0.01, err_msg=component)
+
+    ## the same total as the engine, without soil mining nor methane from rice
+    engine_total = summary[ue.TOTAL_COMPONENTS].astype(float).sum(axis=1)
+    assert engine_total.ne(summary.drop(columns='municipality').astype(float).sum(axis=1)).any()
+    np.testing.assert_allclose(median.loc[summary.index, 'Total'].values, engine_total.values, atol=0.05)
+
+
+def test_draws_widen_the_percentiles(mot_example, no_uncertainty):
+    general_info, fertilisers = mot_example
+    fixed = ue.monte_carlo_emissions(general_info, fertilisers, n_draws=500, seed=0, uncertainty=no_uncertainty)
+    drawn = ue.monte_carlo_emissions(general_info, fertilisers, n_draws=500, seed=0,
+                                     uncertainty={'fertiliser_amount': 0.2})
+
+    fixed, drawn = [i.loc[i.component == 'Fertiliser production'].set_index('id_event') for i in [fixed, drawn]]
+    with_fertilisers = fixed.p50 > 0
+    assert with_fertilisers.any()
+    assert ((fixed['p97.5'] - fixed['p2.5']) == 0).all()
+    assert ((drawn['p97.5'] - drawn['p2.5'])[with_fertilisers] > 0).all()
+    ## the amounts are scaled around one, the median stays close to the value without draws
+    np.testing.assert_allclose(drawn.p50, fixed.p50, rtol=0.05)
+
+
+def test_seeded_draws_are_reproducible(mot_example):
+    general_info, fertilisers = mot_example
+    first = ue.monte_carlo_emissions(general_info, fertilisers, n_draws=50, seed=3, events_per_block=3)
+    second = ue.monte_carlo_emissions(general_info, fertilisers, n_draws=50, seed=3, events_per_block=3)
+    other_seed = ue.monte_carlo_emissions(general_info, fertilisers, n_draws=50, seed=4, events_per_block=3)
+
+    pd.testing.assert_frame_equal(first, second)
+    assert not first.equals(other_seed)
+    assert first.columns.tolist() == ['id_event', 'municipality', 'component', 'mean', 'p2.5', 'p50', 'p97.5']